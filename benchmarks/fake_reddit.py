@@ -0,0 +1,115 @@
+"""
+Fake, deterministic stand-in for the parts of Async PRAW used by
+reddit_search: `await reddit.subreddit(name)`, `subreddit.search(...)`,
+`reddit.subreddits.search(...)` and `reddit.close()`.
+
+Every search returns the same posts for the same subreddit, query and seed,
+newest first, in pages of `REDDIT_PAGE_SIZE` results with a configurable
+delay before each page.
+"""
+
+import asyncio
+import random
+import time
+import zlib
+from typing import AsyncIterator, List, Optional
+from reddit_search import REDDIT_PAGE_SIZE
+
+_WORDS = """
+python rust javascript async await database index cache query latency
+throughput memory thread process queue worker server client request
+response api token model prompt video tutorial guide beginner question
+help error bug fix deploy docker kubernetes cloud storage network socket
+performance benchmark profile optimize compile build test debug release
+learn project career interview code review design pattern library
+framework package install update version feature issue discussion
+""".split()
+
+class FakeSubmission:
+    """The attributes of an Async PRAW submission that reddit_search reads."""
+
+    def __init__(self, post_id: str, title: str, selftext: str,
+                 num_comments: int, created_utc: float):
+        self.id = post_id
+        self.fullname = f"t3_{post_id}"
+        self.title = title
+        self.selftext = selftext
+        self.url = f"https://www.reddit.com/comments/{post_id}/"
+        self.num_comments = num_comments
+        self.created_utc = created_utc
+
+class FakeSubredditResult:
+    def __init__(self, display_name: str):
+        self.display_name = display_name
+
+class FakeSubreddit:
+    def __init__(self, reddit: "FakeReddit", name: str):
+        self._reddit = reddit
+        self.display_name = name
+
+    def search(self, query: str, sort: Optional[str] = None,
+               time_filter: Optional[str] = None,
+               limit: Optional[int] = 100) -> AsyncIterator[FakeSubmission]:
+        return self._reddit._search(self.display_name, query, limit or 100)
+
+class FakeSubreddits:
+    def __init__(self, reddit: "FakeReddit"):
+        self._reddit = reddit
+
+    async def search(self, query: str, limit: int = 5) -> AsyncIterator[FakeSubredditResult]:
+        await asyncio.sleep(self._reddit.page_latency)
+        for index in range(limit):
+            yield FakeSubredditResult(f"{query.replace(' ', '')}{index}")
+
+class FakeReddit:
+    """Deterministic Reddit search source."""
+
+    def __init__(self, page_latency: float = 0.05, overlap: float = 0.1,
+                 shared_posts: int = 1000, seed: int = 0,
+                 now: Optional[float] = None):
+        """
+        :param page_latency: Delay before each page of results, in seconds.
+        :param overlap: Fraction of the results drawn from a pool of posts
+            shared by every query, to exercise deduplication.
+        :param shared_posts: Size of the shared pool.
+        :param seed: Seed of the generated posts.
+        :param now: Reference time of the post dates, defaults to now.
+        """
+        self.page_latency = page_latency
+        self.overlap = overlap
+        self.shared_posts = shared_posts
+        self.seed = seed
+        self.now = now if now is not None else time.time()
+        self.subreddits = FakeSubreddits(self)
+        # Duration of each complete listing, in seconds
+        self.listing_seconds: List[float] = []
+
+    async def subreddit(self, name: str) -> FakeSubreddit:
+        return FakeSubreddit(self, name)
+
+    async def close(self) -> None:
+        pass
+
+    def _post(self, post_id: str, rank: int) -> FakeSubmission:
+        rng = random.Random(zlib.crc32(f"{self.seed}:{post_id}".encode()))
+        title = " ".join(rng.choices(_WORDS, k=rng.randint(4, 12)))
+        selftext = " ".join(rng.choices(_WORDS, k=rng.randint(20, 120)))
+        # Spread over the last 60 days, newest first within a listing
+        created_utc = self.now - rank * 60 - rng.uniform(0, 60)
+        return FakeSubmission(post_id, f"{title} [{post_id}]", selftext,
+                              rng.randint(0, 30), created_utc)
+
+    async def _search(self, subreddit: str, query: str,
+                      limit: int) -> AsyncIterator[FakeSubmission]:
+        start = time.perf_counter()
+        rng = random.Random(zlib.crc32(f"{self.seed}:{subreddit}:{query}".encode()))
+        prefix = f"{zlib.crc32(f'{subreddit}:{query}'.encode()):x}"
+        for index in range(limit):
+            if index % REDDIT_PAGE_SIZE == 0:
+                await asyncio.sleep(self.page_latency)
+            if rng.random() < self.overlap:
+                post_id = f"s{rng.randrange(self.shared_posts)}"
+            else:
+                post_id = f"{prefix}{index}"
+            yield self._post(post_id, index)
+        self.listing_seconds.append(time.perf_counter() - start)
@@ -0,0 +1,207 @@
+"""
+Mock OpenAI-compatible chat completions server.
+
+Runs in a separate process so the benchmarked client does not share its
+CPU time, and answers with configurable latency, error rate and rate
+limits. Relevance prompts are answered deterministically from the post
+title, so every run classifies the same posts as relevant. Streamed
+requests are answered with server-sent events, a few characters per chunk.
+
+Can also be started on its own:
+
+    python -m benchmarks.mock_openai --port 8765 --latency-ms 200
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import re
+import socket
+import time
+import zlib
+from collections import deque
+from typing import Deque, List, NamedTuple, Optional
+
+_BATCH_POST_PATTERN = re.compile(r'<post id="([^"]+)">\nPost Title: (.*)')
+_POST_TITLE_PATTERN = re.compile(r"Post Title: (.*)")
+# Characters of the answer per streamed chunk
+_STREAM_CHUNK_SIZE = 8
+
+class MockSettings(NamedTuple):
+    """Behaviour of the mock server."""
+    # Mean response time, and the spread around it as a fraction of the mean
+    latency: float = 0.05
+    jitter: float = 0.5
+    # Fraction of requests failing with a 500 error
+    error_rate: float = 0.0
+    # 429 errors beyond these limits, if given
+    requests_per_minute: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    # Percentage of posts classified as relevant
+    relevant_percent: int = 20
+    seed: int = 0
+
+def is_relevant(title: str, relevant_percent: int) -> bool:
+    """The mock's verdict for a post, from a hash of its title."""
+    return zlib.crc32(title.encode()) % 100 < relevant_percent
+
+def _answer(prompt: str, settings: MockSettings) -> str:
+    """Answer a prompt, recognized from its instructions or JSON format."""
+    if "relevant_ids" in prompt:
+        verdicts = {"relevant_ids": [], "not_relevant_ids": []}
+        for post_id, title in _BATCH_POST_PATTERN.findall(prompt):
+            relevant = is_relevant(title, settings.relevant_percent)
+            verdicts["relevant_ids" if relevant else "not_relevant_ids"].append(post_id)
+        return json.dumps(verdicts)
+    if '"relevant": true or false' in prompt:
+        match = _POST_TITLE_PATTERN.search(prompt)
+        relevant = match is not None and is_relevant(match.group(1), settings.relevant_percent)
+        return json.dumps({"relevant": relevant})
+    if '"keywords"' in prompt:
+        return json.dumps({"keywords": ["benchmark", "mock"]})
+    return ("I made a short video about exactly this and thought it might help:"
+            " https://www.youtube.com/watch?v=benchmark")
+
+def _run_server(port: int, settings: MockSettings) -> None:
+    from aiohttp import web
+
+    rng = random.Random(settings.seed)
+    request_times: Deque[float] = deque()
+    in_flight = 0
+
+    def error(status: int, message: str, headers: Optional[dict] = None):
+        return web.json_response({"error": {"message": message, "type": "mock"}},
+                                 status=status, headers=headers)
+
+    async def completions(request: web.Request) -> web.Response:
+        nonlocal in_flight
+        body = await request.json()
+        now = time.monotonic()
+        while request_times and request_times[0] <= now - 60:
+            request_times.popleft()
+
+        if (settings.requests_per_minute is not None
+                and len(request_times) >= settings.requests_per_minute):
+            retry_after = request_times[0] + 60 - now
+            return error(429, "Rate limit reached for requests",
+                         {"retry-after-ms": str(int(retry_after * 1000))})
+        if settings.max_concurrency is not None and in_flight >= settings.max_concurrency:
+            return error(429, "Too many concurrent requests", {"retry-after-ms": "100"})
+        request_times.append(now)
+
+        in_flight += 1
+        try:
+            spread = settings.latency * settings.jitter
+            await asyncio.sleep(max(0.0, rng.uniform(settings.latency - spread,
+                                                     settings.latency + spread)))
+        finally:
+            in_flight -= 1
+        if rng.random() < settings.error_rate:
+            return error(500, "Mock server error")
+
+        prompt = "\n".join(message["content"] for message in body["messages"])
+        content = _answer(prompt, settings)
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        headers = {}
+        if settings.requests_per_minute is not None:
+            headers = {"x-ratelimit-limit-requests": str(settings.requests_per_minute),
+                       "x-ratelimit-remaining-requests":
+                           str(settings.requests_per_minute - len(request_times)),
+                       "x-ratelimit-reset-requests": "60s"}
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if body.get("stream"):
+            return await stream(request, body, content, usage, headers)
+        return web.json_response({
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        }, headers=headers)
+
+    async def stream(request: web.Request, body: dict, content: str, usage: dict,
+                     headers: dict) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"content-type": "text/event-stream", **headers})
+        await response.prepare(request)
+
+        def chunk(choices: List[dict], chunk_usage: Optional[dict] = None) -> bytes:
+            data = {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": body["model"],
+                    "choices": choices, "usage": chunk_usage}
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        try:
+            for start in range(0, len(content), _STREAM_CHUNK_SIZE):
+                await response.write(chunk([{"index": 0, "finish_reason": None, "delta": {
+                    "content": content[start:start + _STREAM_CHUNK_SIZE]}}]))
+            await response.write(chunk([{"index": 0, "finish_reason": "stop", "delta": {}}]))
+            if body.get("stream_options", {}).get("include_usage"):
+                await response.write(chunk([], usage))
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            # The client stopped reading once it had what it needed
+            pass
+        return response
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.add_routes([web.post("/v1/chat/completions", completions)])
+    web.run_app(app, host="127.0.0.1", port=port, print=None, handle_signals=False)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class MockOpenAIServer:
+    """Context manager running the mock server in a child process."""
+
+    def __init__(self, settings: MockSettings = MockSettings(),
+                 port: Optional[int] = None):
+        """
+        :param settings: Behaviour of the server.
+        :param port: Port to listen on, defaults to a free port.
+        """
+        self.settings = settings
+        self.port = port or _free_port()
+        self._process: Optional[multiprocessing.Process] = None
+
+    @property
+    def base_url(self) -> str:
+        """The value to use as OPENAI_BASE_URL."""
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def __enter__(self) -> "MockOpenAIServer":
+        self._process = multiprocessing.Process(
+            target=_run_server, args=(self.port, self.settings), daemon=True)
+        self._process.start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.1).close()
+                return self
+            except OSError:
+                if time.monotonic() > deadline or not self._process.is_alive():
+                    self._process.terminate()
+                    raise RuntimeError("The mock OpenAI server did not start.")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc_info) -> None:
+        self._process.terminate()
+        self._process.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI server.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=None)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    args = parser.parse_args()
+    _run_server(args.port, MockSettings(latency=args.latency_ms / 1000,
+                                        error_rate=args.error_rate,
+                                        requests_per_minute=args.rpm,
+                                        max_concurrency=args.max_concurrency))
@@ -0,0 +1,402 @@
+"""
+Offline benchmarks of the outreach pipeline.
+
+Runs each stage, and the streaming pipeline end to end, against the fake
+Reddit source and the mock OpenAI server, and reports throughput, p50/p99
+latency and memory growth. Results are appended to
+`benchmarks/results/results.jsonl` with the current commit, so a change can
+be compared with earlier commits:
+
+    python -m benchmarks.run --scenario 1k
+    python -m benchmarks.run --scenario 1k --compare HEAD~1
+
+Nothing is sent to Reddit or OpenAI, and every cache is created in a
+temporary directory.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks.mock_openai import MockOpenAIServer, MockSettings
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(REPO_DIR, "benchmarks", "results", "results.jsonl")
+# Changes beyond this fraction are flagged by --compare
+REGRESSION_THRESHOLD = 0.10
+
+VIDEO_URL = "https://www.youtube.com/watch?v=benchmark"
+VIDEO_TITLE = "Speeding up Python async database access with a query cache"
+VIDEO_DESCRIPTION = ("How to profile async Python code, find the slow database"
+                     " queries and cache them, with benchmarks before and after.")
+
+class Scenario(NamedTuple):
+    """Size and settings of a benchmark run."""
+    name: str
+    keywords: int
+    posts_per_keyword: int
+    # Classify several posts per relevance request
+    batched: bool
+    max_concurrent_requests: int
+
+SCENARIOS = {
+    "10": Scenario("10", keywords=2, posts_per_keyword=5, batched=False,
+                   max_concurrent_requests=10),
+    "1k": Scenario("1k", keywords=10, posts_per_keyword=100, batched=False,
+                   max_concurrent_requests=20),
+    "50k": Scenario("50k", keywords=50, posts_per_keyword=1000, batched=True,
+                    max_concurrent_requests=50),
+}
+
+class StageResult(NamedTuple):
+    """Measurements of one stage."""
+    operations: int
+    seconds: float
+    throughput: float
+    p50: Optional[float]
+    p99: Optional[float]
+    # Growth of the resident set size during the stage, if measurable
+    peak_memory_mb: Optional[float]
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    :param values: The samples.
+    :param q: The percentile, between 0 and 100.
+    :return: The nearest-rank percentile, or None without samples.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def _current_rss() -> Optional[int]:
+    """The resident set size of the process in bytes, where /proc is available."""
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class MemorySampler:
+    """
+    Samples the resident set size from a thread while a stage runs. Unlike
+    tracemalloc, this does not slow the stage down.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.baseline = _current_rss()
+        self.peak = self.baseline
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, _current_rss() or 0)
+
+    def __enter__(self) -> "MemorySampler":
+        if self.baseline is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.baseline is not None:
+            self._stopped.set()
+            self._thread.join()
+            self.peak = max(self.peak, _current_rss() or 0)
+
+    @property
+    def peak_growth_mb(self) -> Optional[float]:
+        if self.baseline is None:
+            return None
+        return (self.peak - self.baseline) / 1024 / 1024
+
+async def measure(stage: Callable[[List[float]], Awaitable[int]]) -> StageResult:
+    """
+    Run a stage, sampling its memory use.
+
+    :param stage: Coroutine function appending the latency of each operation
+        to the given list, and returning the number of operations.
+    :return: The measurements.
+    """
+    latencies: List[float] = []
+    gc.collect()
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        operations = await stage(latencies)
+        seconds = time.perf_counter() - start
+    return StageResult(operations, seconds, operations / seconds if seconds else 0.0,
+                       percentile(latencies, 50), percentile(latencies, 99),
+                       memory.peak_growth_mb)
+
+async def run_scenario(scenario: Scenario, page_latency: float) -> Dict[str, StageResult]:
+    """
+    Benchmark every stage of a scenario. OPENAI_BASE_URL must point at the
+    mock server.
+
+    :param scenario: The scenario.
+    :param page_latency: Delay of each fake Reddit page, in seconds.
+    :return: The measurements, by stage name.
+    """
+    # Imported here, once the environment points the client at the mock
+    import post_analysis
+    from benchmarks.fake_reddit import FakeReddit
+    from cache_utils import CacheStore
+    from llm_utils import get_client, set_max_concurrent_requests
+    from outreach import filter_posts
+    from pipeline import stream_outreach
+    from post_clustering import cluster_posts_sync
+    from post_ranking import rank_posts_sync
+    from post_store import with_bodies
+    from reddit_search import iter_posts, search_posts
+
+    set_max_concurrent_requests(scenario.max_concurrent_requests)
+    # Created up front, so loading the SDK is not timed as part of a stage
+    get_client()
+    keywords = [f"keyword {index}" for index in range(scenario.keywords)]
+    results: Dict[str, StageResult] = {}
+    posts = []
+    filtered = []
+    relevant = []
+
+    # Time each completion as seen by the analysis functions
+    request_completion = post_analysis.request_completion
+    request_json = post_analysis.request_json
+    llm_latencies: List[float] = []
+
+    def timed(request):
+        async def timed_request(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await request(*args, **kwargs)
+            finally:
+                llm_latencies.append(time.perf_counter() - start)
+        return timed_request
+
+    post_analysis.request_completion = timed(request_completion)
+    post_analysis.request_json = timed(request_json)
+
+    async def search(latencies: List[float]) -> int:
+        nonlocal posts
+        reddit = FakeReddit(page_latency=page_latency)
+        posts = await search_posts(reddit, keywords,
+                                   limit_per_keyword=scenario.posts_per_keyword)
+        latencies.extend(reddit.listing_seconds)
+        return len(posts)
+
+    async def filter_stage(latencies: List[float]) -> int:
+        nonlocal filtered
+        filtered = filter_posts(posts)
+        return len(posts)
+
+    async def rank(latencies: List[float]) -> int:
+        rank_posts_sync(filtered, VIDEO_TITLE, VIDEO_DESCRIPTION, "bm25")
+        return len(filtered)
+
+    async def cluster(latencies: List[float]) -> int:
+        cluster_posts_sync(with_bodies(filtered))
+        return len(filtered)
+
+    async def relevance(latencies: List[float]) -> int:
+        nonlocal relevant
+        llm_latencies.clear()
+        relevant = await post_analysis.analyze_posts(filtered, VIDEO_TITLE, VIDEO_DESCRIPTION,
+                                                     batched=scenario.batched)
+        latencies.extend(llm_latencies)
+        return len(filtered)
+
+    async def comments(latencies: List[float]) -> int:
+        llm_latencies.clear()
+        generated = await post_analysis.generate_engagement_content(
+            VIDEO_URL, VIDEO_TITLE, relevant)
+        latencies.extend(llm_latencies)
+        return len(generated)
+
+    async def step_cache(latencies: List[float]) -> int:
+        store = CacheStore(path=os.path.join("cache", "benchmark_steps.sqlite3"),
+                           legacy_dir=None)
+        videos = [f"video{index}" for index in range(20)]
+        for video_hash in videos:
+            start = time.perf_counter()
+            await store.set(video_hash, "filtered_posts", filtered)
+            latencies.append(time.perf_counter() - start)
+        for video_hash in videos:
+            start = time.perf_counter()
+            await store.get(video_hash, "filtered_posts")
+            latencies.append(time.perf_counter() - start)
+        return 2 * len(videos)
+
+    async def end_to_end(latencies: List[float]) -> int:
+        # Time to each result, from the start of the run
+        reddit = FakeReddit(page_latency=page_latency, seed=1)
+        start = time.perf_counter()
+        count = 0
+        async for _ in stream_outreach(
+                iter_posts(reddit, keywords, limit_per_keyword=scenario.posts_per_keyword),
+                VIDEO_URL, VIDEO_TITLE, VIDEO_DESCRIPTION, filter_posts,
+                concurrency=scenario.max_concurrent_requests):
+            latencies.append(time.perf_counter() - start)
+            count += 1
+        return count
+
+    try:
+        for name, stage in [("search", search), ("filter", filter_stage),
+                            ("rank_bm25", rank), ("cluster", cluster),
+                            ("relevance", relevance),
+                            ("comments", comments), ("step_cache", step_cache),
+                            ("end_to_end", end_to_end)]:
+            results[name] = await measure(stage)
+            print_result(name, results[name])
+    finally:
+        post_analysis.request_completion = request_completion
+        post_analysis.request_json = request_json
+    return results
+
+async def run_scenarios(scenarios: List[Scenario],
+                        page_latency: float) -> List[Dict[str, StageResult]]:
+    """Benchmark several scenarios in turn."""
+    all_results = []
+    for scenario in scenarios:
+        print(f"\nScenario {scenario.name}: {scenario.keywords} keywords"
+              f" x {scenario.posts_per_keyword} posts")
+        all_results.append(await run_scenario(scenario, page_latency))
+    return all_results
+
+def _format_seconds(value: Optional[float]) -> str:
+    return f"{value * 1000:9.1f}ms" if value is not None else f"{'-':>11}"
+
+def _format_memory(value: Optional[float]) -> str:
+    return f"+{value:.1f} MB" if value is not None else "-"
+
+def print_result(name: str, result: StageResult) -> None:
+    print(f"{name:<12} {result.operations:>7} ops {result.seconds:8.2f}s"
+          f" {result.throughput:10.1f}/s  p50 {_format_seconds(result.p50)}"
+          f"  p99 {_format_seconds(result.p99)}  memory {_format_memory(result.peak_memory_mb)}")
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def save_results(scenario: Scenario, settings: MockSettings, page_latency: float,
+                 results: Dict[str, StageResult]) -> None:
+    """Append the results of a run to the results file."""
+    record = {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "scenario": scenario.name,
+        "settings": {**settings._asdict(), "page_latency": page_latency},
+        "stages": {name: result._asdict() for name, result in results.items()},
+    }
+    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+    with open(RESULTS_PATH, "a", encoding="utf-8") as file:
+        file.write(json.dumps(record) + "\n")
+
+def load_baseline(scenario: str, commit: str) -> Optional[dict]:
+    """
+    :param scenario: The scenario name.
+    :param commit: A git revision, resolved to its short hash.
+    :return: The latest stored clean run of the scenario at that commit.
+    """
+    short_hash = _git("rev-parse", "--short", commit) or commit
+    if not os.path.exists(RESULTS_PATH):
+        return None
+    baseline = None
+    with open(RESULTS_PATH, "r", encoding="utf-8") as file:
+        for line in file:
+            record = json.loads(line)
+            if (record["scenario"] == scenario and record["commit"] == short_hash
+                    and not record["dirty"]):
+                baseline = record
+    return baseline
+
+def compare(baseline: dict, results: Dict[str, StageResult]) -> bool:
+    """
+    Print the change of each stage against a baseline run.
+
+    :return: True if a stage's throughput or p99 latency regressed by more
+        than `REGRESSION_THRESHOLD`.
+    """
+    print(f"\nCompared with {baseline['commit']}:")
+    regressed = False
+    for name, result in results.items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            continue
+        changes = []
+        if before["throughput"]:
+            change = result.throughput / before["throughput"] - 1
+            changes.append(f"throughput {change:+.0%}")
+            regressed |= change < -REGRESSION_THRESHOLD
+        if before["p99"] and result.p99 is not None:
+            change = result.p99 / before["p99"] - 1
+            changes.append(f"p99 {change:+.0%}")
+            regressed |= change > REGRESSION_THRESHOLD
+        if before["peak_memory_mb"] and result.peak_memory_mb is not None:
+            change = result.peak_memory_mb / before["peak_memory_mb"] - 1
+            changes.append(f"memory {change:+.0%}")
+        print(f"{name:<12} {', '.join(changes)}")
+    return regressed
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks.")
+    parser.add_argument("--scenario", choices=[*SCENARIOS, "all"], default="1k")
+    parser.add_argument("--llm-latency-ms", type=float, default=50,
+                        help="Mean latency of the mock OpenAI server")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of mock requests failing with a 500 error")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="Requests per minute allowed by the mock server")
+    parser.add_argument("--server-concurrency", type=int, default=None,
+                        help="Concurrent requests allowed by the mock server")
+    parser.add_argument("--page-latency-ms", type=float, default=50,
+                        help="Latency of each fake Reddit page")
+    parser.add_argument("--compare", metavar="COMMIT", default=None,
+                        help="Compare with the stored results of a commit")
+    parser.add_argument("--no-save", action="store_true",
+                        help="Do not store the results")
+    args = parser.parse_args()
+
+    settings = MockSettings(latency=args.llm_latency_ms / 1000,
+                            error_rate=args.error_rate,
+                            requests_per_minute=args.rpm,
+                            max_concurrency=args.server_concurrency)
+    page_latency = args.page_latency_ms / 1000
+    scenarios = list(SCENARIOS.values()) if args.scenario == "all" else [SCENARIOS[args.scenario]]
+
+    regressed = False
+    with MockOpenAIServer(settings) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        os.environ["LLM_CACHE"] = "0"
+        # Keep every cache out of the working tree
+        os.chdir(tempfile.mkdtemp(prefix="outreach-benchmark-"))
+        # One event loop for every scenario, as the LLM client is shared
+        all_results = asyncio.run(run_scenarios(scenarios, page_latency))
+        for scenario, results in zip(scenarios, all_results):
+            if args.compare:
+                baseline = load_baseline(scenario.name, args.compare)
+                if baseline is None:
+                    print(f"\nNo stored results of {args.compare} for this scenario.")
+                else:
+                    regressed |= compare(baseline, results)
+            if not args.no_save:
+                save_results(scenario, settings, page_latency, results)
+    sys.exit(1 if regressed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,298 @@
+"""
+Cache of intermediate pipeline results, indexed by video and step.
+
+Results are pickled into a SQLite database with one row per
+(video_hash, step), so the cache can be queried, shared between processes
+and pruned by size or age. Run `python cache_utils.py --help` to inspect
+and prune entries, or to migrate the old `cache/<video_hash>/<step>.pkl`
+files.
+"""
+
+import argparse
+import asyncio
 import hashlib
 import os
 import pickle
-from typing import Callable, Any, Coroutine, Optional
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Any, Coroutine, Iterator, List, NamedTuple, Optional, Tuple
 from functools import wraps
+from metrics import get_metrics
 
 # Constants
 CACHE_DIR = "cache"
+CACHE_DB_PATH = os.path.join(CACHE_DIR, "steps.sqlite3")
+# How long to wait for another process holding the database lock, in seconds
+LOCK_TIMEOUT = 30
+
+@contextmanager
+def open_database(path: str) -> Iterator[sqlite3.Connection]:
+    """
+    Open a SQLite database shared between processes, committing on success
+    and always closing the connection.
+
+    :param path: Path to the database file. Its directory is created if needed.
+    :return: A context manager yielding the connection.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            yield connection
+    finally:
+        connection.close()
 
 def get_video_hash(video_url: str) -> str:
     """Generate a unique hash for the video URL."""
     return hashlib.md5(video_url.encode()).hexdigest()
 
+class CacheEntry(NamedTuple):
+    video_hash: str
+    step: str
+    size: int
+    created_at: float
+    accessed_at: float
+
+class CacheStore:
+    """
+    SQLite store of pickled step results, keyed on (video_hash, step).
+
+    Entries older than `max_age` are treated as missing, and the least
+    recently used entries are evicted once the store is over `max_size`.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH,
+                 max_size: Optional[int] = None,
+                 max_age: Optional[float] = None,
+                 legacy_dir: Optional[str] = CACHE_DIR):
+        """
+        :param path: Path to the SQLite database file.
+        :param max_size: Maximum total size of the entries in bytes, or None.
+        :param max_age: Maximum age of an entry in seconds, or None.
+        :param legacy_dir: Directory of old pickle files imported on a miss,
+            or None to ignore them.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.legacy_dir = legacy_dir
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with open_database(self.path) as connection:
+            if not self._initialized:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS steps ("
+                    " video_hash TEXT NOT NULL,"
+                    " step TEXT NOT NULL,"
+                    " value BLOB NOT NULL,"
+                    " size INTEGER NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " accessed_at REAL NOT NULL,"
+                    " PRIMARY KEY (video_hash, step))")
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS steps_step ON steps (step)")
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS steps_accessed_at"
+                    " ON steps (accessed_at)")
+                self._initialized = True
+            yield connection
+
+    def get_sync(self, video_hash: str, step: str) -> Tuple[bool, Any]:
+        """
+        Look up a cached step result.
+
+        :param video_hash: The video hash.
+        :param step: The step name.
+        :return: A (found, value) tuple.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT value, created_at FROM steps"
+                " WHERE video_hash = ? AND step = ?",
+                (video_hash, step)).fetchone()
+            if row is not None:
+                value, created_at = row
+                if self.max_age is None or now - created_at <= self.max_age:
+                    connection.execute(
+                        "UPDATE steps SET accessed_at = ?"
+                        " WHERE video_hash = ? AND step = ?",
+                        (now, video_hash, step))
+                    return True, pickle.loads(value)
+                connection.execute(
+                    "DELETE FROM steps WHERE video_hash = ? AND step = ?",
+                    (video_hash, step))
+
+        return self._import_legacy(video_hash, step)
+
+    def set_sync(self, video_hash: str, step: str, value: Any) -> None:
+        """
+        Store a step result, evicting old entries if over the size limit.
+
+        :param video_hash: The video hash.
+        :param step: The step name.
+        :param value: The picklable result.
+        """
+        data = pickle.dumps(value)
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO steps"
+                " (video_hash, step, value, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (video_hash, step, data, len(data), now, now))
+        if self.max_size is not None:
+            self.prune_sync(max_size=self.max_size)
+
+    def delete_sync(self, video_hash: Optional[str] = None,
+                    step: Optional[str] = None) -> int:
+        """
+        Delete the entries matching a video hash and/or step.
+
+        :param video_hash: Only delete entries of this video, if given.
+        :param step: Only delete entries of this step, if given.
+        :return: The number of deleted entries.
+        """
+        query, params = self._where(video_hash, step)
+        with self._connect() as connection:
+            return connection.execute(f"DELETE FROM steps{query}", params).rowcount
+
+    def list_sync(self, video_hash: Optional[str] = None,
+                  step: Optional[str] = None) -> List[CacheEntry]:
+        """
+        List the entries matching a video hash and/or step.
+
+        :param video_hash: Only list entries of this video, if given.
+        :param step: Only list entries of this step, if given.
+        :return: The matching entries, most recently used first.
+        """
+        query, params = self._where(video_hash, step)
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT video_hash, step, size, created_at, accessed_at"
+                f" FROM steps{query} ORDER BY accessed_at DESC", params).fetchall()
+        return [CacheEntry(*row) for row in rows]
+
+    def prune_sync(self, max_size: Optional[int] = None,
+                   max_age: Optional[float] = None) -> int:
+        """
+        Delete entries older than `max_age`, then the least recently used
+        entries until the total size is at most `max_size`.
+
+        :param max_size: Maximum total size in bytes, or None.
+        :param max_age: Maximum entry age in seconds, or None.
+        :return: The number of deleted entries.
+        """
+        deleted = 0
+        with self._connect() as connection:
+            if max_age is not None:
+                deleted += connection.execute(
+                    "DELETE FROM steps WHERE created_at < ?",
+                    (time.time() - max_age,)).rowcount
+            if max_size is not None:
+                total = 0
+                evicted = []
+                rows = connection.execute(
+                    "SELECT video_hash, step, size FROM steps"
+                    " ORDER BY accessed_at DESC")
+                for video_hash, step, size in rows:
+                    total += size
+                    if total > max_size:
+                        evicted.append((video_hash, step))
+                deleted += len(evicted)
+                connection.executemany(
+                    "DELETE FROM steps WHERE video_hash = ? AND step = ?", evicted)
+        return deleted
+
+    def migrate_sync(self, cache_dir: str = CACHE_DIR, delete: bool = False) -> int:
+        """
+        Import the old `<cache_dir>/<video_hash>/<step>.pkl` files.
+
+        :param cache_dir: The directory holding the pickle directories.
+        :param delete: Whether to delete the pickle files once imported.
+        :return: The number of imported entries.
+        """
+        if not os.path.isdir(cache_dir):
+            return 0
+
+        imported = 0
+        for video_hash in sorted(os.listdir(cache_dir)):
+            video_cache_dir = os.path.join(cache_dir, video_hash)
+            if not os.path.isdir(video_cache_dir):
+                continue
+            for filename in sorted(os.listdir(video_cache_dir)):
+                if not filename.endswith(".pkl"):
+                    continue
+                pickle_path = os.path.join(video_cache_dir, filename)
+                with open(pickle_path, "rb") as file:
+                    value = pickle.load(file)
+                self.set_sync(video_hash, filename[:-len(".pkl")], value)
+                imported += 1
+                if delete:
+                    os.remove(pickle_path)
+            if delete and not os.listdir(video_cache_dir):
+                os.rmdir(video_cache_dir)
+        return imported
+
+    def _import_legacy(self, video_hash: str, step: str) -> Tuple[bool, Any]:
+        """Import an old pickle file for this step, if there is one."""
+        if self.legacy_dir is None:
+            return False, None
+        pickle_path = os.path.join(self.legacy_dir, video_hash, f"{step}.pkl")
+        if not os.path.exists(pickle_path):
+            return False, None
+        with open(pickle_path, "rb") as file:
+            value = pickle.load(file)
+        self.set_sync(video_hash, step, value)
+        return True, value
+
+    @staticmethod
+    def _where(video_hash: Optional[str], step: Optional[str]) -> Tuple[str, tuple]:
+        conditions = []
+        params: tuple = ()
+        if video_hash is not None:
+            conditions.append("video_hash = ?")
+            params += (video_hash,)
+        if step is not None:
+            conditions.append("step = ?")
+            params += (step,)
+        if not conditions:
+            return "", params
+        return " WHERE " + " AND ".join(conditions), params
+
+    async def get(self, video_hash: str, step: str) -> Tuple[bool, Any]:
+        """Asynchronous version of `get_sync`."""
+        return await asyncio.to_thread(self.get_sync, video_hash, step)
+
+    async def set(self, video_hash: str, step: str, value: Any) -> None:
+        """Asynchronous version of `set_sync`."""
+        await asyncio.to_thread(self.set_sync, video_hash, step, value)
+
+_cache_store: Optional[CacheStore] = None
+
+def get_cache_store() -> CacheStore:
+    """
+    Return the process-wide cache store, limited by the optional
+    CACHE_MAX_SIZE_MB and CACHE_MAX_AGE_DAYS environment variables.
+
+    :return: The cache store.
+    """
+    global _cache_store
+    if _cache_store is None:
+        max_size_mb = os.getenv("CACHE_MAX_SIZE_MB")
+        max_age_days = os.getenv("CACHE_MAX_AGE_DAYS")
+        _cache_store = CacheStore(
+            max_size=int(float(max_size_mb) * 1024 * 1024) if max_size_mb else None,
+            max_age=float(max_age_days) * 24 * 60 * 60 if max_age_days else None)
+    return _cache_store
+
 def cache_result(step: str):
     """
     Decorator to cache the result of a function.
@@ -24,24 +306,76 @@ def cache_result(step: str):
             if not video_hash:
                 raise ValueError("Missing 'video_hash' argument")
 
-            # Create directory for the video hash
-            video_cache_dir = os.path.join(CACHE_DIR, video_hash)
-            os.makedirs(video_cache_dir, exist_ok=True)
+            metrics = get_metrics()
+            store = get_cache_store()
+            with metrics.timer("cache_lookup_seconds", cache="steps"):
+                found, value = await store.get(video_hash, step)
+            metrics.increment("cache_requests_total", cache="steps", step=step,
+                              result="hit" if found else "miss")
+            if found:
+                return value
 
-            cache_key = f"{step}.pkl"
-            cache_path = os.path.join(video_cache_dir, cache_key)
-
-            if os.path.exists(cache_path):
-                with open(cache_path, "rb") as file:
-                    return pickle.load(file)
-
-            result = await func(*args, **kwargs)
-
-            with open(cache_path, "wb") as file:
-                pickle.dump(result, file)
+            with metrics.timer("step_seconds", step=step):
+                result = await func(*args, **kwargs)
+            await store.set(video_hash, step, result)
 
             return result
 
         return wrapper
 
     return decorator
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect and prune the step cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List cached entries")
+    list_parser.add_argument("--video-hash", help="Only list this video")
+    list_parser.add_argument("--step", help="Only list this step, e.g. relevant_posts")
+
+    delete_parser = subparsers.add_parser("delete", help="Delete cached entries")
+    delete_parser.add_argument("--video-hash", help="Only delete this video")
+    delete_parser.add_argument("--step", help="Only delete this step")
+
+    prune_parser = subparsers.add_parser("prune", help="Evict old or excess entries")
+    prune_parser.add_argument("--max-size-mb", type=float, help="Maximum total size")
+    prune_parser.add_argument("--max-age-days", type=float, help="Maximum entry age")
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Import the old per-step pickle files")
+    migrate_parser.add_argument("--delete", action="store_true",
+                                help="Delete the pickle files once imported")
+
+    args = parser.parse_args()
+    store = CacheStore(legacy_dir=None)
+
+    if args.command == "list":
+        entries = store.list_sync(args.video_hash, args.step)
+        for entry in entries:
+            print(f"{entry.video_hash}  {entry.step:<16} {entry.size:>10} B"
+                  f"  created {_format_time(entry.created_at)}"
+                  f"  used {_format_time(entry.accessed_at)}")
+        print(f"{len(entries)} entries, {sum(e.size for e in entries)} bytes")
+    elif args.command == "delete":
+        if args.video_hash is None and args.step is None:
+            parser.error("delete needs --video-hash and/or --step")
+        print(f"Deleted {store.delete_sync(args.video_hash, args.step)} entries")
+    elif args.command == "prune":
+        max_size = (int(args.max_size_mb * 1024 * 1024)
+                    if args.max_size_mb is not None else None)
+        max_age = (args.max_age_days * 24 * 60 * 60
+                   if args.max_age_days is not None else None)
+        print(f"Pruned {store.prune_sync(max_size, max_age)} entries")
+        if max_age is not None:
+            from post_index import PostIndex
+            from post_store import get_post_body_store
+            print(f"Pruned {PostIndex().prune(max_age)} indexed posts")
+            print(f"Pruned {get_post_body_store().prune(max_age)} post bodies")
+    elif args.command == "migrate":
+        print(f"Imported {store.migrate_sync(delete=args.delete)} entries")
+
+if __name__ == "__main__":
+    main()
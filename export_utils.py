@@ -0,0 +1,277 @@
+"""
+Streaming export of posts and their generated comments.
+
+Rows are written as they are produced, to CSV (flushed after every row, so
+partial results survive a crash) or, with the optional pyarrow package, to
+Parquet (buffered into row groups). An exporter can append to an existing
+file, skipping the posts it already holds for the same video.
+"""
+
+import abc
+import csv
+import os
+import time
+from datetime import datetime, timezone
+from typing import IO, Any, List, NamedTuple, Optional, Set, Tuple
+from reddit_search import RedditPost
+
+OUTPUT_DIR = "output"
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+PARQUET_ROW_GROUP_SIZE = 1000
+
+class ExportRow(NamedTuple):
+    video_url: str
+    post_id: str
+    # ID of the post's near-duplicate cluster, if posts were clustered
+    cluster_id: Optional[str]
+    title: str
+    url: str
+    # None for a post that was not relevant
+    comment: Optional[str]
+    relevant: bool
+    num_comments: int
+    created_utc: float
+    # When the row was written, and how long after the video's run started
+    exported_at: float
+    elapsed_seconds: float
+
+# CSV header of each ExportRow field, starting with the original columns
+CSV_HEADERS = {
+    "title": "Post Title",
+    "url": "Post URL",
+    "comment": "Generated Comment",
+    "post_id": "Post ID",
+    "cluster_id": "Cluster ID",
+    "video_url": "Video URL",
+    "relevant": "Relevant",
+    "num_comments": "Comments",
+    "created_utc": "Post Created At",
+    "exported_at": "Exported At",
+    "elapsed_seconds": "Seconds Since Start",
+}
+
+def make_export_row(video_url: str, post: RedditPost, comment: Optional[str],
+                    started_at: float, relevant: bool = True,
+                    cluster_id: Optional[str] = None) -> ExportRow:
+    """
+    Build the export row of a post.
+
+    :param video_url: URL of the YouTube video.
+    :param post: The Reddit submission.
+    :param comment: The generated comment, if any.
+    :param started_at: When the video's run started, as a timestamp.
+    :param relevant: Whether the post is relevant to the video.
+    :param cluster_id: ID of the post's near-duplicate cluster, if any.
+    :return: The row.
+    """
+    now = time.time()
+    return ExportRow(video_url=video_url, post_id=post.id, cluster_id=cluster_id,
+                     title=post.title, url=post.url, comment=comment, relevant=relevant,
+                     num_comments=post.num_comments, created_utc=post.created_utc,
+                     exported_at=now, elapsed_seconds=round(now - started_at, 3))
+
+def _format_timestamp(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class PostExporter(abc.ABC):
+    """
+    Base class of the exporters, used as context managers. Rows are
+    de-duplicated on (video URL, post ID), including the rows already in
+    the file when appending.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        """
+        :param path: Path of the output file.
+        :param append: Whether to keep the rows of an existing file.
+        """
+        self.path = path
+        self.append = append
+        self.written = 0
+        self._keys: Set[Tuple[str, str]] = set()
+
+    def __enter__(self) -> "PostExporter":
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._open()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._close()
+
+    def write(self, row: ExportRow) -> bool:
+        """
+        Write a row, unless the file already holds the post for this video.
+
+        :param row: The row.
+        :return: Whether the row was written.
+        """
+        key = (row.video_url, row.post_id)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self._write_row(row)
+        self.written += 1
+        return True
+
+    @abc.abstractmethod
+    def _open(self) -> None:
+        """Open the file, loading the keys of its rows when appending."""
+
+    @abc.abstractmethod
+    def _write_row(self, row: ExportRow) -> None:
+        """Write a new row."""
+
+    @abc.abstractmethod
+    def _close(self) -> None:
+        """Write any buffered rows and close the file."""
+
+class CsvExporter(PostExporter):
+    """Write rows to a CSV file, flushing after each row."""
+
+    def __init__(self, path: str, append: bool = False):
+        super().__init__(path, append)
+        self._file: Optional[IO[str]] = None
+        self._writer: Any = None
+
+    def _open(self) -> None:
+        headers = list(CSV_HEADERS.values())
+        exists = self.append and os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if exists:
+            with open(self.path, newline="", encoding="utf-8") as file:
+                reader = csv.DictReader(file)
+                if reader.fieldnames != headers:
+                    raise ValueError(f"{self.path} has different columns, export to a new file.")
+                self._keys.update((row["Video URL"], row["Post ID"]) for row in reader)
+
+        self._file = open(self.path, "a" if exists else "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        if not exists:
+            self._writer.writerow(headers)
+
+    def _write_row(self, row: ExportRow) -> None:
+        if self._writer is None or self._file is None:
+            raise RuntimeError("CsvExporter must be used as a context manager")
+        values = row._asdict()
+        values.update(comment=row.comment or "", cluster_id=row.cluster_id or "",
+                      created_utc=_format_timestamp(row.created_utc),
+                      exported_at=_format_timestamp(row.exported_at))
+        self._writer.writerow([values[field] for field in CSV_HEADERS])
+        self._file.flush()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._writer = None
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Parquet export requires the optional pyarrow package"
+                           " (pip install pyarrow).") from e
+    return pyarrow, pyarrow.parquet
+
+class ParquetExporter(PostExporter):
+    """
+    Write rows to a Parquet file in row groups. The file is written next to
+    its final path and moved into place when the exporter closes, so a
+    crash leaves the previous file intact.
+
+    At most `row_group_size` new rows are held in memory. When appending,
+    the rows of the existing file are copied one row group at a time.
+    """
+
+    def __init__(self, path: str, append: bool = False,
+                 row_group_size: int = PARQUET_ROW_GROUP_SIZE):
+        """
+        :param path: Path of the output file.
+        :param append: Whether to keep the rows of an existing file.
+        :param row_group_size: Number of rows buffered before being written.
+        """
+        super().__init__(path, append)
+        self.row_group_size = row_group_size
+        self._temporary_path = f"{path}.partial"
+        self._writer: Any = None
+        self._rows: List[ExportRow] = []
+
+    def _schema(self):
+        pyarrow, _ = _import_pyarrow()
+        return pyarrow.schema([
+            ("video_url", pyarrow.string()),
+            ("post_id", pyarrow.string()),
+            ("cluster_id", pyarrow.string()),
+            ("title", pyarrow.string()),
+            ("url", pyarrow.string()),
+            ("comment", pyarrow.string()),
+            ("relevant", pyarrow.bool_()),
+            ("num_comments", pyarrow.int64()),
+            ("created_utc", pyarrow.float64()),
+            ("exported_at", pyarrow.float64()),
+            ("elapsed_seconds", pyarrow.float64()),
+        ])
+
+    def _open(self) -> None:
+        _, parquet = _import_pyarrow()
+        schema = self._schema()
+        existing = None
+        if self.append and os.path.exists(self.path):
+            existing = parquet.ParquetFile(self.path)
+            if not existing.schema_arrow.equals(schema):
+                raise ValueError(f"{self.path} has different columns, export to a new file.")
+            keys = parquet.read_table(self.path, columns=["video_url", "post_id"])
+            self._keys.update(zip(keys.column("video_url").to_pylist(),
+                                  keys.column("post_id").to_pylist()))
+
+        self._writer = parquet.ParquetWriter(self._temporary_path, schema)
+        if existing is not None:
+            with existing:
+                for index in range(existing.num_row_groups):
+                    self._writer.write_table(existing.read_row_group(index))
+
+    def _write_row(self, row: ExportRow) -> None:
+        if self._writer is None:
+            raise RuntimeError("ParquetExporter must be used as a context manager")
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self._write_rows()
+
+    def _write_rows(self) -> None:
+        if not self._rows:
+            return
+        pyarrow, _ = _import_pyarrow()
+        columns = {field: [getattr(row, field) for row in self._rows]
+                   for field in ExportRow._fields}
+        self._writer.write_table(pyarrow.Table.from_pydict(columns, schema=self._schema()))
+        self._rows = []
+
+    def _close(self) -> None:
+        if self._writer is None:
+            return
+        self._write_rows()
+        self._writer.close()
+        self._writer = None
+        os.replace(self._temporary_path, self.path)
+
+def open_exporter(path: str, append: bool = False) -> PostExporter:
+    """
+    Create the exporter matching a file's extension: Parquet for .parquet
+    and .pq files, CSV otherwise.
+
+    :param path: Path of the output file.
+    :param append: Whether to keep the rows of an existing file.
+    :return: The exporter, to be used as a context manager.
+    """
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        return ParquetExporter(path, append)
+    return CsvExporter(path, append)
+
+def get_video_csv_path(video_hash: str) -> str:
+    """
+    :param video_hash: The video hash.
+    :return: The path of the video's CSV file of relevant posts and comments.
+    """
+    return os.path.join(OUTPUT_DIR, f"{video_hash}_relevant_posts.csv")
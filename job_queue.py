@@ -0,0 +1,280 @@
+"""
+Durable queue of outreach jobs, shared by worker processes.
+
+Jobs live in a SQLite database, so any number of processes can enqueue and
+consume them. A worker leases a job for a limited time and renews the lease
+while it works; a job whose worker crashed is leased again once its lease
+expires. Delivery is at-least-once: a job may run twice if a lease expires
+while its worker is still alive, which the cached, checkpointed pipeline
+steps make cheap. Run `python job_queue.py --help` to inspect the queue or
+retry failed jobs.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from cache_utils import CACHE_DIR, open_database
+
+JOB_QUEUE_PATH = os.path.join(CACHE_DIR, "jobs.sqlite3")
+DEFAULT_LEASE_SECONDS = 10 * 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+class Job(NamedTuple):
+    id: int
+    video_url: str
+    # Options of the run, as given to `enqueue`
+    options: dict
+    # Number of times the job was leased, including this one
+    attempts: int
+
+class JobStatus(NamedTuple):
+    id: int
+    video_url: str
+    status: str
+    attempts: int
+    result: Optional[str]
+    error: Optional[str]
+    updated_at: float
+
+class JobQueue:
+    """SQLite queue of video jobs with leases."""
+
+    def __init__(self, path: str = JOB_QUEUE_PATH,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        """
+        :param path: Path to the SQLite database file.
+        :param lease_seconds: How long a leased job is reserved for its
+            worker without a renewal.
+        :param max_attempts: Number of leases after which a job that failed
+            or whose lease expired is marked as failed instead of being retried.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with open_database(self.path) as connection:
+            if not self._initialized:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    " video_url TEXT NOT NULL,"
+                    " options TEXT NOT NULL,"
+                    " status TEXT NOT NULL,"
+                    " attempts INTEGER NOT NULL DEFAULT 0,"
+                    " worker TEXT,"
+                    " lease_expires_at REAL,"
+                    " result TEXT,"
+                    " error TEXT,"
+                    " created_at REAL NOT NULL,"
+                    " updated_at REAL NOT NULL)")
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+                self._initialized = True
+            yield connection
+
+    def enqueue(self, video_urls: List[str], options: dict) -> int:
+        """
+        Add a job per video, skipping videos with a pending or leased job.
+
+        :param video_urls: URLs of the YouTube videos.
+        :param options: JSON-serializable options of the run.
+        :return: The number of jobs added.
+        """
+        now = time.time()
+        added = 0
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for video_url in dict.fromkeys(video_urls):
+                active = connection.execute(
+                    "SELECT 1 FROM jobs WHERE video_url = ? AND status IN (?, ?)",
+                    (video_url, PENDING, LEASED)).fetchone()
+                if active:
+                    continue
+                connection.execute(
+                    "INSERT INTO jobs (video_url, options, status, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (video_url, json.dumps(options), PENDING, now, now))
+                added += 1
+        return added
+
+    def lease(self, worker: str) -> Optional[Job]:
+        """
+        Lease the oldest pending job, or a leased job whose lease expired.
+        A job whose last lease expired after its maximum number of attempts,
+        e.g. because it keeps crashing its worker, is marked as failed instead.
+
+        :param worker: A name identifying the worker.
+        :return: The leased job, or None if no job is available.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            # Take the write lock first, so two workers never lease the same job
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "UPDATE jobs SET status = ?, lease_expires_at = NULL, updated_at = ?,"
+                " error = 'Lease expired ' || attempts || ' times, the job may crash its worker'"
+                " WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                (FAILED, now, LEASED, now, self.max_attempts))
+            row = connection.execute(
+                "SELECT id, video_url, options, attempts FROM jobs"
+                " WHERE status = ? OR (status = ? AND lease_expires_at < ?)"
+                " ORDER BY id LIMIT 1", (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            job_id, video_url, options, attempts = row
+            connection.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_expires_at = ?,"
+                " attempts = ?, updated_at = ? WHERE id = ?",
+                (LEASED, worker, now + self.lease_seconds, attempts + 1, now, job_id))
+        return Job(job_id, video_url, json.loads(options), attempts + 1)
+
+    def renew(self, job_id: int, worker: str) -> bool:
+        """
+        Extend the lease of a job.
+
+        :return: False if the worker lost the lease, e.g. after it expired
+            and another worker took the job.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            return connection.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ?"
+                " WHERE id = ? AND status = ? AND worker = ?",
+                (now + self.lease_seconds, now, job_id, LEASED, worker)).rowcount > 0
+
+    def complete(self, job_id: int, worker: str, result: Optional[str]) -> None:
+        """
+        Mark a job as done.
+
+        :param job_id: The job ID.
+        :param worker: The worker that ran the job.
+        :param result: An optional description of the output, e.g. a file path.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, worker = ?, result = ?, error = NULL,"
+                " lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                (DONE, worker, result, time.time(), job_id))
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """
+        Record a failed attempt, releasing the job for a retry unless it
+        reached the maximum number of attempts.
+
+        :return: True if the job will be retried.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN ? ELSE ? END,"
+                " error = ?, lease_expires_at = NULL, updated_at = ?"
+                " WHERE id = ? AND worker = ? AND status = ?",
+                (self.max_attempts, PENDING, FAILED, error, time.time(),
+                 job_id, worker, LEASED))
+            row = connection.execute("SELECT status FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+        return row is not None and row[0] == PENDING
+
+    def resume(self, include_failed: bool = True) -> int:
+        """
+        Make stuck jobs available again, resetting their attempts: leased
+        jobs whose lease expired and, optionally, failed jobs.
+
+        :return: The number of resumed jobs.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            resumed = connection.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, lease_expires_at = NULL,"
+                " updated_at = ? WHERE status = ? AND lease_expires_at < ?",
+                (PENDING, now, LEASED, now)).rowcount
+            if include_failed:
+                resumed += connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = 0, updated_at = ?"
+                    " WHERE status = ?", (PENDING, now, FAILED)).rowcount
+        return resumed
+
+    def counts(self) -> Dict[str, int]:
+        """
+        :return: The number of jobs by status.
+        """
+        with self._connect() as connection:
+            return dict(connection.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def has_unfinished(self) -> bool:
+        """
+        :return: Whether some job is pending or leased.
+        """
+        counts = self.counts()
+        return counts.get(PENDING, 0) + counts.get(LEASED, 0) > 0
+
+    def list(self, status: Optional[str] = None) -> List[JobStatus]:
+        """
+        :param status: Only list jobs with this status, if given.
+        :return: The jobs, oldest first.
+        """
+        query = ("SELECT id, video_url, status, attempts, result, error, updated_at"
+                 " FROM jobs")
+        parameters = []
+        if status is not None:
+            query += " WHERE status = ?"
+            parameters.append(status)
+        with self._connect() as connection:
+            rows = connection.execute(query + " ORDER BY id", parameters).fetchall()
+        return [JobStatus(*row) for row in rows]
+
+    def clear(self, status: str = DONE) -> int:
+        """
+        Delete the jobs with a status.
+
+        :return: The number of deleted jobs.
+        """
+        with self._connect() as connection:
+            return connection.execute("DELETE FROM jobs WHERE status = ?",
+                                      (status,)).rowcount
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect and manage the job queue.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List jobs")
+    list_parser.add_argument("--status", choices=[PENDING, LEASED, DONE, FAILED])
+
+    subparsers.add_parser("resume", help="Retry failed jobs and jobs with an expired lease")
+
+    clear_parser = subparsers.add_parser("clear", help="Delete finished jobs")
+    clear_parser.add_argument("--status", choices=[DONE, FAILED], default=DONE)
+
+    args = parser.parse_args()
+    queue = JobQueue()
+
+    if args.command == "list":
+        jobs = queue.list(args.status)
+        for job in jobs:
+            updated = datetime.fromtimestamp(job.updated_at).strftime("%Y-%m-%d %H:%M")
+            detail = job.error if job.status in (PENDING, FAILED) and job.error else job.result
+            print(f"{job.id:>6}  {job.status:<8} {job.attempts} attempts  {updated}"
+                  f"  {job.video_url}  {detail or ''}")
+        print(", ".join(f"{count} {status}" for status, count in queue.counts().items())
+              or "No jobs")
+    elif args.command == "resume":
+        print(f"Resumed {queue.resume()} jobs")
+    elif args.command == "clear":
+        print(f"Deleted {queue.clear(args.status)} jobs")
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,8 @@ a YouTube video title and description using an LLM.
 """
 
 from typing import List
-from llm_utils import request_completion, extract_json_from_string
+from llm_utils import request_json
+from video_context import clean_description
 
 def escape_line_breaks(text: str) -> str:
     """
@@ -15,6 +16,17 @@ def escape_line_breaks(text: str) -> str:
     """
     return text.replace("\n", "&#10;")
 
+def _string_list_schema(*names: str) -> dict:
+    """Strict JSON schema of an object with a list of strings per name."""
+    return {"type": "object",
+            "properties": {name: {"type": "array", "items": {"type": "string"}}
+                           for name in names},
+            "required": list(names),
+            "additionalProperties": False}
+
+KEYWORDS_SCHEMA = _string_list_schema("keywords")
+SUBREDDITS_SCHEMA = _string_list_schema("relevant_subreddits", "additional_subreddits")
+
 async def get_relevant_keywords(
     video_title: str, video_description: str) -> List[str]:
     """
@@ -26,7 +38,8 @@ async def get_relevant_keywords(
     :return: A list of keywords.
     :raises ValueError: If the output cannot be processed.
     """
-    escaped_description = escape_line_breaks(video_description)
+    # Links, time codes and sponsor lines only cost tokens here
+    escaped_description = escape_line_breaks(clean_description(video_description))
 
     prompt = (f"Based on the following video title and description, suggest "
               f"relevant keywords to find related posts.\n\n"
@@ -37,12 +50,13 @@ async def get_relevant_keywords(
               f"  \"keywords\": [\"keyword1\", \"keyword2\", ...]\n"
               f"}}")
 
-    result = await request_completion(prompt,
-        ("You are an assistant skilled in identifying relevant keywords."
-         " Please output the result in the specified JSON format."))
-
     try:
-        result_json = extract_json_from_string(result)
+        result_json = await request_json(prompt,
+            ("You are an assistant skilled in identifying relevant keywords."
+             " Please output the result in the specified JSON format."),
+            KEYWORDS_SCHEMA, "keywords")
+        if not isinstance(result_json, dict):
+            raise ValueError(f"Expected a JSON object, got: {result_json}")
         keywords = result_json.get("keywords", [])
     except ValueError as e:
         raise ValueError("Error processing the LLM output as JSON") from e
@@ -59,7 +73,7 @@ async def filter_subreddits(video_title: str, video_description: str,
     :param subreddits: List of subreddits to filter.
     :return: List of relevant subreddits.
     """
-    escaped_description = escape_line_breaks(video_description)
+    escaped_description = escape_line_breaks(clean_description(video_description))
 
     prompt = (f"Based on the following video title and description, "
               f"keep only the relevant subreddits from the list, and"
@@ -73,12 +87,13 @@ async def filter_subreddits(video_title: str, video_description: str,
               f" ...], \"additional_subreddits\": [\"subreddit3\","
               f" \"subreddit4\", ...]}}")
 
-    result = await request_completion(prompt,
-        ("You are an assistant skilled in identifying relevant subreddits."
-         " Please output the result in the specified JSON format."))
-
     try:
-        result_json = extract_json_from_string(result)
+        result_json = await request_json(prompt,
+            ("You are an assistant skilled in identifying relevant subreddits."
+             " Please output the result in the specified JSON format."),
+            SUBREDDITS_SCHEMA, "subreddits")
+        if not isinstance(result_json, dict):
+            raise ValueError(f"Expected a JSON object, got: {result_json}")
         relevant_subreddits = result_json.get("relevant_subreddits", [])
         additional_subreddits = result_json.get("additional_subreddits", [])
     except ValueError as e:
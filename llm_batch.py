@@ -0,0 +1,453 @@
+"""
+Deferred LLM requests, answered by offline batch-completion jobs.
+
+Inside `deferred_requests`, completion requests that miss the LLM cache are
+not sent one by one. They are queued, and once no new request arrived for a
+few seconds, written to a JSONL job file and submitted as a single batch
+job. The job is polled until it finishes, then every answer is stored in
+the LLM cache under its request's key and handed back to the waiting
+caller, so the pipeline runs unchanged, only later. OpenAI's Batch API
+costs about half as much as regular requests and has its own rate limits.
+
+Submitted jobs are recorded next to their input file, so a run that is
+interrupted while waiting picks the same jobs up again instead of paying
+for its requests twice.
+"""
+
+import abc
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional
+from cache_utils import CACHE_DIR
+from llm_utils import MODEL, get_client, get_llm_cache, get_scheduler, estimate_tokens, use_batcher
+from metrics import get_metrics
+
+BATCH_DIR = os.path.join(CACHE_DIR, "batches")
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+# A job is submitted once no request was added for this long, in seconds
+DEFAULT_IDLE_SECONDS = 5.0
+# How often a running job is checked, in seconds
+DEFAULT_POLL_SECONDS = 60.0
+# OpenAI's limit of requests per batch job
+MAX_JOB_REQUESTS = 50_000
+# Failed checks of a running job are retried with a growing delay, up to
+# this delay and number of consecutive failures
+MAX_POLL_BACKOFF_SECONDS = 15 * 60
+MAX_POLL_ERRORS = 20
+
+class BatchJobError(RuntimeError):
+    """A batch job ended without answers: it failed, expired or was cancelled."""
+
+class BatchResult(NamedTuple):
+    custom_id: str
+    # The completion text, or None if the request failed
+    content: Optional[str]
+    error: Optional[str]
+    usage: Optional[Dict[str, Any]]
+
+def _parse_output_line(record: Dict[str, Any]) -> BatchResult:
+    """Read a line of a batch output or error file."""
+    custom_id = record["custom_id"]
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        error = record.get("error") or response.get("body", {}).get("error")
+        return BatchResult(custom_id, None, json.dumps(error), None)
+    body = response["body"]
+    choices = body.get("choices") or []
+    content = choices[0]["message"].get("content") if choices else None
+    return BatchResult(custom_id, content or "", None, body.get("usage"))
+
+class BatchBackend(abc.ABC):
+    """Service running batch jobs of chat completion requests."""
+
+    name = ""
+
+    @abc.abstractmethod
+    async def submit(self, input_path: str) -> str:
+        """
+        Start a job.
+
+        :param input_path: Path of the JSONL file of requests.
+        :return: The job ID.
+        """
+
+    @abc.abstractmethod
+    async def fetch_results(self, job_id: str) -> Optional[List[BatchResult]]:
+        """
+        Check a job.
+
+        :param job_id: The job ID.
+        :return: The results of a finished job, or None while it runs.
+        :raises BatchJobError: If the job failed, expired or was cancelled.
+            Other errors, e.g. network errors, are worth retrying.
+        """
+
+    def discard(self, job_id: str) -> None:
+        """
+        Delete the local files of a job once its results were stored.
+
+        :param job_id: The job ID.
+        """
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI's Batch API, which answers within 24 hours."""
+
+    name = "openai"
+
+    async def submit(self, input_path: str) -> str:
+        client = get_client()
+        with open(input_path, "rb") as file:
+            input_file = await client.files.create(file=file, purpose="batch")
+        batch = await client.batches.create(input_file_id=input_file.id,
+                                            endpoint=CHAT_COMPLETIONS_ENDPOINT,
+                                            completion_window="24h")
+        return batch.id
+
+    async def fetch_results(self, job_id: str) -> Optional[List[BatchResult]]:
+        client = get_client()
+        batch = await client.batches.retrieve(job_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            # An expired job still returns the requests it completed
+            if batch.status != "expired" or not batch.output_file_id:
+                raise BatchJobError(f"Batch job {job_id} {batch.status}: {batch.errors}")
+        elif batch.status != "completed":
+            return None
+
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await client.files.content(file_id)
+                results.extend(_parse_output_line(json.loads(line))
+                               for line in content.text.splitlines() if line.strip())
+        return results
+
+async def _send_chat_request(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer a batch request line with a regular chat completion request."""
+    estimated_tokens = sum(estimate_tokens(message["content"]) for message in body["messages"])
+
+    async def send() -> Dict[str, Any]:
+        completion = await get_client().chat.completions.create(**body)
+        return completion.model_dump()
+
+    return await get_scheduler().run(send, estimated_tokens)
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a batch service, for tests and local mock
+    servers. A job is answered on its first check, each request by
+    `respond` (by default a regular chat completion request, which
+    OPENAI_BASE_URL can point at a mock server), and its output file is
+    written in the Batch API's format next to its input.
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str = os.path.join(BATCH_DIR, "local"),
+                 respond: Optional[Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = None):
+        """
+        :param directory: Where job input and output files are kept.
+        :param respond: Optional coroutine function answering the body of a
+            request with the body of a chat completion.
+        """
+        self.directory = directory
+        self.respond = respond or _send_chat_request
+
+    def _path(self, job_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.{kind}.jsonl")
+
+    def discard(self, job_id: str) -> None:
+        for kind in ("input", "output"):
+            path = self._path(job_id, kind)
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def submit(self, input_path: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        with open(input_path, encoding="utf-8") as source, \
+                open(self._path(job_id, "input"), "w", encoding="utf-8") as target:
+            target.write(source.read())
+        return job_id
+
+    async def fetch_results(self, job_id: str) -> Optional[List[BatchResult]]:
+        output_path = self._path(job_id, "output")
+        if not os.path.exists(output_path):
+            await self._run(job_id, output_path)
+        with open(output_path, encoding="utf-8") as file:
+            return [_parse_output_line(json.loads(line)) for line in file if line.strip()]
+
+    async def _run(self, job_id: str, output_path: str) -> None:
+        input_path = self._path(job_id, "input")
+        if not os.path.exists(input_path):
+            raise BatchJobError(f"Batch job {job_id} does not exist")
+        with open(input_path, encoding="utf-8") as file:
+            requests = [json.loads(line) for line in file if line.strip()]
+
+        async def answer(request: Dict[str, Any]) -> Dict[str, Any]:
+            try:
+                body = await self.respond(request["body"])
+                return {"custom_id": request["custom_id"], "error": None,
+                        "response": {"status_code": 200, "body": body}}
+            except Exception as e:
+                return {"custom_id": request["custom_id"], "response": None,
+                        "error": {"code": type(e).__name__, "message": str(e)}}
+
+        lines = await asyncio.gather(*[answer(request) for request in requests])
+        os.makedirs(self.directory, exist_ok=True)
+        # Written in one go, so a crash never leaves a partial output
+        temporary_path = f"{output_path}.partial"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(line) + "\n" for line in lines)
+        os.replace(temporary_path, output_path)
+
+BATCH_BACKENDS = {OpenAIBatchBackend.name: OpenAIBatchBackend,
+                  LocalBatchBackend.name: LocalBatchBackend}
+
+class DeferredBatcher:
+    """Collects completion requests into batch jobs and waits for their answers."""
+
+    def __init__(self, backend: BatchBackend, directory: str = BATCH_DIR,
+                 idle_seconds: float = DEFAULT_IDLE_SECONDS,
+                 poll_seconds: float = DEFAULT_POLL_SECONDS,
+                 max_job_requests: int = MAX_JOB_REQUESTS):
+        """
+        :param backend: The batch service.
+        :param directory: Where job files and records are kept.
+        :param idle_seconds: How long to wait for more requests before
+            submitting a job.
+        :param poll_seconds: How often a running job is checked.
+        :param max_job_requests: Maximum number of requests per job.
+        """
+        self.backend = backend
+        self.directory = directory
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self.max_job_requests = max_job_requests
+        # Request bodies not submitted yet, by custom ID
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._futures: Dict[str, "asyncio.Future[str]"] = {}
+        self._last_request = 0.0
+        self._collector: Optional["asyncio.Task[None]"] = None
+        self._jobs: List["asyncio.Task[None]"] = []
+        self._resumed = False
+
+    async def request(self, custom_id: str, body: Dict[str, Any]) -> str:
+        """
+        Queue a chat completion request for the next job.
+
+        :param custom_id: A unique ID of the request, e.g. its cache key.
+        :param body: The body of the chat completion request.
+        :return: The completion text, once the job finished.
+        :raises RuntimeError: If the job or the request failed.
+        """
+        if not self._resumed:
+            self._resumed = True
+            self._resume_jobs()
+        future = self._futures.get(custom_id)
+        if future is None:
+            future = self._futures[custom_id] = self._new_future()
+            self._pending[custom_id] = body
+            self._last_request = time.monotonic()
+            if self._collector is None or self._collector.done():
+                self._collector = asyncio.create_task(self._collect())
+        # Shielded so a cancelled caller does not cancel the other waiters
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def _new_future() -> "asyncio.Future[str]":
+        future = asyncio.get_running_loop().create_future()
+        # Answers of resumed jobs may have no caller, which is fine for failures too
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return future
+
+    def _record_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _resume_jobs(self) -> None:
+        """Wait again for the unfinished jobs of this backend submitted by earlier runs."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.directory, name), encoding="utf-8") as file:
+                record = json.load(file)
+            if record["backend"] != self.backend.name:
+                continue
+            custom_ids = [custom_id for custom_id in record["custom_ids"]
+                          if custom_id not in self._futures]
+            for custom_id in custom_ids:
+                self._futures[custom_id] = self._new_future()
+            print(f"📮 Waiting for batch job {record['job_id']} of an earlier run"
+                  f" ({len(record['custom_ids'])} requests).")
+            self._jobs.append(asyncio.create_task(self._wait(record["job_id"], custom_ids)))
+
+    async def _collect(self) -> None:
+        """Submit the queued requests once no more arrive."""
+        while self._pending:
+            idle = time.monotonic() - self._last_request
+            if idle < self.idle_seconds and len(self._pending) < self.max_job_requests:
+                await asyncio.sleep(self.idle_seconds - idle)
+                continue
+            custom_ids = list(self._pending)[:self.max_job_requests]
+            requests = {custom_id: self._pending.pop(custom_id) for custom_id in custom_ids}
+            self._jobs.append(asyncio.create_task(self._run_job(requests)))
+
+    async def _run_job(self, requests: Dict[str, Dict[str, Any]]) -> None:
+        custom_ids = list(requests)
+        try:
+            job_id = await self._submit(requests)
+        except Exception as e:
+            self._fail(custom_ids, f"Could not submit a batch job: {e}")
+            return
+        print(f"📮 Submitted batch job {job_id} with {len(requests)} requests.")
+        await self._wait(job_id, custom_ids)
+
+    async def _submit(self, requests: Dict[str, Dict[str, Any]]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        input_path = os.path.join(self.directory,
+                                  f"requests-{int(time.time())}-{uuid.uuid4().hex[:8]}.jsonl")
+        with open(input_path, "w", encoding="utf-8") as file:
+            for custom_id, body in requests.items():
+                file.write(json.dumps({"custom_id": custom_id, "method": "POST",
+                                       "url": CHAT_COMPLETIONS_ENDPOINT, "body": body}) + "\n")
+        job_id = await self.backend.submit(input_path)
+        with open(self._record_path(job_id), "w", encoding="utf-8") as file:
+            json.dump({"job_id": job_id, "backend": self.backend.name,
+                       "input_path": input_path, "custom_ids": list(requests),
+                       "submitted_at": time.time()}, file)
+        get_metrics().increment("llm_batch_jobs_total", backend=self.backend.name)
+        return job_id
+
+    async def _poll(self, job_id: str) -> List[BatchResult]:
+        """
+        Check a job until it finishes, retrying failed checks with backoff.
+
+        :raises BatchJobError: If the job ended without answers.
+        :raises Exception: The last error, once too many checks in a row failed.
+        """
+        errors = 0
+        while True:
+            try:
+                results = await self.backend.fetch_results(job_id)
+                errors = 0
+            except BatchJobError:
+                raise
+            except Exception as e:
+                errors += 1
+                if errors >= MAX_POLL_ERRORS:
+                    raise
+                delay = min(self.poll_seconds * 2 ** (errors - 1), MAX_POLL_BACKOFF_SECONDS)
+                print(f"⚠️ Could not check batch job {job_id}, retrying in {delay:.0f}s: {e}")
+                get_metrics().increment("llm_batch_poll_errors_total", backend=self.backend.name)
+                await asyncio.sleep(delay)
+                continue
+            if results is not None:
+                return results
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _wait(self, job_id: str, custom_ids: List[str]) -> None:
+        """Poll a job, then store its answers and wake up their callers."""
+        try:
+            results = await self._poll(job_id)
+        except BatchJobError as e:
+            self._fail(custom_ids, str(e))
+            self._forget(job_id)
+            return
+        except Exception as e:
+            # The job may still finish: keep its record for the next run
+            self._fail(custom_ids, f"Gave up checking batch job {job_id}, the next"
+                                   f" deferred run will check it again: {e}")
+            return
+
+        metrics = get_metrics()
+        cache = get_llm_cache()
+        answered = {}
+        for result in results:
+            if result.content is None:
+                continue
+            answered[result.custom_id] = result.content
+            if result.usage:
+                metrics.increment("llm_tokens_total", result.usage.get("prompt_tokens", 0),
+                                  model=MODEL, kind="prompt")
+                metrics.increment("llm_tokens_total", result.usage.get("completion_tokens", 0),
+                                  model=MODEL, kind="completion")
+        if cache is not None and answered:
+            # Also stores answers nobody waits for, e.g. after a restart
+            await asyncio.to_thread(cache.set_many_sync, answered)
+
+        errors = {result.custom_id: result.error for result in results
+                  if result.content is None}
+        for custom_id in custom_ids:
+            future = self._futures.pop(custom_id, None)
+            if future is None or future.done():
+                continue
+            if custom_id in answered:
+                metrics.increment("llm_batch_requests_total", result="answered")
+                future.set_result(answered[custom_id])
+            else:
+                metrics.increment("llm_batch_requests_total", result="failed")
+                future.set_exception(RuntimeError(
+                    f"Batch request failed: {errors.get(custom_id) or 'no answer in the job output'}"))
+        print(f"📬 Batch job {job_id} finished: {len(answered)} answers,"
+              f" {len(custom_ids) - len(answered)} failed.")
+        self._forget(job_id)
+
+    def _fail(self, custom_ids: List[str], error: str) -> None:
+        print(f"⚠️ {error}")
+        for custom_id in custom_ids:
+            future = self._futures.pop(custom_id, None)
+            if future is not None and not future.done():
+                get_metrics().increment("llm_batch_requests_total", result="failed")
+                future.set_exception(RuntimeError(error))
+
+    def _forget(self, job_id: str) -> None:
+        """Delete the record and files of a finished job."""
+        self.backend.discard(job_id)
+        record_path = self._record_path(job_id)
+        if not os.path.exists(record_path):
+            return
+        with open(record_path, encoding="utf-8") as file:
+            input_path = json.load(file)["input_path"]
+        if os.path.exists(input_path):
+            os.remove(input_path)
+        os.remove(record_path)
+
+_batchers: Dict[str, DeferredBatcher] = {}
+
+def get_batcher(backend: str = OpenAIBatchBackend.name) -> DeferredBatcher:
+    """
+    Return the process-wide batcher of a backend, creating it on first use.
+    LLM_BATCH_POLL_SECONDS sets how often its jobs are checked.
+
+    :param backend: "openai" or "local" (see `LocalBatchBackend`).
+    :return: The batcher.
+    :raises ValueError: If the backend is unknown.
+    """
+    if backend not in BATCH_BACKENDS:
+        raise ValueError(f"Unknown batch backend {backend!r},"
+                         f" expected one of: {', '.join(BATCH_BACKENDS)}")
+    if backend not in _batchers:
+        poll_seconds = os.getenv("LLM_BATCH_POLL_SECONDS")
+        _batchers[backend] = DeferredBatcher(
+            BATCH_BACKENDS[backend](),
+            poll_seconds=float(poll_seconds) if poll_seconds else DEFAULT_POLL_SECONDS)
+    return _batchers[backend]
+
+@contextmanager
+def deferred_requests(backend: str = OpenAIBatchBackend.name) -> Iterator[DeferredBatcher]:
+    """
+    Send the completion requests made in this block, including by the tasks
+    it starts, as batch jobs. Requests served from the LLM cache are not
+    affected.
+
+    :param backend: "openai" or "local" (see `LocalBatchBackend`).
+    :return: The batcher.
+    """
+    batcher = get_batcher(backend)
+    with use_batcher(batcher):
+        yield batcher
@@ -0,0 +1,180 @@
+"""
+Persistent, content-addressed cache of LLM responses.
+
+Responses are keyed on the model, system prompt and prompt, so any call that
+was already paid for is served locally, however the surrounding step is
+cached. Entries live in a SQLite database, which makes the cache safe to
+share between processes, and are evicted least-recently-used once the cache
+grows past its size limit.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, Optional
+from cache_utils import CACHE_DIR, open_database
+from metrics import get_metrics
+
+DEFAULT_CACHE_PATH = os.path.join(CACHE_DIR, "llm_responses.sqlite3")
+DEFAULT_MAX_ENTRIES = 100_000
+
+def get_cache_key(model: str, system_prompt: Optional[str], prompt: str,
+                  response_format: Optional[dict] = None) -> str:
+    """
+    Generate the cache key of a completion request.
+
+    :param model: The model name.
+    :param system_prompt: The optional system prompt.
+    :param prompt: The user prompt.
+    :param response_format: The optional structured output format.
+    :return: A hex digest identifying the request.
+    """
+    request = [model, system_prompt, prompt]
+    if response_format is not None:
+        # Only added when given, so plain requests keep their cached responses
+        request.append(response_format)
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class LLMCache:
+    """
+    SQLite-backed LLM response cache with LRU eviction and an optional TTL.
+
+    The blocking database calls run in a worker thread, and concurrent
+    requests for the same key within a process share a single computation.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH,
+                 max_entries: Optional[int] = DEFAULT_MAX_ENTRIES,
+                 ttl: Optional[float] = None):
+        """
+        :param path: Path to the SQLite database file.
+        :param max_entries: Maximum number of entries kept, or None for no limit.
+        :param ttl: Maximum age of an entry in seconds, or None to keep
+            entries until they are evicted.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._in_flight: Dict[str, "asyncio.Future[str]"] = {}
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with open_database(self.path) as connection:
+            if not self._initialized:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    " key TEXT PRIMARY KEY,"
+                    " response TEXT NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " accessed_at REAL NOT NULL)")
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_accessed_at"
+                    " ON responses (accessed_at)")
+                self._initialized = True
+            yield connection
+
+    def get_sync(self, key: str) -> Optional[str]:
+        """
+        Return the cached response for a key, or None if missing or expired.
+
+        :param key: The cache key.
+        :return: The cached response, if any.
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            return None
+
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return response
+
+    def set_sync(self, key: str, response: str) -> None:
+        """
+        Store a response and evict the least recently used entries if the
+        cache is over its size limit.
+
+        :param key: The cache key.
+        :param response: The response to store.
+        """
+        self.set_many_sync({key: response})
+
+    def set_many_sync(self, responses: Dict[str, str]) -> None:
+        """
+        Store several responses in one transaction, e.g. the answers of a
+        batch job, and evict entries like `set_sync`.
+
+        :param responses: The responses to store, by cache key.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO responses"
+                " (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(key, response, now, now) for key, response in responses.items()])
+            if self.max_entries is not None:
+                connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY accessed_at DESC"
+                    " LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def clear_sync(self) -> None:
+        """Remove every entry from the cache."""
+        if os.path.exists(self.path):
+            with self._connect() as connection:
+                connection.execute("DELETE FROM responses")
+
+    async def get(self, key: str) -> Optional[str]:
+        """Asynchronous version of `get_sync`."""
+        return await asyncio.to_thread(self.get_sync, key)
+
+    async def set(self, key: str, response: str) -> None:
+        """Asynchronous version of `set_sync`."""
+        await asyncio.to_thread(self.set_sync, key, response)
+
+    async def get_or_compute(self, key: str,
+                             compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        Return the cached response for a key, computing and storing it if
+        missing. Empty responses are not cached.
+
+        :param key: The cache key.
+        :param compute: Coroutine function producing the response.
+        :return: The cached or computed response.
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            get_metrics().increment("cache_requests_total", cache="llm", result="shared")
+        else:
+            task = asyncio.ensure_future(self._get_or_compute(key, compute))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded so a cancelled caller does not cancel the other waiters
+        return await asyncio.shield(task)
+
+    async def _get_or_compute(self, key: str,
+                              compute: Callable[[], Awaitable[str]]) -> str:
+        response = await self.get(key)
+        get_metrics().increment("cache_requests_total", cache="llm",
+                                result="miss" if response is None else "hit")
+        if response is None:
+            response = await compute()
+            if response:
+                await self.set(key, response)
+        return response
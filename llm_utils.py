@@ -1,28 +1,222 @@
 """Utilities for interacting with the LLMs.
 Currently only supports OpenAI's models."""
 
+import bisect
 import os
 import json
-import re
-from typing import Optional, List, Dict, Union
-from openai import AsyncOpenAI
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, Iterator, Optional, List, Dict, Tuple, Union
+from llm_cache import LLMCache, get_cache_key, DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES
+from rate_limiter import RateScheduler
+from metrics import get_metrics
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize OpenAI API key
-openai_api_key = os.getenv("OPENAI_API_KEY")
-client = AsyncOpenAI(api_key=openai_api_key)
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from llm_batch import DeferredBatcher
 
-async def request_completion(prompt: str, system_prompt: Optional[str] = None) -> str:
+_client: Optional["AsyncOpenAI"] = None
+
+def get_client() -> "AsyncOpenAI":
+    """
+    Return the process-wide OpenAI client, created on the first request so
+    runs served from the cache never load the OpenAI SDK. Retries are
+    handled by the shared scheduler. OPENAI_BASE_URL can point the client at
+    a local mock server.
+
+    :return: The OpenAI client.
+    """
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _client
+
+MODEL = "gpt-4o-mini"
+
+# Upper bound of in-flight requests, shared by every caller in the process
+DEFAULT_MAX_CONCURRENT_REQUESTS = 10
+_scheduler: Optional[RateScheduler] = None
+
+def get_scheduler() -> RateScheduler:
+    """
+    Return the process-wide request scheduler, configured from the optional
+    OPENAI_MAX_CONCURRENCY, OPENAI_REQUESTS_PER_MINUTE and
+    OPENAI_TOKENS_PER_MINUTE environment variables.
+
+    :return: The request scheduler.
+    """
+    global _scheduler
+    if _scheduler is None:
+        requests_per_minute = os.getenv("OPENAI_REQUESTS_PER_MINUTE")
+        tokens_per_minute = os.getenv("OPENAI_TOKENS_PER_MINUTE")
+        _scheduler = RateScheduler(
+            max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY")
+                                or DEFAULT_MAX_CONCURRENT_REQUESTS),
+            requests_per_minute=int(requests_per_minute) if requests_per_minute else None,
+            tokens_per_minute=int(tokens_per_minute) if tokens_per_minute else None)
+    return _scheduler
+
+def set_max_concurrent_requests(max_requests: int) -> None:
+    """
+    Set the maximum number of in-flight completion requests for the process.
+
+    :param max_requests: Maximum number of concurrent requests.
+    :raises ValueError: If max_requests is not positive.
+    """
+    get_scheduler().set_max_concurrency(max_requests)
+
+def set_budget_share(share: float) -> None:
+    """
+    Use only a fraction of the OpenAI rate limits in this process, so
+    several worker processes sharing an API key stay within its budget.
+
+    :param share: The fraction, in (0, 1].
+    :raises ValueError: If share is out of range.
+    """
+    get_scheduler().set_budget_share(share)
+
+_llm_cache: Optional[LLMCache] = None
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    Return the process-wide LLM response cache, configured from the
+    LLM_CACHE, LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES and LLM_CACHE_TTL
+    environment variables.
+
+    :return: The response cache, or None if disabled with LLM_CACHE=0.
+    """
+    global _llm_cache
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+    if _llm_cache is None:
+        max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES)
+        ttl = os.getenv("LLM_CACHE_TTL")
+        _llm_cache = LLMCache(
+            path=os.getenv("LLM_CACHE_PATH") or DEFAULT_CACHE_PATH,
+            max_entries=max_entries if max_entries > 0 else None,
+            ttl=float(ttl) if ttl else None)
+    return _llm_cache
+
+# Batcher of the requests deferred to batch jobs (see `llm_batch`)
+_batcher: ContextVar[Optional["DeferredBatcher"]] = ContextVar("batcher", default=None)
+
+@contextmanager
+def use_batcher(batcher: "DeferredBatcher") -> Iterator[None]:
+    """
+    Defer the completion requests made in this block, and by the tasks it
+    starts, to a batcher. Use `llm_batch.deferred_requests` instead.
+
+    :param batcher: The batcher.
+    """
+    token = _batcher.set(batcher)
+    try:
+        yield
+    finally:
+        _batcher.reset(token)
+
+# Set LLM_STRUCTURED_OUTPUT=0 for models or servers without JSON schema support
+_structured_output = os.getenv("LLM_STRUCTURED_OUTPUT", "1") != "0"
+
+def json_schema_format(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the structured output `response_format` of a JSON schema.
+
+    :param name: A name for the schema.
+    :param schema: A JSON schema in OpenAI's strict subset: every property
+        required and no additional properties.
+    :return: The response format.
+    """
+    return {"type": "json_schema",
+            "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+async def request_completion(prompt: str, system_prompt: Optional[str] = None,
+                             use_cache: bool = True,
+                             response_format: Optional[Dict[str, Any]] = None,
+                             stream_json: bool = False) -> str:
     """
     Asynchronously request completion from OpenAI API.
 
+    Responses are cached on the model, system prompt, prompt and response
+    format, so repeated requests are served locally (see `get_llm_cache`).
+
     :param prompt: The user prompt to send to the OpenAI API.
     :param system_prompt: An optional system prompt to set the context.
+    :param use_cache: Whether to read and write the response cache.
+    :param response_format: An optional structured output format (see
+        `json_schema_format`).
+    :param stream_json: Whether to stream the response and stop reading it
+        as soon as it holds a complete JSON value. Ignored for deferred
+        requests.
     :return: The completion result from the OpenAI API.
     """
+    cache = get_llm_cache() if use_cache else None
+    key = get_cache_key(MODEL, system_prompt, prompt, response_format)
+    batcher = _batcher.get()
+    if batcher is not None:
+        body = _chat_body(prompt, system_prompt, response_format)
+        compute = lambda: batcher.request(key, body)
+    else:
+        compute = lambda: _request_completion(prompt, system_prompt, response_format, stream_json)
+
+    if cache is None:
+        return await compute()
+    return await cache.get_or_compute(key, compute)
+
+def _is_structured_output_error(error: Exception) -> bool:
+    """
+    Whether a rejected request was rejected for its response format, rather
+    than e.g. its length or content.
+    """
+    param = getattr(error, "param", None) or ""
+    code = getattr(error, "code", None) or ""
+    return (param.startswith("response_format")
+            or any(name in code for name in ("response_format", "json_schema")))
+
+async def request_json(prompt: str, system_prompt: Optional[str] = None,
+                       schema: Optional[Dict[str, Any]] = None,
+                       schema_name: str = "response",
+                       use_cache: bool = True) -> Union[Dict, List]:
+    """
+    Request a JSON response. With a schema, structured output makes the
+    model answer with matching JSON; without one, or if the model does not
+    support it, the first JSON value of the answer is used, so the prompt
+    should describe the format too. The response is streamed and read only
+    until its JSON value is complete.
+
+    :param prompt: The user prompt to send to the OpenAI API.
+    :param system_prompt: An optional system prompt to set the context.
+    :param schema: An optional JSON schema of the response (see
+        `json_schema_format`).
+    :param schema_name: A name for the schema.
+    :param use_cache: Whether to read and write the response cache.
+    :return: The JSON value.
+    :raises ValueError: If the response holds no JSON value.
+    """
+    global _structured_output
+    response_format = (json_schema_format(schema_name, schema)
+                       if schema is not None and _structured_output else None)
+    try:
+        result = await request_completion(prompt, system_prompt, use_cache,
+                                          response_format, stream_json=True)
+    except Exception as e:
+        # Imported here, a failed request has already loaded the client
+        from openai import BadRequestError
+        if (response_format is None or not isinstance(e, BadRequestError)
+                or not _is_structured_output_error(e)):
+            raise
+        print(f"⚠️ Structured output is not supported, parsing JSON from text instead: {e}")
+        _structured_output = False
+        result = await request_completion(prompt, system_prompt, use_cache, stream_json=True)
+    return extract_json_from_string(result)
+
+def _chat_body(prompt: str, system_prompt: Optional[str],
+               response_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """The body of a chat completion request."""
     messages = []
 
     if system_prompt:
@@ -30,31 +224,259 @@ async def request_completion(prompt: str, system_prompt: Optional[str] = None) -
 
     messages.append({"role": "user", "content": prompt})
 
-    completion = await client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages
-    )
+    body: Dict[str, Any] = {"model": MODEL, "messages": messages}
+    if response_format is not None:
+        body["response_format"] = response_format
+    return body
+
+async def _request_completion(prompt: str, system_prompt: Optional[str],
+                              response_format: Optional[Dict[str, Any]] = None,
+                              stream_json: bool = False) -> str:
+    body = _chat_body(prompt, system_prompt, response_format)
+    scheduler = get_scheduler()
+    metrics = get_metrics()
+    estimated_tokens = estimate_tokens(prompt) + estimate_tokens(system_prompt or "")
+
+    def record_usage(usage) -> None:
+        scheduler.record_usage(estimated_tokens, usage.total_tokens)
+        metrics.increment("llm_tokens_total", usage.prompt_tokens,
+                          model=MODEL, kind="prompt")
+        metrics.increment("llm_tokens_total", usage.completion_tokens,
+                          model=MODEL, kind="completion")
+        # Prompt tokens served from the provider's prefix cache
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) if details else None
+        if cached_tokens:
+            metrics.increment("llm_tokens_total", cached_tokens, model=MODEL, kind="cached")
+
+    async def send() -> str:
+        with metrics.timer("llm_attempt_seconds", model=MODEL):
+            response = await get_client().chat.completions.with_raw_response.create(**body)
+        scheduler.observe_headers(response.headers)
+        completion = response.parse()
+        if completion.usage is not None:
+            record_usage(completion.usage)
+        if not completion.choices or not completion.choices[0].message.content:
+            return ""
+        return completion.choices[0].message.content
+
+    async def send_streaming() -> str:
+        # A new parser per attempt, as a retry starts the answer over
+        parser = JSONStreamParser()
+        pieces = []
+        complete = False
+        with metrics.timer("llm_attempt_seconds", model=MODEL):
+            response = await get_client().chat.completions.with_raw_response.create(
+                **body, stream=True, stream_options={"include_usage": True})
+            scheduler.observe_headers(response.headers)
+            stream = response.parse()
+            try:
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        record_usage(chunk.usage)
+                    if complete or not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    pieces.append(chunk.choices[0].delta.content)
+                    # The rest can only be whitespace or chatter, but the stream
+                    # is read to its end for the usage chunk
+                    complete = bool(parser.feed(pieces[-1]))
+            finally:
+                await stream.close()
+        return "".join(pieces)
 
-    if not completion.choices or not completion.choices[0].message.content:
-        return ""
+    # Includes the time spent waiting for the scheduler and retrying
+    with metrics.timer("llm_request_seconds", model=MODEL):
+        return await scheduler.run(send_streaming if stream_json else send, estimated_tokens)
 
-    return completion.choices[0].message.content
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a text, at about four
+    characters per token for English.
+
+    :param text: The input text.
+    :return: The estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+_MATCHING_BRACKET = {"{": "}", "[": "]"}
+
+class _Bracket:
+    """An open bracket of `JSONStreamParser`."""
+
+    def __init__(self, offset: int, closer: str):
+        self.offset = offset
+        self.closer = closer
+        # Closed brackets directly inside: (start, end) offsets of a valid
+        # value, or a list of the values found in an invalid one
+        self.children: List[Union[Tuple[int, int], list]] = []
+        self.invalid = False
+
+class JSONStreamParser:
+    """
+    Find the JSON objects and arrays in a text received in pieces, e.g. a
+    streamed completion, surrounded by any other text.
+
+    Brackets are matched in a single pass that skips string contents, with
+    a stack of the offsets of the open brackets. When a bracket closes, its
+    text is checked with `json.loads` after replacing the values already
+    found inside it by a placeholder, so every character is checked once
+    and the work stays linear in the length of the text. When a bracket
+    turns out to be prose, e.g. "{like this {"a": 1}", or never closes, the
+    values found inside it are used instead. A closing bracket drops the
+    unclosed brackets opened after the one it matches, and is ignored if it
+    matches none.
+    """
+
+    def __init__(self):
+        # Text from the outermost open bracket, as pieces and their offsets
+        self._pieces: List[str] = []
+        self._piece_offsets: List[int] = []
+        self._position = 0
+        self._stack: List[_Bracket] = []
+        self._open_counts = {"}": 0, "]": 0}
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> List[Union[Dict, List]]:
+        """
+        Scan the next piece of text.
+
+        :param text: The text received since the previous call.
+        :return: The JSON values completed by this piece, in order.
+        """
+        values: List[Union[Dict, List]] = []
+        base = self._position
+        self._pieces.append(text)
+        self._piece_offsets.append(base)
+        for index, char in enumerate(text):
+            if not self._stack:
+                if char in _MATCHING_BRACKET:
+                    self._open(base + index, char)
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in _MATCHING_BRACKET:
+                self._open(base + index, char)
+            elif char in "}]" and self._open_counts[char]:
+                self._close(base + index + 1, char, values)
+        self._position = base + len(text)
+        self._trim()
+        return values
+
+    def finish(self) -> List[Union[Dict, List]]:
+        """
+        End the text, giving up on the brackets that are still open.
+
+        :return: The values found inside them, in order.
+        """
+        values: List[Union[Dict, List]] = []
+        while self._stack:
+            bracket = self._pop()
+            if self._stack:
+                self._add_child(bracket.children, valid=False)
+            else:
+                self._emit(bracket.children, values)
+        self.__init__()
+        return values
+
+    def _open(self, offset: int, char: str) -> None:
+        closer = _MATCHING_BRACKET[char]
+        self._stack.append(_Bracket(offset, closer))
+        self._open_counts[closer] += 1
+
+    def _pop(self) -> _Bracket:
+        bracket = self._stack.pop()
+        self._open_counts[bracket.closer] -= 1
+        return bracket
+
+    def _add_child(self, child: Union[Tuple[int, int], list], valid: bool) -> None:
+        parent = self._stack[-1]
+        parent.children.append(child)
+        parent.invalid = parent.invalid or not valid
+
+    def _close(self, end: int, char: str, values: List[Union[Dict, List]]) -> None:
+        bracket = self._pop()
+        # Unclosed brackets opened after the matching one are prose
+        while bracket.closer != char:
+            self._add_child(bracket.children, valid=False)
+            bracket = self._pop()
+
+        valid = not bracket.invalid and self._is_valid(bracket, end)
+        node = (bracket.offset, end) if valid else bracket.children
+        if self._stack:
+            self._add_child(node, valid)
+        else:
+            self._emit(node, values)
+
+    def _is_valid(self, bracket: _Bracket, end: int) -> bool:
+        """Check a closed bracket whose children are all valid values."""
+        parts = []
+        position = bracket.offset
+        for child_start, child_end in bracket.children:
+            parts.append(self._text(position, child_start))
+            parts.append("0")
+            position = child_end
+        parts.append(self._text(position, end))
+        try:
+            json.loads("".join(parts))
+            return True
+        except ValueError:
+            return False
+
+    def _emit(self, node: Union[Tuple[int, int], list],
+              values: List[Union[Dict, List]]) -> None:
+        """Parse the values of a top-level node, in order."""
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, list):
+                pending.extend(reversed(node))
+                continue
+            try:
+                values.append(json.loads(self._text(*node)))
+            except RecursionError:
+                # Valid, but nested too deeply for the decoder
+                pass
+
+    def _text(self, start: int, end: int) -> str:
+        """The text between two offsets, joining only the pieces it spans."""
+        index = bisect.bisect_right(self._piece_offsets, start) - 1
+        parts = []
+        while index < len(self._pieces) and self._piece_offsets[index] < end:
+            piece_offset = self._piece_offsets[index]
+            parts.append(self._pieces[index][max(0, start - piece_offset):end - piece_offset])
+            index += 1
+        return "".join(parts)
+
+    def _trim(self) -> None:
+        """Forget the pieces before the outermost open bracket."""
+        if not self._stack:
+            self._pieces = []
+            self._piece_offsets = []
+            return
+        first = bisect.bisect_right(self._piece_offsets, self._stack[0].offset) - 1
+        if first > 0:
+            del self._pieces[:first]
+            del self._piece_offsets[:first]
 
 def extract_json_from_string(text: str) -> Union[Dict, List]:
     """
-    Extract the first valid JSON object from a string.
+    Extract the first valid JSON object or array from a string.
 
     :param text: The input string containing JSON.
     :return: The extracted JSON object (dict or list).
     :raises ValueError: If no valid JSON object is found.
     """
-    json_pattern = re.compile(r'{.*?}|[.*?]', re.DOTALL)
-    matches = json_pattern.findall(text)
-
-    for match in matches:
-        try:
-            return json.loads(match)
-        except json.JSONDecodeError:
-            continue
-
-    raise ValueError("No valid JSON object found in the input text.")
+    parser = JSONStreamParser()
+    values = parser.feed(text) or parser.finish()
+    if not values:
+        raise ValueError("No valid JSON object found in the input text.")
+    return values[0]
@@ -0,0 +1,289 @@
+"""
+In-process instrumentation of a run.
+
+Every stage records into the process-wide registry returned by
+`get_metrics`: latency histograms of the cached steps, LLM requests and
+Reddit listing pages, cache hit/miss counters, token usage, retries and
+queue depths. At the end of a run the registry can be written as JSON or
+in the Prometheus text format, and `ProgressLine` prints a live summary
+while the run is going.
+"""
+
+import asyncio
+import json
+import math
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"'
+                          for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else repr(bound)
+
+class Histogram:
+    """Cumulative bucket histogram of observed values."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        :param buckets: Increasing upper bounds of the buckets, ending with inf.
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile by linear interpolation within its bucket, as
+        Prometheus' `histogram_quantile` does.
+
+        :param q: The quantile, between 0 and 1.
+        :return: The estimate, or None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                if math.isinf(bound):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound if not math.isinf(bound) else lower
+        return lower
+
+    def to_dict(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[_format_bound(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99), "buckets": buckets}
+
+class Metrics:
+    """Registry of counters, gauges and histograms, keyed on name and labels."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        # Current and highest value of each gauge
+        self.gauges: Dict[str, Dict[Labels, List[float]]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Add to a counter.
+
+        :param name: The counter name.
+        :param value: The amount to add.
+        :param labels: The counter labels.
+        """
+        series = self.counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """
+        Set a gauge, keeping track of its highest value.
+
+        :param name: The gauge name.
+        :param value: The current value.
+        :param labels: The gauge labels.
+        """
+        series = self.gauges.setdefault(name, {})
+        key = _labels(labels)
+        if key in series:
+            series[key][0] = value
+            series[key][1] = max(series[key][1], value)
+        else:
+            series[key] = [value, value]
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Record a value, usually a latency in seconds, in a histogram.
+
+        :param name: The histogram name.
+        :param value: The observed value.
+        :param labels: The histogram labels.
+        """
+        series = self.histograms.setdefault(name, {})
+        key = _labels(labels)
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observe the time spent in the block, including when it fails."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_total(self, name: str, **labels) -> float:
+        """Return the sum of the series of a counter matching the labels."""
+        wanted = set(_labels(labels))
+        return sum(value for key, value in self.counters.get(name, {}).items()
+                   if wanted <= set(key))
+
+    def histogram_total(self, name: str) -> Histogram:
+        """Return the merge of every series of a histogram."""
+        merged = Histogram()
+        for histogram in self.histograms.get(name, {}).values():
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.count += histogram.count
+            merged.sum += histogram.sum
+        return merged
+
+    def to_dict(self) -> dict:
+        """
+        :return: A JSON-serializable report of every metric.
+        """
+        def series(metric: Dict[Labels, object], render) -> list:
+            return [{"labels": dict(key), **render(value)}
+                    for key, value in sorted(metric.items())]
+
+        return {
+            "started_at": self.started_at,
+            "duration_seconds": time.time() - self.started_at,
+            "counters": {name: series(metric, lambda value: {"value": value})
+                         for name, metric in sorted(self.counters.items())},
+            "gauges": {name: series(metric, lambda value: {"value": value[0], "max": value[1]})
+                       for name, metric in sorted(self.gauges.items())},
+            "histograms": {name: series(metric, Histogram.to_dict)
+                           for name, metric in sorted(self.histograms.items())},
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Every metric in the Prometheus text exposition format, with
+            names prefixed by "outreach_".
+        """
+        lines = []
+        for name, metric in sorted(self.counters.items()):
+            lines.append(f"# TYPE outreach_{name} counter")
+            for key, value in sorted(metric.items()):
+                lines.append(f"outreach_{name}{_format_labels(key)} {value}")
+        for name, metric in sorted(self.gauges.items()):
+            lines.append(f"# TYPE outreach_{name} gauge")
+            for key, (value, _) in sorted(metric.items()):
+                lines.append(f"outreach_{name}{_format_labels(key)} {value}")
+            lines.append(f"# TYPE outreach_{name}_max gauge")
+            for key, (_, highest) in sorted(metric.items()):
+                lines.append(f"outreach_{name}_max{_format_labels(key)} {highest}")
+        for name, metric in sorted(self.histograms.items()):
+            lines.append(f"# TYPE outreach_{name} histogram")
+            for key, histogram in sorted(metric.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    bucket_labels = _format_labels(key, (("le", _format_bound(bound)),))
+                    lines.append(f"outreach_{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"outreach_{name}_sum{_format_labels(key)} {histogram.sum}")
+                lines.append(f"outreach_{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path: str) -> None:
+        """
+        Write the report to a file, in the Prometheus text format if the path
+        ends with ".prom" or ".txt", and as JSON otherwise.
+
+        :param path: The output file path.
+        """
+        if path.endswith((".prom", ".txt")):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+
+    def summary(self) -> str:
+        """
+        :return: A one-line summary of the run so far.
+        """
+        elapsed = time.time() - self.started_at
+        requests = self.histogram_total("llm_request_seconds")
+        p50 = requests.quantile(0.5)
+        llm_hits = self.counter_total("cache_requests_total", cache="llm", result="hit")
+        llm_lookups = self.counter_total("cache_requests_total", cache="llm")
+        in_flight = self.gauges.get("llm_in_flight", {}).get((), [0, 0])[0]
+        tokens = self.counter_total("llm_tokens_total")
+        retries = self.counter_total("llm_retries_total")
+        posts = self.counter_total("reddit_posts_fetched_total")
+        return (f"⏱️ {elapsed:.0f}s | 🔍 {posts:.0f} posts"
+                f" | 🤖 {requests.count} LLM requests ({in_flight:.0f} in flight"
+                f", p50 {p50 or 0:.2f}s) | 🗃️ LLM cache {llm_hits:.0f}/{llm_lookups:.0f}"
+                f" | 🪙 {tokens:.0f} tokens | 🔁 {retries:.0f} retries")
+
+_metrics: Optional[Metrics] = None
+
+def get_metrics() -> Metrics:
+    """
+    :return: The process-wide metrics registry.
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+class ProgressLine:
+    """Async context manager printing `Metrics.summary` to stderr periodically."""
+
+    def __init__(self, metrics: Optional[Metrics] = None, interval: float = 1.0):
+        """
+        :param metrics: The registry to summarize, defaults to `get_metrics()`.
+        :param interval: Seconds between two updates.
+        """
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            sys.stderr.write("\r\033[K" + self.metrics.summary())
+            sys.stderr.flush()
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> "ProgressLine":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        sys.stderr.write("\r\033[K" + self.metrics.summary() + "\n")
+        sys.stderr.flush()
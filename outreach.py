@@ -1,22 +1,80 @@
 """Starting point of the application."""
 
 import argparse
+import multiprocessing
 import os
 import asyncio
+import socket
+import time
+from contextlib import nullcontext
 from datetime import datetime, timedelta
+from typing import Callable, ContextManager, Dict, List, NamedTuple, Optional, Tuple
 from dotenv import load_dotenv
-from video_utils import extract_video_details
-from reddit_search import get_reddit_instance, search_posts, RedditPost
-from post_analysis import analyze_posts, generate_engagement_content
-from keyword_extractor import get_relevant_keywords
-from cache_utils import get_video_hash, cache_result
-from csv_utils import save_posts_to_csv
+from video_utils import fetch_video_details, fetch_many_video_details, extract_playlist_urls
+from reddit_search import (RedditInitError, RedditSession, get_reddit_instance, search_posts, iter_posts, RedditPost,
+                           KeywordCache, SearchFilter, SearchStats, discover_subreddits,
+                           HighWaterMark)
+from post_analysis import analyze_posts, iter_engagement_content, RelevanceStats
+from keyword_extractor import get_relevant_keywords, filter_subreddits
+from cache_utils import get_video_hash, cache_result, get_cache_store
+from export_utils import CsvExporter, PostExporter, get_video_csv_path, make_export_row, open_exporter
+from pipeline import stream_outreach
+from post_index import PostIndex
+from post_store import get_post_body_store
+from llm_utils import set_max_concurrent_requests, set_budget_share, estimate_tokens
+from video_context import summarize_video, format_video_context
+from job_queue import JobQueue, DEFAULT_LEASE_SECONDS
+from metrics import get_metrics, ProgressLine
 
 # Constants
 COMMENT_THRESHOLD = 10
 TIME_THRESHOLD_IN_MONTHS = 3  # in months
 SECTION_SEPARATOR = "=" * 20
 POST_SEPARATOR = "-" * 20
+DEFAULT_MAX_CONCURRENT_VIDEOS = 3
+# Minimum time between two checkpoints of the generated comments, in seconds
+COMMENT_CHECKPOINT_INTERVAL = 5
+# How often an idle worker checks the job queue, in seconds
+WORKER_POLL_INTERVAL = 5
+
+# The filter_posts predicates, in the form pushed down into the Reddit search
+SEARCH_FILTER = SearchFilter(
+    max_age_seconds=TIME_THRESHOLD_IN_MONTHS * 30 * 24 * 60 * 60,
+    max_comments=COMMENT_THRESHOLD
+)
+
+class RunOptions(NamedTuple):
+    """Options shared by every video of a run."""
+    # Stream each post through the later stages as soon as it is found
+    stream: bool = False
+    # Send the time window to Reddit and filter posts while paging
+    server_filter: bool = False
+    # Classify several posts per relevance request
+    batched_relevance: bool = False
+    # Rank posts locally and only check the best ones with the LLM
+    prefilter_top_k: Optional[int] = None
+    prefilter_threshold: Optional[float] = None
+    prefilter_method: str = "bm25"
+    # Use application-only Reddit auth, which is enough for searching
+    read_only: bool = False
+    # Discard the saved Reddit refresh token and authorize again
+    reauthorize: bool = False
+    # Search relevant subreddits instead of r/all
+    target_subreddits: bool = False
+    # Reuse fresh search results and relevance verdicts from the post index
+    post_index: bool = False
+    # Only fetch and analyze the posts published since the previous run
+    incremental: bool = False
+    # Write the run's metrics to this file (.prom/.txt: Prometheus text, else JSON)
+    metrics_path: Optional[str] = None
+    # Print a live progress line to stderr
+    progress: bool = False
+    # Also append every video's rows to this file (.parquet: Parquet, else CSV)
+    export_path: Optional[str] = None
+    # Send relevance and comment requests as batch jobs of this backend
+    deferred: Optional[str] = None
+    # Judge and comment on each group of near-duplicate posts once
+    cluster_duplicates: bool = False
 
 # Load environment variables from .env file at the start of the script
 load_dotenv()
@@ -40,33 +98,294 @@ def filter_posts(posts: list[RedditPost]) -> list[RedditPost]:
 @cache_result("video_details")
 async def get_video_details(video_url: str, video_hash: str) -> tuple:
     """Extract video details and save to cache if not already cached."""
-    title, description = extract_video_details(video_url)
-    return title, description
+    return await fetch_video_details(video_url)
 
 @cache_result("keywords")
 async def get_keywords(video_title: str, video_description: str, video_hash: str) -> list:
     """Get relevant keywords and save to cache if not already cached."""
     return await get_relevant_keywords(video_title, video_description)
 
+@cache_result("video_context")
+async def get_video_context(video_title: str, video_description: str, video_hash: str) -> str:
+    """Summarize the video for post-level prompts and save to cache if not already cached."""
+    return await summarize_video(video_title, video_description)
+
+@cache_result("subreddits")
+async def get_subreddits(reddit: RedditSession, keywords: list, video_title: str, video_description: str,
+                         video_hash: str) -> list:
+    """Discover and filter relevant subreddits and save to cache if not already cached."""
+    candidates = await discover_subreddits(await reddit.get(), keywords)
+    if not candidates:
+        return []
+    return await filter_subreddits(video_title, video_description, candidates)
+
 @cache_result("filtered_posts")
-async def get_reddit_posts(reddit, keywords: list, video_hash: str) -> list[RedditPost]:
+async def get_reddit_posts(reddit: RedditSession, keywords: list, video_hash: str,
+                           keyword_cache: Optional[KeywordCache] = None,
+                           server_filter: bool = False,
+                           subreddits: Optional[list] = None,
+                           post_index: Optional[PostIndex] = None) -> list[RedditPost]:
     """Search for Reddit posts and save to cache if not already cached."""
-    posts = await search_posts(reddit, keywords)
+    search_filter = SEARCH_FILTER if server_filter else None
+    stats = SearchStats()
+    posts = await search_posts(await reddit.get(), keywords, keyword_cache=keyword_cache,
+                               search_filter=search_filter, stats=stats,
+                               subreddits=subreddits, post_index=post_index)
+    if server_filter or post_index is not None:
+        print(f"📊 Search: {stats}")
     return filter_posts(posts)
 
+async def update_reddit_posts(reddit: RedditSession, keywords: list, video_hash: str,
+                              keyword_cache: Optional[KeywordCache] = None,
+                              server_filter: bool = False,
+                              subreddits: Optional[list] = None,
+                              post_index: Optional[PostIndex] = None
+) -> Tuple[List[RedditPost], List[RedditPost], Dict[str, HighWaterMark]]:
+    """
+    Fetch the posts published since the previous run of each search and
+    merge them with the cached posts.
+
+    The newest post seen by each search is its new high-water mark, so the
+    next run only pages through newer posts. Nothing is saved here: call
+    `save_search_state` once the new posts have been analyzed, so the posts
+    of an interrupted run are still new for the next one.
+
+    :return: All the filtered posts, those that were not cached before, and
+        the updated high-water marks.
+    """
+    store = get_cache_store()
+    found, cached_posts = await store.get(video_hash, "filtered_posts")
+    cached_posts = cached_posts if found else []
+    found, high_water_marks = await store.get(video_hash, "search_state")
+    high_water_marks: Dict[str, HighWaterMark] = dict(high_water_marks) if found else {}
+
+    search_filter = SEARCH_FILTER if server_filter else None
+    stats = SearchStats()
+    fetched_posts = await search_posts(await reddit.get(), keywords, keyword_cache=keyword_cache,
+                                       search_filter=search_filter, stats=stats,
+                                       subreddits=subreddits, post_index=post_index,
+                                       high_water_marks=high_water_marks)
+    print(f"📊 Search: {stats}")
+
+    # Fetched posts replace their cached copy, which may have fewer comments
+    fetched_ids = {post.id for post in fetched_posts}
+    merged = {post.id: post for post in cached_posts if post.id not in fetched_ids}
+    merged.update((post.id, post) for post in fetched_posts)
+    posts = filter_posts(list(merged.values()))
+
+    cached_ids = {post.id for post in cached_posts}
+    return posts, [post for post in posts if post.id not in cached_ids], high_water_marks
+
+async def save_search_state(video_hash: str, posts: List[RedditPost],
+                            high_water_marks: Dict[str, HighWaterMark]) -> None:
+    """
+    Save the posts and high-water marks of an incremental search (see
+    `update_reddit_posts`), once its new posts have verdicts.
+
+    :param video_hash: The video hash.
+    :param posts: All the filtered posts.
+    :param high_water_marks: The updated high-water marks.
+    """
+    store = get_cache_store()
+    await store.set(video_hash, "filtered_posts", posts)
+    await store.set(video_hash, "search_state", high_water_marks)
+    # The bodies of older posts are referenced again, so pruning keeps them
+    await asyncio.to_thread(get_post_body_store().touch, [post.id for post in posts])
+
+async def _prefilter(posts: list[RedditPost], video_title: str, video_description: str,
+                     options: RunOptions) -> list[RedditPost]:
+    """Rank posts locally and keep the best ones, if the options ask for it."""
+    if options.prefilter_top_k is None and options.prefilter_threshold is None:
+        return posts
+    # Imported here, as loading NumPy is only worth it when ranking
+    from post_ranking import prefilter_posts
+
+    candidate_count = len(posts)
+    posts = await prefilter_posts(posts, video_title, video_description,
+                                  top_k=options.prefilter_top_k,
+                                  threshold=options.prefilter_threshold,
+                                  method=options.prefilter_method)
+    print(f"🎯 Local ranking kept {len(posts)} of {candidate_count} posts.\n{SECTION_SEPARATOR}")
+    return posts
+
+async def _cluster(posts: list[RedditPost], options: RunOptions) -> Dict[str, str]:
+    """Group near-duplicate posts, if the options ask for it."""
+    if not options.cluster_duplicates:
+        return {}
+    # Imported here, as loading NumPy is only worth it when clustering
+    from post_clustering import cluster_posts
+
+    clusters = await cluster_posts(posts)
+    cluster_count = len(set(clusters.values()))
+    print(f"🧬 Near-duplicates: {len(posts)} posts in {cluster_count} clusters,"
+          f" {len(posts) - cluster_count} fewer relevance checks.\n{SECTION_SEPARATOR}")
+    return clusters
+
+async def _analyze_posts(posts: list[RedditPost], video_title: str, video_description: str,
+                         video_hash: str, batched: bool = False,
+                         post_index: Optional[PostIndex] = None,
+                         clusters: Optional[Dict[str, str]] = None) -> list:
+    """Analyze Reddit posts for relevance, reusing the verdicts of the post index."""
+    known_verdicts = {}
+    if post_index is not None:
+        known_verdicts = await asyncio.to_thread(
+            post_index.get_verdicts, video_hash, [post.id for post in posts])
+        if known_verdicts:
+            print(f"♻️ Reusing {len(known_verdicts)} relevance verdicts from the post index.")
+    unjudged_posts = [post for post in posts if post.id not in known_verdicts]
+
+    stats = RelevanceStats()
+    newly_relevant = await analyze_posts(unjudged_posts, video_title, video_description,
+                                         batched=batched, stats=stats, clusters=clusters)
+    if batched:
+        print(f"🪙 Batched relevance: {stats}")
+
+    relevant_ids = {post.id for post in newly_relevant}
+    if post_index is not None:
+        await asyncio.to_thread(post_index.put_verdicts, video_hash,
+                                {post.id: post.id in relevant_ids for post in unjudged_posts})
+    return [post for post in posts
+            if known_verdicts.get(post.id) or post.id in relevant_ids]
+
 @cache_result("relevant_posts")
-async def analyze_reddit_posts(posts: list[RedditPost], video_title: str, video_description: str, video_hash: str) -> list:
+async def analyze_reddit_posts(posts: list[RedditPost], video_title: str, video_description: str, video_hash: str,
+                               batched: bool = False,
+                               post_index: Optional[PostIndex] = None,
+                               clusters: Optional[Dict[str, str]] = None) -> list:
     """Analyze Reddit posts for relevance and save to cache if not already cached."""
-    return await analyze_posts(posts, video_title, video_description)
+    return await _analyze_posts(posts, video_title, video_description, video_hash,
+                                batched, post_index, clusters)
 
-async def main(video_url: str) -> None:
+async def update_relevant_posts(posts: list[RedditPost], new_posts: list[RedditPost],
+                                video_title: str, video_description: str, video_hash: str,
+                                options: RunOptions = RunOptions(),
+                                post_index: Optional[PostIndex] = None,
+                                clusters: Optional[Dict[str, str]] = None) -> list:
     """
-    Main function to extract video details and initialize Reddit.
+    Analyze only the new posts for relevance and merge them with the cached
+    relevant posts that are still current. Every post is analyzed if no
+    relevant posts are cached yet.
 
+    :param posts: All the current filtered posts.
+    :param new_posts: The posts not seen by the previous run.
+    :param clusters: Optional cluster ID of each post, to judge each
+        cluster of near-duplicates once. A new post in the cluster of a post
+        judged by an earlier run gets its verdict.
+    :return: The relevant posts, in the order of `posts`.
+    """
+    store = get_cache_store()
+    found, cached_relevant = await store.get(video_hash, "relevant_posts")
+    cached_relevant = cached_relevant if found else []
+    candidates = new_posts if found else posts
+    if found:
+        print(f"🆕 {len(new_posts)} new posts since the last run.\n{SECTION_SEPARATOR}")
+
+    inherited_relevant = []
+    if found and clusters:
+        new_ids = {post.id for post in new_posts}
+        judged_clusters = {clusters.get(post.id, post.id) for post in posts
+                           if post.id not in new_ids}
+        relevant_clusters = {clusters.get(post.id, post.id) for post in cached_relevant}
+        known = [post for post in candidates if clusters.get(post.id, post.id) in judged_clusters]
+        if known:
+            print(f"🧬 Reusing the verdicts of earlier posts for {len(known)} new near-duplicates.")
+        inherited_relevant = [post for post in known
+                              if clusters.get(post.id, post.id) in relevant_clusters]
+        candidates = [post for post in candidates
+                      if clusters.get(post.id, post.id) not in judged_clusters]
+
+    candidates = await _prefilter(candidates, video_title, video_description, options)
+    newly_relevant = await _analyze_posts(candidates, video_title, video_description,
+                                          video_hash, options.batched_relevance, post_index,
+                                          clusters)
+
+    relevant_ids = ({post.id for post in cached_relevant}
+                    | {post.id for post in newly_relevant}
+                    | {post.id for post in inherited_relevant})
+    relevant_posts = [post for post in posts if post.id in relevant_ids]
+    await store.set(video_hash, "relevant_posts", relevant_posts)
+    return relevant_posts
+
+async def generate_comments(video_url: str, video_title: str, posts: list[RedditPost],
+                            video_hash: str,
+                            on_comment: Optional[Callable[[RedditPost, str], None]] = None,
+                            video_summary: str = "",
+                            clusters: Optional[Dict[str, str]] = None
+) -> Dict[str, str]:
+    """
+    Generate comments for the relevant posts, checkpointing them every few
+    seconds and when generation stops, also on an error or interruption, so
+    an interrupted run resumes where it stopped.
+
+    :param on_comment: Optional callback given each post and its comment,
+        the checkpointed ones first, then each new one as soon as it is ready.
+    :param video_summary: Optional compact summary of the video.
+    :param clusters: Optional cluster ID of each post, which share one
+        comment per cluster of near-duplicates.
+    :return: The generated comments, by post ID.
+    """
+    store = get_cache_store()
+    found, checkpoint = await store.get(video_hash, "comments")
+    comments: Dict[str, str] = dict(checkpoint) if found else {}
+    reused = 0
+    if clusters:
+        # A new near-duplicate of a post commented on by an earlier run shares its comment
+        cluster_comments = {clusters.get(post_id, post_id): comment
+                            for post_id, comment in comments.items()}
+        for post in posts:
+            cluster_id = clusters.get(post.id, post.id)
+            if post.id not in comments and cluster_id in cluster_comments:
+                comments[post.id] = cluster_comments[cluster_id]
+                reused += 1
+    pending = [post for post in posts if post.id not in comments]
+    if len(pending) < len(posts):
+        print(f"♻️ Resuming: {len(posts) - len(pending)} comments already generated.")
+
+    posts_by_id = {post.id: post for post in posts}
+    if on_comment is not None:
+        for post in posts:
+            if post.id in comments:
+                on_comment(post, comments[post.id])
+
+    # Each checkpoint rewrites every comment, so they are not saved one by one
+    unsaved = reused
+    saved_at = time.monotonic()
+    try:
+        async for post_id, comment in iter_engagement_content(video_url, video_title, pending,
+                                                              video_summary=video_summary,
+                                                              clusters=clusters):
+            comments[post_id] = comment
+            unsaved += 1
+            if time.monotonic() - saved_at >= COMMENT_CHECKPOINT_INTERVAL:
+                await store.set(video_hash, "comments", comments)
+                unsaved = 0
+                saved_at = time.monotonic()
+            if on_comment is not None:
+                on_comment(posts_by_id[post_id], comment)
+    finally:
+        if unsaved:
+            await store.set(video_hash, "comments", comments)
+    return comments
+
+async def process_video(reddit: RedditSession, video_url: str,
+                        keyword_cache: Optional[KeywordCache] = None,
+                        options: RunOptions = RunOptions(),
+                        exporter: Optional[PostExporter] = None) -> Optional[str]:
+    """
+    Run the whole outreach pipeline for a single video.
+
+    :param reddit: Reddit session, initialized when a search is not cached.
     :param video_url: URL of the YouTube video.
+    :param keyword_cache: Optional keyword search cache shared between videos.
+    :param options: Options for the run.
+    :param exporter: Optional export file shared between videos, which also
+        gets the posts that were not relevant.
+    :return: The path to the saved CSV file, or None if nothing was saved.
     """
+    started_at = time.time()
     # Generate video hash
     video_hash = get_video_hash(video_url)
+    post_index = PostIndex(max_comments=COMMENT_THRESHOLD) if options.post_index else None
 
     # Extract video details
     video_title, video_description = await get_video_details(video_url=video_url, video_hash=video_hash)
@@ -77,56 +396,484 @@ async def main(video_url: str) -> None:
     keywords = await get_keywords(video_title=video_title, video_description=video_description, video_hash=video_hash)
 
     if not keywords:
-        print("Error: Unable to extract keywords.")
-        return
+        print(f"Error: Unable to extract keywords for {video_url}.")
+        return None
 
     print(f"🔑 Suggested Keywords:\n{' - '.join(keywords)}\n{SECTION_SEPARATOR}")
 
-    # Initialize Reddit
-    reddit = None
-    try:
-        reddit = await get_reddit_instance()
-        print(f"🚀 Reddit initialized successfully.\n{SECTION_SEPARATOR}")
+    # Every post-level prompt uses this compact summary instead of the description
+    video_summary = await get_video_context(video_title=video_title, video_description=video_description,
+                                            video_hash=video_hash)
+    full_context_tokens = estimate_tokens(format_video_context(video_title, video_description))
+    context_tokens = estimate_tokens(format_video_context(video_title, video_summary))
+    print(f"🧾 Video context: ~{context_tokens} tokens per prompt instead of"
+          f" ~{full_context_tokens} with the full description.\n{SECTION_SEPARATOR}")
 
-        # Search for posts based on keywords
-        posts = await get_reddit_posts(reddit=reddit, keywords=keywords, video_hash=video_hash)
+    subreddits = None
+    if options.target_subreddits:
+        subreddits = await get_subreddits(reddit=reddit, keywords=keywords, video_title=video_title,
+                                          video_description=video_description, video_hash=video_hash)
+        if subreddits:
+            print(f"📚 Searching subreddits:\n{', '.join(subreddits)}\n{SECTION_SEPARATOR}")
+        else:
+            print(f"No relevant subreddits found, searching r/all.\n{SECTION_SEPARATOR}")
 
-        if not posts:
-            print("Error: Unable to find matching posts.")
-            return
+    if options.stream:
+        return await stream_video(reddit, video_url, video_hash, video_title,
+                                  video_summary, keywords, keyword_cache,
+                                  options, subreddits, post_index, exporter, started_at)
 
-        print(f"🔍 Found {len(posts)} posts matching the criteria. Analyzing relevance...\n{SECTION_SEPARATOR}")
+    with _deferred_requests(options):
+        return await _process_posts(reddit, video_url, video_hash, video_title, video_summary,
+                                    keywords, keyword_cache, options, subreddits, post_index,
+                                    exporter, started_at)
 
-        # Analyze posts for relevance
-        relevant_posts = await analyze_reddit_posts(posts=posts, video_title=video_title, video_description=video_description, video_hash=video_hash)
+def _deferred_requests(options: RunOptions) -> ContextManager:
+    """Defer the LLM requests of a block to batch jobs if the run asks for it."""
+    if options.deferred is None:
+        return nullcontext()
+    # Only loaded by deferred runs
+    from llm_batch import deferred_requests
+    return deferred_requests(options.deferred)
 
-        if not relevant_posts:
-            print("Error: No relevant posts found.")
-            return
+async def _process_posts(reddit: RedditSession, video_url: str, video_hash: str,
+                         video_title: str, video_summary: str, keywords: List[str],
+                         keyword_cache: Optional[KeywordCache], options: RunOptions,
+                         subreddits: Optional[List[str]], post_index: Optional[PostIndex],
+                         exporter: Optional[PostExporter], started_at: float) -> Optional[str]:
+    """Search, analyze and comment on the posts of a video (see `process_video`)."""
+    # Search for posts based on keywords
+    if options.incremental:
+        posts, new_posts, high_water_marks = await update_reddit_posts(
+            reddit, keywords, video_hash, keyword_cache=keyword_cache,
+            server_filter=options.server_filter, subreddits=subreddits,
+            post_index=post_index)
+    else:
+        posts = await get_reddit_posts(reddit=reddit, keywords=keywords, video_hash=video_hash,
+                                       keyword_cache=keyword_cache,
+                                       server_filter=options.server_filter,
+                                       subreddits=subreddits, post_index=post_index)
+
+    if not posts:
+        print(f"Error: Unable to find matching posts for {video_url}.")
+        return None
+
+    print(f"🔍 Found {len(posts)} posts matching the criteria. Analyzing relevance...\n{SECTION_SEPARATOR}")
+    clusters = await _cluster(posts, options)
+
+    # Analyze posts for relevance
+    if options.incremental:
+        relevant_posts = await update_relevant_posts(posts, new_posts, video_title,
+                                                     video_summary, video_hash,
+                                                     options, post_index, clusters)
+        await save_search_state(video_hash, posts, high_water_marks)
+    else:
+        posts = await _prefilter(posts, video_title, video_summary, options)
+        relevant_posts = await analyze_reddit_posts(posts=posts, video_title=video_title, video_description=video_summary, video_hash=video_hash,
+                                                    batched=options.batched_relevance,
+                                                    post_index=post_index, clusters=clusters)
+
+    if exporter is not None:
+        relevant_ids = {post.id for post in relevant_posts}
+        for post in posts:
+            if post.id not in relevant_ids:
+                exporter.write(make_export_row(video_url, post, None, started_at, relevant=False,
+                                               cluster_id=clusters.get(post.id)))
+
+    if not relevant_posts:
+        print(f"Error: No relevant posts found for {video_url}.")
+        return None
+
+    print(f"✔️ Found {len(relevant_posts)} relevant posts. Generating comments...\n{SECTION_SEPARATOR}")
+
+    # Generate engagement content, saving each comment to CSV as it is ready
+    with CsvExporter(get_video_csv_path(video_hash)) as writer:
+        def export(post: RedditPost, comment: str) -> None:
+            row = make_export_row(video_url, post, comment, started_at,
+                                  cluster_id=clusters.get(post.id))
+            writer.write(row)
+            if exporter is not None:
+                exporter.write(row)
+
+        comments = await generate_comments(video_url, video_title, relevant_posts,
+                                           video_hash, export, video_summary, clusters)
 
-        print(f"✔️ Found {len(relevant_posts)} relevant posts. Generating comments...\n{SECTION_SEPARATOR}")
+    for post in relevant_posts:
+        if post.id not in comments:
+            continue
+        print(f"📝 Post Title: {post.title}")
+        print(f"💬 Generated Comment: {comments[post.id]}")
+        print(f"🔗 Post URL: {post.url}\n{POST_SEPARATOR}")
 
-        # Generate engagement content
-        comments = await generate_engagement_content(video_url, video_title, relevant_posts)
+    failed_count = sum(1 for post in relevant_posts if post.id not in comments)
+    if failed_count:
+        print(f"⚠️ {failed_count} comments failed and will be retried on the next run.")
 
-        for post, comment in zip(relevant_posts, comments):
+    print(f"📁 Relevant posts and comments have been saved to {writer.path}")
+    return writer.path
+
+async def stream_video(reddit: RedditSession, video_url: str, video_hash: str, video_title: str,
+                       video_description: str, keywords: List[str],
+                       keyword_cache: Optional[KeywordCache] = None,
+                       options: RunOptions = RunOptions(),
+                       subreddits: Optional[List[str]] = None,
+                       post_index: Optional[PostIndex] = None,
+                       exporter: Optional[PostExporter] = None,
+                       started_at: Optional[float] = None) -> Optional[str]:
+    """
+    Stream posts from search to comment generation, writing each CSV row as
+    soon as its comment is ready. The per-step post caches are not used.
+
+    :param exporter: Optional export file shared between videos.
+    :param started_at: When the video's run started, defaults to now.
+    :return: The path to the saved CSV file, or None if nothing was saved.
+    """
+    started_at = started_at if started_at is not None else time.time()
+    search_filter = SEARCH_FILTER if options.server_filter else None
+    stats = SearchStats()
+    posts = iter_posts(await reddit.get(), keywords, keyword_cache=keyword_cache,
+                       search_filter=search_filter, stats=stats,
+                       subreddits=subreddits, post_index=post_index)
+    count = 0
+    with CsvExporter(get_video_csv_path(video_hash)) as writer:
+        async for post, comment in stream_outreach(posts, video_url, video_title,
+                                                   video_description, filter_posts):
+            count += 1
+            row = make_export_row(video_url, post, comment, started_at)
+            writer.write(row)
+            if exporter is not None:
+                exporter.write(row)
             print(f"📝 Post Title: {post.title}")
             print(f"💬 Generated Comment: {comment}")
             print(f"🔗 Post URL: {post.url}\n{POST_SEPARATOR}")
 
-        # Save to CSV
-        csv_path = save_posts_to_csv(relevant_posts, comments, f"{video_hash}_relevant_posts.csv")
-        print(f"📁 Relevant posts and comments have been saved to {csv_path}")
-    except RuntimeError as e:
-        print(f"Error initializing Reddit: {e}")
+    if options.server_filter or post_index is not None:
+        print(f"📊 Search: {stats}")
+
+    if not count:
+        print(f"Error: No relevant posts found for {video_url}.")
+        os.remove(writer.path)
+        return None
+
+    print(f"📁 {count} relevant posts and comments have been saved to {writer.path}")
+    return writer.path
+
+async def main(video_url: str) -> None:
+    """
+    Main function to extract video details and initialize Reddit.
+
+    :param video_url: URL of the YouTube video.
+    """
+    await main_batch([video_url], max_concurrent_videos=1)
+
+async def main_batch(video_urls: List[str],
+                     max_concurrent_videos: int = DEFAULT_MAX_CONCURRENT_VIDEOS,
+                     max_concurrent_requests: Optional[int] = None,
+                     options: RunOptions = RunOptions()) -> None:
+    """
+    Run the pipeline for many videos in one process, sharing a single Reddit
+    session, LLM client and keyword search cache.
+
+    :param video_urls: URLs of the YouTube videos.
+    :param max_concurrent_videos: Maximum number of videos processed at once.
+    :param max_concurrent_requests: Optional global budget of in-flight LLM
+        requests, shared by all videos.
+    :param options: Options for the run.
+    """
+    if max_concurrent_requests is not None:
+        set_max_concurrent_requests(max_concurrent_requests)
+
+    # Only logs in once a search actually needs Reddit
+    reddit = RedditSession(read_only=options.read_only, reauthorize=options.reauthorize)
+
+    store = get_cache_store()
+    uncached_urls = [url for url in video_urls
+                     if not (await store.get(get_video_hash(url), "video_details"))[0]]
+    if len(uncached_urls) > 1:
+        # Resolve the details of every new video in one pass, on the thread pool
+        try:
+            await fetch_many_video_details(uncached_urls)
+        except Exception as e:
+            print(f"⚠️ Could not prefetch every video's details, retrying per video: {e}")
+
+    semaphore = asyncio.Semaphore(max_concurrent_videos)
+    keyword_cache: KeywordCache = {}
+
+    async def run(video_url: str, exporter: Optional[PostExporter]) -> Optional[str]:
+        async with semaphore:
+            return await process_video(reddit, video_url, keyword_cache, options, exporter)
+
+    export = (open_exporter(options.export_path, append=True)
+              if options.export_path else nullcontext())
+    progress = ProgressLine() if options.progress else nullcontext()
+    try:
+        with export as exporter:
+            async with progress:
+                results = await asyncio.gather(*[run(url, exporter) for url in video_urls],
+                                               return_exceptions=True)
+        if exporter is not None:
+            print(f"📤 Exported {exporter.written} new rows to {exporter.path}")
+    finally:
+        await reddit.close()
+        if options.metrics_path:
+            get_metrics().write_report(options.metrics_path)
+            print(f"📈 Metrics have been saved to {options.metrics_path}")
+
+    init_error = next((result for result in results if isinstance(result, RedditInitError)), None)
+    if init_error is not None:
+        print(f"Error initializing Reddit: {init_error}")
+
+    if len(video_urls) == 1:
+        if isinstance(results[0], BaseException) and results[0] is not init_error:
+            raise results[0]
+    else:
+        print(f"\n{SECTION_SEPARATOR}\n📦 Batch summary\n{SECTION_SEPARATOR}")
+        for url, result in zip(video_urls, results):
+            if isinstance(result, BaseException):
+                print(f"❌ {url}: {result}")
+            elif result is None:
+                print(f"⚠️ {url}: no output")
+            else:
+                print(f"✅ {url}: {result}")
+
+async def _renew_lease(queue: JobQueue, job_id: int, worker: str) -> None:
+    """Renew a job's lease until cancelled, a few times per lease period."""
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        if not await asyncio.to_thread(queue.renew, job_id, worker):
+            print(f"⚠️ {worker} lost the lease of job {job_id}, it may run twice.")
+            return
+
+async def run_worker(worker: str,
+                     max_concurrent_videos: int = 1,
+                     lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                     options: RunOptions = RunOptions()) -> None:
+    """
+    Process jobs from the job queue until no job is pending or leased.
+
+    Each job runs with the options it was enqueued with. A job is completed
+    only once its video is processed, so the jobs of a crashed worker are
+    leased again when their lease expires.
+
+    :param worker: A name identifying the worker, unique across processes.
+    :param max_concurrent_videos: Maximum number of jobs processed at once.
+    :param lease_seconds: How long a job stays reserved without a renewal.
+    :param options: Reddit auth, metrics and export options of the worker.
+    """
+    queue = JobQueue(lease_seconds=lease_seconds)
+    reddit = RedditSession(read_only=options.read_only)
+    keyword_cache: KeywordCache = {}
+
+    async def run_slot(exporter: Optional[PostExporter]) -> None:
+        while True:
+            job = await asyncio.to_thread(queue.lease, worker)
+            if job is None:
+                # Other workers' jobs may still come back if their lease expires
+                if not await asyncio.to_thread(queue.has_unfinished):
+                    return
+                await asyncio.sleep(WORKER_POLL_INTERVAL)
+                continue
+
+            print(f"👷 {worker} started job {job.id} (attempt {job.attempts}): {job.video_url}")
+            job_options = RunOptions(**{name: value for name, value in job.options.items()
+                                        if name in RunOptions._fields})
+            heartbeat = asyncio.create_task(_renew_lease(queue, job.id, worker))
+            try:
+                result = await process_video(reddit, job.video_url, keyword_cache,
+                                             job_options, exporter)
+            except RedditInitError as e:
+                # Every later search would fail too, so stop taking jobs
+                await asyncio.to_thread(queue.fail, job.id, worker, str(e))
+                print(f"Error initializing Reddit: {e}")
+                return
+            except Exception as e:
+                retried = await asyncio.to_thread(queue.fail, job.id, worker, str(e))
+                print(f"❌ {worker} failed job {job.id}{' (will retry)' if retried else ''}: {e}")
+            else:
+                await asyncio.to_thread(queue.complete, job.id, worker, result)
+                print(f"✅ {worker} finished job {job.id}: {result or 'no output'}")
+            finally:
+                heartbeat.cancel()
+
+    export = (open_exporter(options.export_path, append=True)
+              if options.export_path else nullcontext())
+    try:
+        with export as exporter:
+            await asyncio.gather(*[run_slot(exporter) for _ in range(max_concurrent_videos)])
     finally:
-        if reddit is not None:
+        await reddit.close()
+        if options.metrics_path:
+            root, extension = os.path.splitext(options.metrics_path)
+            metrics_path = f"{root}.{worker.replace(':', '-')}{extension}"
+            get_metrics().write_report(metrics_path)
+            print(f"📈 Metrics have been saved to {metrics_path}")
+
+def _run_worker_process(index: int, num_workers: int, max_concurrent_videos: int,
+                        max_concurrent_requests: Optional[int], lease_seconds: float,
+                        options: RunOptions) -> None:
+    """Entry point of a worker process."""
+    if max_concurrent_requests is not None:
+        set_max_concurrent_requests(max_concurrent_requests)
+    # The workers share the API key, so each gets an equal part of its limits
+    set_budget_share(1 / num_workers)
+    if options.export_path:
+        # A file per worker, named the same on every run so appending de-duplicates
+        root, extension = os.path.splitext(options.export_path)
+        options = options._replace(export_path=f"{root}.{index}{extension}")
+    worker = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    asyncio.run(run_worker(worker, max_concurrent_videos, lease_seconds, options))
+
+def main_workers(num_workers: int,
+                 max_concurrent_videos: int = 1,
+                 max_concurrent_requests: Optional[int] = None,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 options: RunOptions = RunOptions()) -> None:
+    """
+    Consume the job queue with several worker processes, which share the
+    step caches, the post index and the OpenAI rate limits.
+
+    :param num_workers: Number of worker processes.
+    :param max_concurrent_videos: Maximum number of jobs per worker at once.
+    :param max_concurrent_requests: Optional budget of in-flight LLM
+        requests, split between the workers.
+    :param lease_seconds: How long a job stays reserved without a renewal.
+    :param options: Reddit auth, metrics and export options of the workers.
+    """
+    if not options.read_only:
+        # Authorize, or check the saved refresh token, once here, so the
+        # workers reuse it instead of each opening the browser
+        async def authorize() -> None:
+            reddit = await get_reddit_instance(reauthorize=options.reauthorize)
             await reddit.close()
 
+        try:
+            asyncio.run(authorize())
+        except RuntimeError as e:
+            print(f"Error initializing Reddit: {e}")
+            return
+
+    processes = [multiprocessing.Process(
+                     target=_run_worker_process,
+                     args=(index, num_workers, max_concurrent_videos,
+                           max_concurrent_requests, lease_seconds, options))
+                 for index in range(num_workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    counts = JobQueue().counts()
+    print(f"\n{SECTION_SEPARATOR}\n📦 Jobs: "
+          + (", ".join(f"{count} {status}" for status, count in counts.items()) or "none"))
+
+def read_video_urls(source: str) -> List[str]:
+    """
+    Read video URLs from a file (one per line) or expand a playlist URL.
+
+    :param source: Path to a text file or a YouTube playlist/channel URL.
+    :return: The list of video URLs.
+    """
+    if os.path.isfile(source):
+        with open(source, "r", encoding="utf-8") as file:
+            return [line.strip() for line in file
+                    if line.strip() and not line.lstrip().startswith("#")]
+    return extract_playlist_urls(source)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Extract video details and initialize Reddit.")
-    parser.add_argument("video_url", type=str, help="URL of the YouTube video")
+    parser.add_argument("video_url", type=str, nargs="?",
+                        help="URL of the YouTube video")
+    parser.add_argument("--batch", type=str, metavar="FILE_OR_PLAYLIST",
+                        help="File with one video URL per line, or a playlist URL")
+    parser.add_argument("--max-videos", type=int,
+                        default=DEFAULT_MAX_CONCURRENT_VIDEOS,
+                        help="Maximum number of videos processed concurrently")
+    parser.add_argument("--max-requests", type=int, default=None,
+                        help="Global maximum of concurrent LLM requests")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream each post through all stages as soon as it is found")
+    parser.add_argument("--server-filter", action="store_true",
+                        help="Filter posts by age and comments while searching")
+    parser.add_argument("--batched-relevance", action="store_true",
+                        help="Check the relevance of several posts per LLM request")
+    parser.add_argument("--prefilter-top-k", type=int, default=None,
+                        help="Only check the K best posts of the local ranking with the LLM")
+    parser.add_argument("--prefilter-threshold", type=float, default=None,
+                        help="Only check posts with at least this local ranking score")
+    parser.add_argument("--prefilter-embeddings", action="store_true",
+                        help="Rank with a local embedding model instead of BM25")
+    parser.add_argument("--subreddits", action="store_true",
+                        help="Search relevant subreddits instead of r/all")
+    parser.add_argument("--post-index", action="store_true",
+                        help="Reuse fresh search results and verdicts from the local post index")
+    parser.add_argument("--read-only", action="store_true",
+                        help="Use application-only Reddit auth (no browser login)")
+    parser.add_argument("--reauthorize", action="store_true",
+                        help="Discard the saved Reddit token and log in again")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch and analyze the posts published since the last run")
+    parser.add_argument("--metrics", type=str, metavar="FILE", default=None,
+                        help="Write timings, cache hits, tokens and retries to FILE"
+                             " (Prometheus text if it ends with .prom or .txt, else JSON)")
+    parser.add_argument("--progress", action="store_true",
+                        help="Show a live progress line")
+    parser.add_argument("--export", type=str, metavar="FILE", default=None,
+                        help="Append every video's posts, verdicts and comments to FILE"
+                             " (Parquet if it ends with .parquet, else CSV), skipping"
+                             " posts already in it")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="Add the videos to the job queue instead of processing them")
+    parser.add_argument("--workers", type=int, default=None, metavar="N",
+                        help="Process the job queue with N worker processes")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS,
+                        metavar="SECONDS",
+                        help="How long a worker's job is reserved without a heartbeat")
+    parser.add_argument("--deferred", nargs="?", const="openai", choices=["openai", "local"],
+                        default=None, metavar="BACKEND",
+                        help="Send relevance and comment requests as batch jobs and wait"
+                             " for them: cheaper, but may take hours (BACKEND: openai,"
+                             " or local to test against OPENAI_BASE_URL)")
+    parser.add_argument("--cluster-duplicates", action="store_true",
+                        help="Check and comment on near-duplicate posts (e.g. cross-posts) once")
 
     args = parser.parse_args()
-    asyncio.run(main(args.video_url))
+    options = RunOptions(stream=args.stream, server_filter=args.server_filter,
+                         batched_relevance=args.batched_relevance,
+                         prefilter_top_k=args.prefilter_top_k,
+                         prefilter_threshold=args.prefilter_threshold,
+                         prefilter_method="embeddings" if args.prefilter_embeddings else "bm25",
+                         read_only=args.read_only, reauthorize=args.reauthorize,
+                         target_subreddits=args.subreddits,
+                         post_index=args.post_index, incremental=args.incremental,
+                         metrics_path=args.metrics, progress=args.progress,
+                         export_path=args.export, deferred=args.deferred,
+                         cluster_duplicates=args.cluster_duplicates)
+    if args.incremental and args.stream:
+        parser.error("--incremental cannot be combined with --stream")
+    if args.deferred and args.stream:
+        parser.error("--deferred cannot be combined with --stream")
+    if args.cluster_duplicates and args.stream:
+        parser.error("--cluster-duplicates cannot be combined with --stream")
+    if args.enqueue or args.workers is not None:
+        if args.workers is not None and args.workers < 1:
+            parser.error("--workers must be at least 1")
+        urls = read_video_urls(args.batch) if args.batch else []
+        if args.video_url:
+            urls.insert(0, args.video_url)
+        if args.enqueue and not urls:
+            parser.error("--enqueue needs video_url or --batch")
+        if urls:
+            added = JobQueue().enqueue(urls, options._asdict())
+            print(f"📥 Added {added} jobs to the queue.")
+        if args.workers:
+            main_workers(args.workers, args.max_videos, args.max_requests, args.lease, options)
+    elif args.batch:
+        urls = read_video_urls(args.batch)
+        if args.video_url:
+            urls.insert(0, args.video_url)
+        asyncio.run(main_batch(urls, args.max_videos, args.max_requests, options))
+    elif args.video_url:
+        asyncio.run(main_batch([args.video_url], 1, args.max_requests, options))
+    else:
+        parser.error("either video_url or --batch is required")
@@ -0,0 +1,123 @@
+"""
+Streaming pipeline that takes each Reddit post through filtering, relevance
+analysis and comment generation as soon as it is found.
+
+Stages are linked by bounded queues, so the LLM works on the first posts
+while later search pages are still loading, and memory stays proportional
+to the queue sizes rather than to the number of posts.
+"""
+
+import asyncio
+from typing import (Any, AsyncIterator, Awaitable, Callable, List, Optional,
+                    Tuple)
+from reddit_search import RedditPost
+from post_analysis import is_post_relevant, generate_comment
+from post_store import with_bodies
+from metrics import get_metrics
+
+DEFAULT_STAGE_CONCURRENCY = 10
+DEFAULT_QUEUE_SIZE = 50
+
+# Marks the end of a stage's input
+_DONE = object()
+
+async def _run_stage(name: str, in_queue: asyncio.Queue, out_queue: asyncio.Queue,
+                     worker: Callable[[Any], Awaitable[Any]],
+                     concurrency: int) -> None:
+    """
+    Process items from `in_queue` with `concurrency` workers and put the
+    non-None results on `out_queue`. Failed items are reported and dropped.
+
+    :param name: Stage name, used in error messages.
+    :param in_queue: Queue of input items, terminated by `_DONE`.
+    :param out_queue: Queue receiving the results, terminated by `_DONE`.
+    :param worker: Coroutine function processing a single item.
+    :param concurrency: Number of items processed at once.
+    """
+    metrics = get_metrics()
+
+    async def run_worker() -> None:
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                # Let the sibling workers see the end of the input too
+                await in_queue.put(_DONE)
+                return
+            metrics.set_gauge("queue_depth", in_queue.qsize(), queue=name)
+            try:
+                with metrics.timer("pipeline_stage_seconds", stage=name):
+                    result = await worker(item)
+            except Exception as e:
+                print(f"Error in {name} stage: {e}")
+                continue
+            if result is not None:
+                await out_queue.put(result)
+
+    try:
+        await asyncio.gather(*[run_worker() for _ in range(concurrency)])
+    finally:
+        await out_queue.put(_DONE)
+
+async def stream_outreach(posts: AsyncIterator[RedditPost], video_url: str,
+                          video_title: str, video_description: str,
+                          post_filter: Callable[[List[RedditPost]], List[RedditPost]],
+                          concurrency: int = DEFAULT_STAGE_CONCURRENCY,
+                          queue_size: int = DEFAULT_QUEUE_SIZE
+) -> AsyncIterator[Tuple[RedditPost, str]]:
+    """
+    Stream posts through filtering, relevance analysis and comment generation.
+
+    :param posts: Async iterator of candidate Reddit posts.
+    :param video_url: URL of the YouTube video.
+    :param video_title: Title of the video.
+    :param video_description: Description of the video, or its compact
+        summary (see `video_context.summarize_video`).
+    :param post_filter: Function keeping the posts that match the criteria.
+    :param concurrency: Number of concurrent LLM calls per stage.
+    :param queue_size: Maximum number of items buffered between stages.
+    :return: Async iterator of (relevant post, generated comment) pairs, in
+        completion order.
+    """
+    candidates: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    filtered: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    relevant: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    results: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    async def produce() -> None:
+        try:
+            async for post in posts:
+                await candidates.put(post)
+        finally:
+            await candidates.put(_DONE)
+
+    async def keep_matching(post: RedditPost) -> Optional[RedditPost]:
+        return post if post_filter([post]) else None
+
+    async def keep_relevant(post: RedditPost) -> Optional[RedditPost]:
+        # Only the posts that passed the filter are loaded, off the event loop
+        [post] = await asyncio.to_thread(with_bodies, [post])
+        relevant_post = await is_post_relevant(post, video_title, video_description)
+        return post if relevant_post else None
+
+    async def add_comment(post: RedditPost) -> Tuple[RedditPost, str]:
+        return post, await generate_comment(video_url, video_title, post, video_description)
+
+    tasks = [
+        asyncio.create_task(produce()),
+        asyncio.create_task(_run_stage("filter", candidates, filtered, keep_matching, 1)),
+        asyncio.create_task(_run_stage("relevance", filtered, relevant, keep_relevant, concurrency)),
+        asyncio.create_task(_run_stage("comment", relevant, results, add_comment, concurrency)),
+    ]
+
+    try:
+        while True:
+            item = await results.get()
+            if item is _DONE:
+                break
+            yield item
+        # Surface errors from the search itself
+        await tasks[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -3,13 +3,251 @@ Functions for analyzing Reddit posts and generating engagement content.
 """
 
 import asyncio
-from typing import List
-from asyncpraw.models import Submission
-from llm_utils import request_completion
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import AsyncContextManager, AsyncIterator, Dict, List, Optional, Tuple
+from llm_utils import request_completion, request_json, estimate_tokens
+from post_store import with_bodies
+from video_context import format_video_context
 from reddit_search import RedditPost
 
+def _concurrency_limit(max_concurrency: Optional[int]) -> AsyncContextManager:
+    """Return a per-call limit, or no limit to rely on the shared scheduler."""
+    if max_concurrency is None:
+        return nullcontext()
+    return asyncio.Semaphore(max_concurrency)
+
+# Token budget of a single batched relevance request
+DEFAULT_MAX_BATCH_TOKENS = 6000
+DEFAULT_MAX_BATCH_POSTS = 25
+
+@dataclass
+class RelevanceStats:
+    """Estimated prompt tokens of batched relevance checks."""
+    requests: int = 0
+    batched_tokens: int = 0
+    # What the same posts would have cost with one request per post
+    per_post_tokens: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.per_post_tokens - self.batched_tokens
+
+    def __str__(self) -> str:
+        saved_percent = (100 * self.saved_tokens / self.per_post_tokens
+                         if self.per_post_tokens else 0)
+        return (f"{self.requests} requests, ~{self.batched_tokens} prompt tokens"
+                f" vs ~{self.per_post_tokens} per post"
+                f" (saved ~{self.saved_tokens}, {saved_percent:.0f}%)")
+
+# Prompts start with the video context and the instructions, which are the
+# same for every post of a video, so providers can cache them as a prefix.
+# Only the user message holds the posts.
+
+def _relevance_system_prompt(video_title: str, video_description: str) -> str:
+    return (f"{format_video_context(video_title, video_description)}\n\n"
+            f"Analyze the Reddit post given by the user and determine if the"
+            f" video above would be relevant to the discussion. Respond in"
+            f" this JSON format:\n{{\"relevant\": true or false}}")
+
+RELEVANCE_SCHEMA = {
+    "type": "object",
+    "properties": {"relevant": {"type": "boolean"}},
+    "required": ["relevant"],
+    "additionalProperties": False,
+}
+
+BATCH_RELEVANCE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "relevant_ids": {"type": "array", "items": {"type": "string"}},
+        "not_relevant_ids": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["relevant_ids", "not_relevant_ids"],
+    "additionalProperties": False,
+}
+
+def _post_prompt(post: RedditPost) -> str:
+    return f"Post Title: {post.title}\nPost Content: {post.body}"
+
+def _relevance_tokens(post: RedditPost, system_prompt: str) -> int:
+    """Estimated prompt tokens of the relevance check of a single post."""
+    return estimate_tokens(system_prompt) + estimate_tokens(_post_prompt(post))
+
+async def is_post_relevant(post: RedditPost, video_title: str,
+                           video_description: str) -> bool:
+    """
+    Determine whether the video would be relevant to a single Reddit post.
+
+    :param post: The Reddit submission to analyze.
+    :param video_title: Title of the video.
+    :param video_description: Description of the video, or its compact
+        summary (see `video_context.summarize_video`).
+    :return: True if the video is relevant to the post. An answer that
+        cannot be parsed counts as not relevant.
+    """
+    try:
+        result_json = await request_json(
+            _post_prompt(post), _relevance_system_prompt(video_title, video_description),
+            RELEVANCE_SCHEMA, "relevance")
+    except ValueError:
+        return False
+    return isinstance(result_json, dict) and result_json.get("relevant") is True
+
+async def generate_comment(video_url: str, video_title: str,
+                           post: RedditPost, video_summary: str = "") -> str:
+    """
+    Generate an engagement comment for a single Reddit post.
+
+    :param video_url: URL of the YouTube video.
+    :param video_title: Title of the video.
+    :param post: The relevant Reddit submission.
+    :param video_summary: Optional compact summary of the video.
+    :return: The generated comment.
+    """
+    system_prompt = (f"{format_video_context(video_title, video_summary)}\n\n"
+                     f"Generate a helpful and non-spammy comment replying to the"
+                     f" Reddit post given by the user, including a link to the"
+                     f" video above: {video_url}\nMake sure to mention that you"
+                     f" created the video and are sharing it to be useful, and"
+                     f" make the comment a relevant reply to the original post.")
+    return await request_completion(_post_prompt(post), system_prompt)
+
+def _batch_relevance_system_prompt(video_title: str, video_description: str) -> str:
+    return (f"{format_video_context(video_title, video_description)}\n\n"
+            f"Analyze each of the Reddit posts given by the user and determine"
+            f" if the video above would be relevant to its discussion.\n"
+            f"Output the ID of every post in exactly one of the lists, in"
+            f" this JSON format:\n"
+            f"{{\"relevant_ids\": [\"id1\", ...], \"not_relevant_ids\": [\"id2\", ...]}}")
+
+def _batch_relevance_post(post: RedditPost) -> str:
+    return (f"<post id=\"{post.id}\">\nPost Title: {post.title}\n"
+            f"Post Content: {post.body}\n</post>\n")
+
+def split_into_batches(posts: List[RedditPost], header_tokens: int,
+                       max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+                       max_batch_posts: int = DEFAULT_MAX_BATCH_POSTS
+) -> List[List[RedditPost]]:
+    """
+    Group posts into batches whose estimated prompt fits the token budget.
+
+    :param posts: List of Reddit submissions.
+    :param header_tokens: Estimated tokens of the shared part of the prompt.
+    :param max_batch_tokens: Token budget of a single request.
+    :param max_batch_posts: Maximum number of posts in a single request.
+    :return: The batches, each with at least one post.
+    """
+    batches: List[List[RedditPost]] = []
+    batch: List[RedditPost] = []
+    batch_tokens = header_tokens
+    for post in posts:
+        post_tokens = estimate_tokens(_batch_relevance_post(post))
+        if batch and (batch_tokens + post_tokens > max_batch_tokens
+                      or len(batch) >= max_batch_posts):
+            batches.append(batch)
+            batch = []
+            batch_tokens = header_tokens
+        batch.append(post)
+        batch_tokens += post_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def _classify_batch(batch: List[RedditPost], video_title: str,
+                          video_description: str,
+                          stats: RelevanceStats) -> Dict[str, bool]:
+    """
+    Classify a batch of posts in a single request. A batch whose output
+    cannot be parsed, or misses some posts, is split in half and retried.
+
+    :return: The relevance verdict of each post, by post ID.
+    """
+    if len(batch) == 1:
+        post = batch[0]
+        stats.requests += 1
+        stats.batched_tokens += _relevance_tokens(
+            post, _relevance_system_prompt(video_title, video_description))
+        return {post.id: await is_post_relevant(post, video_title, video_description)}
+
+    system_prompt = _batch_relevance_system_prompt(video_title, video_description)
+    prompt = "".join(_batch_relevance_post(post) for post in batch)
+    stats.requests += 1
+    stats.batched_tokens += estimate_tokens(system_prompt) + estimate_tokens(prompt)
+    verdicts: Dict[str, bool] = {}
+    try:
+        result_json = await request_json(prompt, system_prompt,
+                                         BATCH_RELEVANCE_SCHEMA, "batch_relevance")
+        if isinstance(result_json, dict):
+            for post_id in result_json.get("not_relevant_ids", []):
+                verdicts[str(post_id)] = False
+            for post_id in result_json.get("relevant_ids", []):
+                verdicts[str(post_id)] = True
+    except ValueError:
+        pass
+
+    missing = [post for post in batch if post.id not in verdicts]
+    if not missing:
+        return verdicts
+
+    middle = len(missing) // 2 or 1
+    for half in (missing[:middle], missing[middle:]):
+        if half:
+            verdicts.update(await _classify_batch(
+                half, video_title, video_description, stats))
+    return verdicts
+
+async def analyze_posts_batched(posts: List[RedditPost], video_title: str,
+                                video_description: str, max_concurrency: Optional[int] = None,
+                                max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+                                stats: Optional[RelevanceStats] = None
+) -> List[RedditPost]:
+    """
+    Analyze Reddit posts for relevance, packing several posts into each
+    request so the video context is only sent once per batch.
+
+    :param posts: List of Reddit submissions to analyze.
+    :param video_title: Title of the video.
+    :param video_description: Description of the video.
+    :param max_concurrency: Optional limit of concurrent requests for this
+        call, on top of the shared scheduler budget.
+    :param max_batch_tokens: Token budget of a single request.
+    :param stats: Optional counters updated with the estimated token usage.
+    :return: List of relevant Reddit submissions, in input order.
+    """
+    stats = stats if stats is not None else RelevanceStats()
+    header_tokens = estimate_tokens(
+        _batch_relevance_system_prompt(video_title, video_description))
+    full_posts = await asyncio.to_thread(with_bodies, posts)
+    batches = split_into_batches(full_posts, header_tokens, max_batch_tokens)
+    system_prompt = _relevance_system_prompt(video_title, video_description)
+    stats.per_post_tokens += sum(_relevance_tokens(post, system_prompt)
+                                 for post in full_posts)
+
+    semaphore = _concurrency_limit(max_concurrency)
+
+    async def classify(batch: List[RedditPost]) -> Dict[str, bool]:
+        async with semaphore:
+            return await _classify_batch(batch, video_title, video_description, stats)
+
+    verdicts: Dict[str, bool] = {}
+    for batch_verdicts in await asyncio.gather(*[classify(batch) for batch in batches]):
+        verdicts.update(batch_verdicts)
+    return [post for post in posts if verdicts.get(post.id)]
+
+def _group_clusters(posts: List[RedditPost],
+                    clusters: Dict[str, str]) -> Dict[str, List[RedditPost]]:
+    """Group posts by cluster ID, in input order. Unclustered posts are their own cluster."""
+    groups: Dict[str, List[RedditPost]] = {}
+    for post in posts:
+        groups.setdefault(clusters.get(post.id, post.id), []).append(post)
+    return groups
+
 async def analyze_posts(posts: List[RedditPost], video_title: str,
-                        video_description: str, max_concurrency: int = 10
+                        video_description: str, max_concurrency: Optional[int] = None,
+                        batched: bool = False,
+                        stats: Optional[RelevanceStats] = None,
+                        clusters: Optional[Dict[str, str]] = None
 ) -> List[RedditPost]:
     """
     Analyze Reddit posts to determine relevance based on video content.
@@ -17,55 +255,114 @@ async def analyze_posts(posts: List[RedditPost], video_title: str,
     :param posts: List of Reddit submissions to analyze.
     :param video_title: Title of the video.
     :param video_description: Description of the video.
-    :param max_concurrency: Maximum number of concurrent requests.
+    :param max_concurrency: Optional limit of concurrent requests for this
+        call, on top of the shared scheduler budget.
+    :param batched: Whether to classify several posts per request
+        (see `analyze_posts_batched`).
+    :param stats: Optional counters updated with the estimated token usage
+        in batched mode.
+    :param clusters: Optional cluster ID of each post (see
+        `post_clustering.cluster_posts`). Only the first post of each
+        cluster is analyzed, and its verdict applies to the whole cluster.
     :return: List of relevant Reddit submissions.
     """
-    semaphore = asyncio.Semaphore(max_concurrency)
-    relevant_posts = []
+    if clusters:
+        groups = _group_clusters(posts, clusters)
+        judged = await analyze_posts([members[0] for members in groups.values()],
+                                     video_title, video_description, max_concurrency,
+                                     batched, stats)
+        relevant_clusters = {clusters.get(post.id, post.id) for post in judged}
+        return [post for post in posts if clusters.get(post.id, post.id) in relevant_clusters]
+
+    if batched:
+        return await analyze_posts_batched(posts, video_title, video_description,
+                                           max_concurrency, stats=stats)
+
+    semaphore = _concurrency_limit(max_concurrency)
+    relevant_ids = set()
 
     async def analyze_post(post):
         async with semaphore:
-            prompt = (f"Given the video title '{video_title}' and description"
-                      f" '{video_description}', analyze the following Reddit post"
-                      f" and determine if the video would be relevant to the"
-                      f" discussion.\n\nPost Title: {post.title}\nPost Content:"
-                      f" {post.selftext}\n\nRespond with 'relevant' or"
-                      f" 'not relevant'.")
-            result = await request_completion(prompt)
-            lower_result = result.lower()
-            if "relevant" in lower_result and \
-                    "not relevant" not in lower_result:
-                relevant_posts.append(post)
-
-    await asyncio.gather(*[analyze_post(post) for post in posts])
-    return relevant_posts
+            if await is_post_relevant(post, video_title, video_description):
+                relevant_ids.add(post.id)
+
+    full_posts = await asyncio.to_thread(with_bodies, posts)
+    await asyncio.gather(*[analyze_post(post) for post in full_posts])
+    # The given posts, which stay slim in the step caches
+    return [post for post in posts if post.id in relevant_ids]
+
+async def iter_engagement_content(video_url: str, video_title: str,
+                                  posts: List[RedditPost],
+                                  max_concurrency: Optional[int] = None,
+                                  video_summary: str = "",
+                                  clusters: Optional[Dict[str, str]] = None
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Generate engagement content for relevant Reddit posts, yielding each
+    comment as soon as it is ready. A post whose generation fails is
+    reported and skipped without affecting the others.
+
+    :param video_url: URL of the YouTube video.
+    :param video_title: Title of the video.
+    :param posts: List of relevant Reddit submissions.
+    :param max_concurrency: Optional limit of concurrent requests for this
+        call, on top of the shared scheduler budget.
+    :param video_summary: Optional compact summary of the video.
+    :param clusters: Optional cluster ID of each post (see
+        `post_clustering.cluster_posts`). A comment is generated for the
+        first post of each cluster and yielded for every post of the cluster.
+    :return: Async iterator of (post ID, comment) pairs, in completion order.
+    """
+    if clusters:
+        groups = _group_clusters(posts, clusters)
+        async for post_id, comment in iter_engagement_content(
+                video_url, video_title, [members[0] for members in groups.values()],
+                max_concurrency, video_summary):
+            for post in groups[clusters.get(post_id, post_id)]:
+                yield post.id, comment
+        return
+
+    semaphore = _concurrency_limit(max_concurrency)
+    posts = await asyncio.to_thread(with_bodies, posts)
+
+    async def generate(post: RedditPost) -> Tuple[RedditPost, Optional[str]]:
+        async with semaphore:
+            try:
+                return post, await generate_comment(video_url, video_title, post,
+                                                    video_summary)
+            except Exception as e:
+                print(f"Error generating a comment for post {post.id}: {e}")
+                return post, None
+
+    tasks = [asyncio.create_task(generate(post)) for post in posts]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            post, comment = await next_done
+            if comment is not None:
+                yield post.id, comment
+    finally:
+        for task in tasks:
+            task.cancel()
 
 async def generate_engagement_content(video_url: str, video_title: str,
                                       posts: List[RedditPost],
-                                      max_concurrency: int = 10) -> List[str]:
+                                      max_concurrency: Optional[int] = None,
+                                      video_summary: str = "",
+                                      clusters: Optional[Dict[str, str]] = None
+) -> Dict[str, str]:
     """
     Generate engagement content for relevant Reddit posts.
 
     :param video_url: URL of the YouTube video.
     :param video_title: Title of the video.
     :param posts: List of relevant Reddit submissions.
-    :param max_concurrency: Maximum number of concurrent requests.
-    :return: List of generated engagement comments.
+    :param max_concurrency: Optional limit of concurrent requests for this
+        call, on top of the shared scheduler budget.
+    :param video_summary: Optional compact summary of the video.
+    :param clusters: Optional cluster ID of each post, which get one shared
+        comment per cluster (see `iter_engagement_content`).
+    :return: The generated engagement comments, by post ID. Posts whose
+        generation failed are missing.
     """
-    semaphore = asyncio.Semaphore(max_concurrency)
-    comments = []
-
-    async def generate_comment(post):
-        async with semaphore:
-            prompt = (f"Given the video title '{video_title}' and the following"
-                      f" Reddit post, generate a helpful and non-spammy comment"
-                      f" that includes a link to the video. Make sure to mention"
-                      f" that you created the video and are sharing it to be"
-                      f" useful, and make the comment a relevant reply to the"
-                      f" original post.\n\nPost Title: {post.title}\nPost Content:"
-                      f" {post.selftext}\n\nVideo URL: {video_url}")
-            comment = await request_completion(prompt)
-            comments.append(comment)
-
-    await asyncio.gather(*[generate_comment(post) for post in posts])
-    return comments
+    return {post_id: comment async for post_id, comment in iter_engagement_content(
+        video_url, video_title, posts, max_concurrency, video_summary, clusters)}
@@ -0,0 +1,113 @@
+"""
+Near-duplicate detection of Reddit posts.
+
+The same question is often cross-posted to several subreddits or slightly
+reworded. Posts are compared on the word pairs (shingles) of their title
+and body through MinHash signatures. Locality-sensitive hashing over bands
+of those signatures only brings similar posts together, so clustering takes
+near-linear time instead of comparing every pair. Each cluster can then be
+judged and commented on once.
+"""
+
+import asyncio
+import zlib
+from typing import Dict, List, Optional
+import numpy as np
+from post_ranking import tokenize
+from post_store import with_bodies
+from reddit_search import RedditPost
+
+# Minimum estimated Jaccard similarity of the shingles of two near-duplicates
+DEFAULT_SIMILARITY_THRESHOLD = 0.5
+# 16 bands of 4 hashes: posts with a similarity of 0.5 share a band 64% of
+# the time, and of 0.8 over 99%
+NUM_HASHES = 64
+NUM_BANDS = 16
+SHINGLE_SIZE = 2
+# Posts with fewer distinct shingles, e.g. a title like "Help please" with no
+# body, are too short to tell a duplicate from a common phrase, so they are
+# never clustered
+MIN_SHINGLES = 8
+# A prime above the 32-bit shingle hashes, for the hash permutations
+_PRIME = 4294967311
+_SEED = 1
+
+_random = np.random.default_rng(_SEED)
+# Kept below 2**31 so a * x + b fits in 64 bits
+_HASH_A = _random.integers(1, 2 ** 31, NUM_HASHES, dtype=np.uint64)
+_HASH_B = _random.integers(0, 2 ** 31, NUM_HASHES, dtype=np.uint64)
+
+def _shingles(post: RedditPost) -> np.ndarray:
+    """The hashes of the word shingles of a post."""
+    tokens = tokenize(f"{post.title}\n{post.body}")
+    shingles = {" ".join(tokens[index:index + SHINGLE_SIZE])
+                for index in range(len(tokens) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64)
+
+def minhash_signature(post: RedditPost) -> Optional[np.ndarray]:
+    """
+    Compute the MinHash signature of a post.
+
+    :param post: The Reddit submission, with its body.
+    :return: The signature, or None for a post with fewer than MIN_SHINGLES
+        shingles.
+    """
+    shingles = _shingles(post)
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    return ((np.outer(shingles, _HASH_A) + _HASH_B) % _PRIME).min(axis=0)
+
+def _find(parents: List[int], index: int) -> int:
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
+
+def cluster_posts_sync(posts: List[RedditPost],
+                       threshold: float = DEFAULT_SIMILARITY_THRESHOLD) -> Dict[str, str]:
+    """
+    Group near-duplicate posts. Blocking, use `cluster_posts` from async code.
+    Posts too short to compare (see MIN_SHINGLES) get a cluster of their own.
+
+    :param posts: The posts, with their body.
+    :param threshold: Minimum estimated Jaccard similarity of the shingles
+        of two posts in the same cluster.
+    :return: The cluster ID of every post, by post ID. A cluster's ID is the
+        ID of its first post in the given order.
+    """
+    signatures = [minhash_signature(post) for post in posts]
+    parents = list(range(len(posts)))
+    rows = NUM_HASHES // NUM_BANDS
+
+    for band in range(NUM_BANDS):
+        buckets: Dict[bytes, int] = {}
+        for index, signature in enumerate(signatures):
+            if signature is None:
+                continue
+            key = signature[band * rows:(band + 1) * rows].tobytes()
+            first = buckets.setdefault(key, index)
+            if first == index:
+                continue
+            # Compared with the first post of the bucket only, which keeps
+            # the work linear in the number of posts
+            root, other = _find(parents, first), _find(parents, index)
+            if root != other and np.mean(signatures[first] == signature) >= threshold:
+                parents[max(root, other)] = min(root, other)
+
+    return {post.id: posts[_find(parents, index)].id for index, post in enumerate(posts)}
+
+async def cluster_posts(posts: List[RedditPost],
+                        threshold: float = DEFAULT_SIMILARITY_THRESHOLD) -> Dict[str, str]:
+    """
+    Group near-duplicate posts in a worker thread, loading the bodies of
+    slim posts.
+
+    :param posts: The posts.
+    :param threshold: Minimum estimated Jaccard similarity of the shingles
+        of two posts in the same cluster.
+    :return: The cluster ID of every post, by post ID (see `cluster_posts_sync`).
+    """
+    def cluster() -> Dict[str, str]:
+        return cluster_posts_sync(with_bodies(posts), threshold)
+
+    return await asyncio.to_thread(cluster)
@@ -0,0 +1,243 @@
+"""
+Local index of every Reddit post seen, shared by all videos.
+
+The index stores each post's metadata and fetch time, the post IDs returned
+by each search query, and the relevance verdict of each post for each video.
+Post bodies are not duplicated here: they live in the post body store, and
+indexed posts are returned slim.
+A search whose results are all still fresh is answered from the index
+without a network call, and posts already judged for a video are not sent
+to the LLM again.
+
+Post freshness depends on `num_comments`, which `filter_posts` compares
+with the comment threshold: young posts and posts close to the threshold
+gain comments quickly, so they go stale sooner.
+"""
+
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from cache_utils import CACHE_DIR, open_database
+from post_store import PostBodyStore, get_post_body_store
+from reddit_search import RedditPost
+
+POST_INDEX_PATH = os.path.join(CACHE_DIR, "post_index.sqlite3")
+
+# How long the results of a search query are reused, in seconds
+QUERY_TTL = 6 * 60 * 60
+# How long a post's comment count is trusted, by post age (in seconds)
+POST_TTLS = [
+    (24 * 60 * 60, 60 * 60),           # under a day old: 1 hour
+    (7 * 24 * 60 * 60, 6 * 60 * 60),   # under a week old: 6 hours
+]
+DEFAULT_POST_TTL = 24 * 60 * 60
+# Posts this close to the comment threshold are refreshed twice as often
+THRESHOLD_MARGIN = 2
+
+def get_post_ttl(post: RedditPost, max_comments: Optional[int], now: float) -> float:
+    """
+    Return how long a post's metadata stays fresh after it was fetched.
+
+    :param post: The indexed post.
+    :param max_comments: The comment threshold posts are filtered on, if any.
+    :param now: The current time.
+    :return: The time-to-live in seconds.
+    """
+    if max_comments is not None and post.num_comments > max_comments:
+        # Comment counts only grow, so the post stays filtered out
+        return float("inf")
+
+    age = now - post.created_utc
+    ttl = next((ttl for max_age, ttl in POST_TTLS if age < max_age), DEFAULT_POST_TTL)
+    if max_comments is not None and max_comments - post.num_comments <= THRESHOLD_MARGIN:
+        ttl /= 2
+    return ttl
+
+class PostIndex:
+    """SQLite index of posts, search query results and relevance verdicts."""
+
+    def __init__(self, path: str = POST_INDEX_PATH,
+                 max_comments: Optional[int] = None,
+                 query_ttl: float = QUERY_TTL,
+                 body_store: Optional[PostBodyStore] = None):
+        """
+        :param path: Path to the SQLite database file.
+        :param max_comments: The comment threshold posts are filtered on, if
+            any, used to decide when a post is stale.
+        :param query_ttl: How long the results of a query are reused, in seconds.
+        :param body_store: Where the bodies of indexed posts are kept,
+            defaults to the shared post body store.
+        """
+        self.path = path
+        self.max_comments = max_comments
+        self.query_ttl = query_ttl
+        self.body_store = body_store or get_post_body_store()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with open_database(self.path) as connection:
+            if not self._initialized:
+                connection.executescript(
+                    "CREATE TABLE IF NOT EXISTS posts ("
+                    " id TEXT PRIMARY KEY,"
+                    " title TEXT NOT NULL,"
+                    " url TEXT NOT NULL,"
+                    " num_comments INTEGER NOT NULL,"
+                    " created_utc REAL NOT NULL,"
+                    " fetched_at REAL NOT NULL);"
+                    "CREATE TABLE IF NOT EXISTS queries ("
+                    " query TEXT PRIMARY KEY,"
+                    " post_ids TEXT NOT NULL,"
+                    " fetched_at REAL NOT NULL);"
+                    "CREATE TABLE IF NOT EXISTS verdicts ("
+                    " post_id TEXT NOT NULL,"
+                    " video_hash TEXT NOT NULL,"
+                    " relevant INTEGER NOT NULL,"
+                    " judged_at REAL NOT NULL,"
+                    " PRIMARY KEY (video_hash, post_id));")
+                self._initialized = True
+            yield connection
+
+    def put_posts(self, posts: List[RedditPost], fetched_at: Optional[float] = None) -> None:
+        """
+        Add or refresh posts in the index.
+
+        :param posts: The fetched posts.
+        :param fetched_at: When the posts were fetched, defaults to now.
+        """
+        fetched_at = fetched_at if fetched_at is not None else time.time()
+        for post in posts:
+            if post.body is not None:
+                self.body_store.put(post.id, post.body)
+        # Indexed posts must find their body, also after a crash
+        self.body_store.flush()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO posts (id, title, url,"
+                " num_comments, created_utc, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(post.id, post.title, post.url, post.num_comments,
+                  post.created_utc, fetched_at)
+                 for post in posts])
+
+    def get_posts(self, post_ids: List[str]) -> Dict[str, Tuple[RedditPost, float]]:
+        """
+        Look up posts by ID.
+
+        :param post_ids: The post IDs.
+        :return: (post, fetched_at) pairs of the indexed posts, by post ID.
+            The posts are slim, their bodies are in the body store.
+        """
+        found = {}
+        with self._connect() as connection:
+            # Stay below SQLite's limit on the number of query parameters
+            for start in range(0, len(post_ids), 500):
+                chunk = post_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    "SELECT id, title, url, num_comments, created_utc,"
+                    f" fetched_at FROM posts WHERE id IN ({placeholders})", chunk)
+                for post_id, title, url, num_comments, created_utc, fetched_at in rows:
+                    post = RedditPost(id=post_id, title=title, body=None,
+                                      url=url, num_comments=num_comments,
+                                      created_utc=created_utc)
+                    found[post_id] = (post, fetched_at)
+        return found
+
+    def put_query(self, query: str, posts: List[RedditPost]) -> None:
+        """
+        Record the results of a search query, indexing its posts.
+
+        :param query: A key identifying the search (keyword, subreddit, ...).
+        :param posts: The posts it returned, in order.
+        """
+        now = time.time()
+        self.put_posts(posts, now)
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO queries (query, post_ids, fetched_at)"
+                " VALUES (?, ?, ?)", (query, ",".join(post.id for post in posts), now))
+
+    def get_fresh_query(self, query: str) -> Optional[List[RedditPost]]:
+        """
+        Return the results of a search query if it and all its posts are
+        still fresh.
+
+        :param query: The key given to `put_query`.
+        :return: The indexed posts, or None if the query must be run again.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT post_ids, fetched_at FROM queries WHERE query = ?",
+                (query,)).fetchone()
+        if row is None or now - row[1] > self.query_ttl:
+            return None
+
+        post_ids = [post_id for post_id in row[0].split(",") if post_id]
+        indexed = self.get_posts(post_ids)
+        posts = []
+        for post_id in post_ids:
+            if post_id not in indexed:
+                return None
+            post, fetched_at = indexed[post_id]
+            if now - fetched_at > get_post_ttl(post, self.max_comments, now):
+                return None
+            posts.append(post)
+        # Their bodies are referenced again, so pruning keeps them
+        self.body_store.touch(post_ids)
+        return posts
+
+    def get_verdicts(self, video_hash: str, post_ids: List[str]) -> Dict[str, bool]:
+        """
+        Look up the relevance verdicts of posts for a video.
+
+        :param video_hash: The video hash.
+        :param post_ids: The post IDs.
+        :return: The known verdicts, by post ID.
+        """
+        verdicts = {}
+        with self._connect() as connection:
+            for start in range(0, len(post_ids), 500):
+                chunk = post_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    "SELECT post_id, relevant FROM verdicts WHERE video_hash = ?"
+                    f" AND post_id IN ({placeholders})", [video_hash, *chunk])
+                verdicts.update({post_id: bool(relevant) for post_id, relevant in rows})
+        return verdicts
+
+    def put_verdicts(self, video_hash: str, verdicts: Dict[str, bool]) -> None:
+        """
+        Record the relevance verdicts of posts for a video.
+
+        :param video_hash: The video hash.
+        :param verdicts: The verdicts, by post ID.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO verdicts (post_id, video_hash, relevant, judged_at)"
+                " VALUES (?, ?, ?, ?)",
+                [(post_id, video_hash, int(relevant), now)
+                 for post_id, relevant in verdicts.items()])
+
+    def prune(self, max_age: float) -> int:
+        """
+        Delete queries and posts not fetched within `max_age` seconds, with
+        the verdicts of the deleted posts.
+
+        :param max_age: Maximum age in seconds.
+        :return: The number of deleted posts.
+        """
+        cutoff = time.time() - max_age
+        with self._connect() as connection:
+            connection.execute("DELETE FROM queries WHERE fetched_at < ?", (cutoff,))
+            connection.execute(
+                "DELETE FROM verdicts WHERE post_id IN"
+                " (SELECT id FROM posts WHERE fetched_at < ?)", (cutoff,))
+            return connection.execute(
+                "DELETE FROM posts WHERE fetched_at < ?", (cutoff,)).rowcount
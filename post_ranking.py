@@ -0,0 +1,247 @@
+"""
+Cheap local ranking of Reddit posts against a video, used to send only the
+most promising posts to the LLM relevance check.
+
+Posts are scored with BM25 over their title and content, vectorized with
+NumPy, or optionally by cosine similarity with a local sentence-transformers
+embedding model. Per-post vectors are cached by post ID across runs.
+"""
+
+import asyncio
+import math
+import os
+import pickle
+import re
+import sqlite3
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from cache_utils import CACHE_DIR, open_database
+from post_store import with_bodies
+from reddit_search import RedditPost
+
+VECTOR_CACHE_PATH = os.path.join(CACHE_DIR, "post_vectors.sqlite3")
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been
+before being below between both but by can could did do does doing down
+during each few for from further had has have having he her here hers him
+his how i if in into is it its just me more most my no nor not now of off
+on once only or other our out over own same she should so some such than
+that the their them then there these they this those through to too under
+until up very was we were what when where which while who whom why will
+with would you your
+""".split())
+
+_URL_PATTERN = re.compile(r"https?://\S+")
+_TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#.\-]*[a-z0-9+#]|[a-z0-9]")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase terms, dropping links and stopwords.
+
+    :param text: The input text.
+    :return: The list of terms.
+    """
+    text = _URL_PATTERN.sub(" ", text.lower())
+    return [token for token in _TOKEN_PATTERN.findall(text)
+            if token not in STOPWORDS]
+
+def _post_text(post: RedditPost) -> str:
+    return f"{post.title}\n{post.body}"
+
+class PostVectorCache:
+    """SQLite cache of per-post vectors, keyed on (post_id, method)."""
+
+    def __init__(self, path: str = VECTOR_CACHE_PATH):
+        """
+        :param path: Path to the SQLite database file.
+        """
+        self.path = path
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with open_database(self.path) as connection:
+            if not self._initialized:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS vectors ("
+                    " post_id TEXT NOT NULL,"
+                    " method TEXT NOT NULL,"
+                    " value BLOB NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " PRIMARY KEY (post_id, method))")
+                self._initialized = True
+            yield connection
+
+    def get_many(self, post_ids: List[str], method: str) -> Dict[str, Any]:
+        """
+        Return the cached vectors of the given posts.
+
+        :param post_ids: The post IDs to look up.
+        :param method: The ranking method the vectors belong to.
+        :return: The cached vectors, by post ID.
+        """
+        vectors = {}
+        with self._connect() as connection:
+            # Stay below SQLite's limit on the number of query parameters
+            for start in range(0, len(post_ids), 500):
+                chunk = post_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT post_id, value FROM vectors WHERE method = ?"
+                    f" AND post_id IN ({placeholders})", [method, *chunk])
+                for post_id, value in rows:
+                    vectors[post_id] = pickle.loads(value)
+        return vectors
+
+    def set_many(self, vectors: Dict[str, Any], method: str) -> None:
+        """
+        Store the vectors of several posts.
+
+        :param vectors: The vectors to store, by post ID.
+        :param method: The ranking method the vectors belong to.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO vectors (post_id, method, value, created_at)"
+                " VALUES (?, ?, ?, ?)",
+                [(post_id, method, pickle.dumps(vector), now)
+                 for post_id, vector in vectors.items()])
+
+def _get_vectors(posts: List[RedditPost], method: str, compute,
+                 cache: Optional[PostVectorCache]) -> List[Any]:
+    """Return the vector of each post, computing and caching the missing ones."""
+    cached = cache.get_many([post.id for post in posts], method) if cache else {}
+    missing = [post for post in posts if post.id not in cached]
+    if missing:
+        # Only posts without a cached vector need their body
+        missing = with_bodies(missing)
+        computed = dict(zip([post.id for post in missing], compute(missing)))
+        if cache:
+            cache.set_many(computed, method)
+        cached.update(computed)
+    return [cached[post.id] for post in posts]
+
+def bm25_scores(query_terms: Counter, documents: List[Counter]) -> np.ndarray:
+    """
+    Score documents against a query with BM25.
+
+    :param query_terms: Term counts of the query.
+    :param documents: Term counts of each document.
+    :return: The score of each document.
+    """
+    if not documents or not query_terms:
+        return np.zeros(len(documents))
+
+    vocabulary = list(query_terms)
+    term_frequencies = np.array(
+        [[document.get(term, 0) for term in vocabulary] for document in documents],
+        dtype=np.float64)
+    lengths = np.array([sum(document.values()) for document in documents],
+                       dtype=np.float64)
+    average_length = max(lengths.mean(), 1.0)
+
+    document_frequencies = (term_frequencies > 0).sum(axis=0)
+    inverse_frequencies = np.log(
+        1 + (len(documents) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+    query_weights = np.array([query_terms[term] for term in vocabulary], dtype=np.float64)
+
+    normalization = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+    saturated = term_frequencies * (BM25_K1 + 1) / (term_frequencies + normalization[:, None])
+    return saturated @ (inverse_frequencies * query_weights)
+
+_embedding_models: Dict[str, Any] = {}
+
+def _get_embedding_model(model_name: str):
+    if model_name not in _embedding_models:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "Embedding ranking requires the optional sentence-transformers"
+                " package (pip install sentence-transformers).") from e
+        _embedding_models[model_name] = SentenceTransformer(model_name)
+    return _embedding_models[model_name]
+
+def _embed(texts: List[str], model_name: str) -> np.ndarray:
+    model = _get_embedding_model(model_name)
+    return np.asarray(model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+def rank_posts_sync(posts: List[RedditPost], video_title: str,
+                    video_description: str, method: str = "bm25",
+                    cache: Optional[PostVectorCache] = None
+) -> List[Tuple[RedditPost, float]]:
+    """
+    Score posts against the video, best first.
+
+    With "bm25", scores are divided by the best score so they fall in
+    [0, 1]. With "embeddings", they are cosine similarities.
+
+    :param posts: List of Reddit submissions to rank.
+    :param video_title: Title of the video.
+    :param video_description: Description of the video.
+    :param method: "bm25" or "embeddings".
+    :param cache: Optional cache of per-post vectors.
+    :return: (post, score) pairs sorted by decreasing score.
+    """
+    if not posts:
+        return []
+
+    if method == "bm25":
+        # The title is a better summary of the video, so it counts twice
+        query_terms = Counter(tokenize(f"{video_title}\n{video_title}\n{video_description}"))
+        documents = _get_vectors(
+            posts, "bm25",
+            lambda missing: [Counter(tokenize(_post_text(post))) for post in missing],
+            cache)
+        scores = bm25_scores(query_terms, documents)
+        best_score = scores.max()
+        if best_score > 0:
+            scores = scores / best_score
+    elif method == "embeddings":
+        model_name = os.getenv("LOCAL_EMBEDDING_MODEL") or DEFAULT_EMBEDDING_MODEL
+        query_vector = _embed([f"{video_title}\n{video_description}"], model_name)[0]
+        vectors = _get_vectors(
+            posts, f"embeddings:{model_name}",
+            lambda missing: list(_embed([_post_text(post) for post in missing], model_name)),
+            cache)
+        scores = np.stack(vectors) @ query_vector
+    else:
+        raise ValueError(f"Unknown ranking method: {method}")
+
+    order = np.argsort(-scores, kind="stable")
+    return [(posts[index], float(scores[index])) for index in order]
+
+async def prefilter_posts(posts: List[RedditPost], video_title: str,
+                          video_description: str, top_k: Optional[int] = None,
+                          threshold: Optional[float] = None,
+                          method: str = "bm25") -> List[RedditPost]:
+    """
+    Keep only the posts most likely to be relevant to the video.
+
+    :param posts: List of Reddit submissions to filter.
+    :param video_title: Title of the video.
+    :param video_description: Description of the video.
+    :param top_k: Keep at most this many of the best ranked posts, if given.
+    :param threshold: Keep only posts scoring at least this much, if given
+        (see `rank_posts_sync` for the score range).
+    :param method: "bm25" or "embeddings".
+    :return: The kept posts, best first.
+    """
+    ranked = await asyncio.to_thread(rank_posts_sync, posts, video_title,
+                                     video_description, method, PostVectorCache())
+    if threshold is not None:
+        ranked = [(post, score) for post, score in ranked
+                  if not math.isnan(score) and score >= threshold]
+    if top_k is not None:
+        ranked = ranked[:top_k]
+    return [post for post, _ in ranked]
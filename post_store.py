@@ -0,0 +1,173 @@
+"""
+Side store of Reddit post bodies.
+
+Posts travel through the pipeline and the step caches as slim records
+without their body text, which is written here as soon as a post is found
+and read back only by the stages that build prompts or rank posts. Writes
+are buffered and flushed in batches; bodies are zlib-compressed, keyed on
+post ID, and shared by all videos and processes.
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+from cache_utils import CACHE_DIR, open_database
+
+if TYPE_CHECKING:
+    from reddit_search import RedditPost
+
+POST_BODY_STORE_PATH = os.path.join(CACHE_DIR, "post_bodies.sqlite3")
+# Number of buffered bodies that triggers a write
+FLUSH_SIZE = 500
+
+class PostBodyStore:
+    """SQLite store of post bodies with a write buffer."""
+
+    def __init__(self, path: str = POST_BODY_STORE_PATH, flush_size: int = FLUSH_SIZE):
+        """
+        :param path: Path to the SQLite database file.
+        :param flush_size: Number of buffered bodies that triggers a write.
+        """
+        self.path = path
+        self.flush_size = flush_size
+        self._initialized = False
+        # Bodies not written yet, which readers see too
+        self._pending: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with open_database(self.path) as connection:
+            if not self._initialized:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS bodies ("
+                    " post_id TEXT PRIMARY KEY,"
+                    " body BLOB NOT NULL,"
+                    " stored_at REAL NOT NULL)")
+                self._initialized = True
+            yield connection
+
+    def put(self, post_id: str, body: str) -> bool:
+        """
+        Buffer the body of a post.
+
+        :param post_id: The post ID.
+        :param body: The post's body text.
+        :return: Whether the buffer is full and should be flushed.
+        """
+        with self._lock:
+            self._pending[post_id] = body
+            return len(self._pending) >= self.flush_size
+
+    def flush(self) -> None:
+        """Write the buffered bodies."""
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO bodies (post_id, body, stored_at) VALUES (?, ?, ?)",
+                [(post_id, zlib.compress(body.encode()), now)
+                 for post_id, body in pending.items()])
+        # Only dropped from the buffer once written, so readers always find them
+        with self._lock:
+            for post_id, body in pending.items():
+                if self._pending.get(post_id) is body:
+                    del self._pending[post_id]
+
+    def get_many(self, post_ids: List[str]) -> Dict[str, str]:
+        """
+        Look up post bodies.
+
+        :param post_ids: The post IDs.
+        :return: The stored bodies, by post ID.
+        """
+        with self._lock:
+            found = {post_id: self._pending[post_id]
+                     for post_id in post_ids if post_id in self._pending}
+        missing = [post_id for post_id in post_ids if post_id not in found]
+        if not missing:
+            return found
+        with self._connect() as connection:
+            # Stay below SQLite's limit on the number of query parameters
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT post_id, body FROM bodies WHERE post_id IN ({placeholders})",
+                    chunk)
+                found.update({post_id: zlib.decompress(body).decode()
+                              for post_id, body in rows})
+        return found
+
+    def get(self, post_id: str) -> Optional[str]:
+        """
+        :param post_id: The post ID.
+        :return: The body of the post, or None if it is not stored.
+        """
+        return self.get_many([post_id]).get(post_id)
+
+    def touch(self, post_ids: List[str]) -> None:
+        """
+        Mark bodies as used again, e.g. by posts saved in a step cache once
+        more, so pruning by age keeps them.
+
+        :param post_ids: The post IDs.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany("UPDATE bodies SET stored_at = ? WHERE post_id = ?",
+                                   [(now, post_id) for post_id in post_ids])
+
+    def prune(self, max_age: float) -> int:
+        """
+        Delete bodies stored or last used more than `max_age` seconds ago.
+
+        :param max_age: Maximum age in seconds.
+        :return: The number of deleted bodies.
+        """
+        self.flush()
+        with self._connect() as connection:
+            return connection.execute("DELETE FROM bodies WHERE stored_at < ?",
+                                      (time.time() - max_age,)).rowcount
+
+_post_body_store: Optional[PostBodyStore] = None
+
+def get_post_body_store() -> PostBodyStore:
+    """Return the shared post body store, creating it on first use."""
+    global _post_body_store
+    if _post_body_store is None:
+        _post_body_store = PostBodyStore()
+        # Slim posts saved by this process must find their body later
+        atexit.register(_post_body_store.flush)
+    return _post_body_store
+
+def with_bodies(posts: List["RedditPost"]) -> List["RedditPost"]:
+    """
+    Load the bodies of slim posts in one lookup. Blocking, run it in a
+    thread from async code.
+
+    :param posts: The posts, slim or not.
+    :return: The posts with their body, in the same order.
+    :raises RuntimeError: If the body of a slim post is missing from the
+        store, e.g. because it was pruned.
+    """
+    slim_ids = [post.id for post in posts if post.body is None]
+    if not slim_ids:
+        return posts
+    bodies = get_post_body_store().get_many(slim_ids)
+    missing = [post_id for post_id in slim_ids if post_id not in bodies]
+    if missing:
+        raise RuntimeError(
+            f"The bodies of {len(missing)} cached posts are missing from the post body"
+            f" store, e.g. posts {', '.join(missing[:3])}. Delete the video's cached posts"
+            f" to search again: python cache_utils.py delete --video-hash <hash>")
+    return [post if post.body is not None else post._replace(body=bodies[post.id])
+            for post in posts]
@@ -0,0 +1,315 @@
+"""
+Adaptive scheduler for OpenAI requests.
+
+A single scheduler is shared by every stage, so relevance checks, comment
+generation and keyword extraction draw from the same budget. It keeps the
+requests and tokens sent in the last minute under the configured limits,
+adjusts its concurrency AIMD-style (one more slot after a window of
+successes, half the slots after a 429), honours the rate limit headers of
+the responses and retries transient errors with jittered exponential
+backoff.
+"""
+
+import asyncio
+import math
+import random
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import (TYPE_CHECKING, Awaitable, Callable, Deque, Mapping, Optional,
+                    Tuple, TypeVar)
+from metrics import get_metrics
+
+if TYPE_CHECKING:
+    from openai import APIStatusError
+
+T = TypeVar("T")
+
+WINDOW = 60.0  # in seconds
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 0.5  # in seconds
+DEFAULT_MAX_DELAY = 60.0  # in seconds
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value: str) -> Optional[float]:
+    """
+    Parse a rate limit reset duration such as "1s", "6m0s" or "250ms".
+
+    :param value: The header value.
+    :return: The duration in seconds, or None if it cannot be parsed.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+@dataclass
+class SchedulerStats:
+    """Counters of the requests run by a scheduler."""
+    requests: int = 0
+    retries: int = 0
+    rate_limited: int = 0
+    failures: int = 0
+
+class RateScheduler:
+    """
+    Shared concurrency, rate and retry policy for LLM requests.
+
+    Use `run` to execute a request under the scheduler. The request may call
+    `observe_headers` and `record_usage` to report the response headers and
+    the actual token usage.
+    """
+
+    def __init__(self, max_concurrency: int = 10,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY):
+        """
+        :param max_concurrency: Upper bound of in-flight requests.
+        :param requests_per_minute: Optional request rate limit.
+        :param tokens_per_minute: Optional token rate limit.
+        :param max_retries: Maximum number of retries of a single request.
+        :param base_delay: Initial backoff delay in seconds.
+        :param max_delay: Maximum backoff delay in seconds.
+        """
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = SchedulerStats()
+        # Fraction of the account's limits this process may use
+        self.budget_share = 1.0
+
+        # Current AIMD concurrency limit, between 1 and max_concurrency
+        self.concurrency = float(max_concurrency)
+        self._in_flight = 0
+        # Send times, and (time, tokens) of the requests in the last window
+        self._request_times: Deque[float] = deque()
+        self._token_window: Deque[Tuple[float, int]] = deque()
+        self._window_tokens = 0
+        self._paused_until = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def set_max_concurrency(self, max_concurrency: int) -> None:
+        """
+        Change the upper bound of in-flight requests.
+
+        :param max_concurrency: Maximum number of concurrent requests.
+        :raises ValueError: If max_concurrency is not positive.
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.concurrency = min(self.concurrency, max_concurrency) or 1.0
+
+    def set_budget_share(self, share: float) -> None:
+        """
+        Use only a fraction of the request, token and concurrency limits,
+        e.g. 1/N when N processes share an API key. Limits learned later
+        from the response headers are scaled too.
+
+        :param share: The fraction, in (0, 1].
+        :raises ValueError: If share is out of range.
+        """
+        if not 0 < share <= 1:
+            raise ValueError("share must be in (0, 1]")
+        scale = share / self.budget_share
+        if self.requests_per_minute is not None:
+            self.requests_per_minute = max(1, int(self.requests_per_minute * scale))
+        if self.tokens_per_minute is not None:
+            self.tokens_per_minute = max(1, int(self.tokens_per_minute * scale))
+        self.set_max_concurrency(max(1, math.ceil(self.max_concurrency * scale)))
+        self.budget_share = share
+
+    async def run(self, request: Callable[[], Awaitable[T]],
+                  estimated_tokens: int = 0) -> T:
+        """
+        Run a request under the scheduler, retrying transient errors.
+
+        :param request: Coroutine function sending the request.
+        :param estimated_tokens: Estimated tokens used by the request.
+        :return: The request's result.
+        :raises Exception: The last error, once retries are exhausted, or
+            any error that is not transient.
+        """
+        attempt = 0
+        while True:
+            await self._acquire(estimated_tokens)
+            try:
+                result = await request()
+            except Exception as e:
+                retry_after = self._on_error(e)
+                if retry_after is None or attempt >= self.max_retries:
+                    self.stats.failures += 1
+                    get_metrics().increment("llm_failures_total")
+                    raise
+            else:
+                self._on_success()
+                self.stats.requests += 1
+                return result
+            finally:
+                await self._release()
+
+            attempt += 1
+            self.stats.retries += 1
+            get_metrics().increment("llm_retries_total")
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Pause new requests when the rate limit headers of a response show the
+        remaining requests or tokens are exhausted.
+
+        :param headers: The response headers.
+        """
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = headers.get(f"x-ratelimit-reset-{kind}")
+            if remaining is None or reset is None:
+                continue
+            try:
+                exhausted = int(remaining) <= 0
+            except ValueError:
+                continue
+            reset_seconds = parse_duration(reset)
+            if exhausted and reset_seconds:
+                self._pause(reset_seconds)
+
+        limit = headers.get("x-ratelimit-limit-requests")
+        if limit and limit.isdigit() and self.requests_per_minute is None:
+            self.requests_per_minute = max(1, int(int(limit) * self.budget_share))
+        limit = headers.get("x-ratelimit-limit-tokens")
+        if limit and limit.isdigit() and self.tokens_per_minute is None:
+            self.tokens_per_minute = max(1, int(int(limit) * self.budget_share))
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        Correct the token window with the actual usage of a request.
+
+        :param estimated_tokens: The estimate given to `run`.
+        :param actual_tokens: The tokens reported by the response.
+        """
+        difference = actual_tokens - estimated_tokens
+        if difference:
+            self._token_window.append((time.monotonic(), difference))
+            self._window_tokens += difference
+
+    def _pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _on_success(self) -> None:
+        # Additive increase: about one more slot per window of successes
+        self.concurrency = min(float(self.max_concurrency),
+                               self.concurrency + 1 / self.concurrency)
+
+    def _on_error(self, error: Exception) -> Optional[float]:
+        """
+        Classify an error.
+
+        :return: The delay requested by the server (0 if none) if the error
+            is transient, or None if it should not be retried.
+        """
+        # Imported here, a failed request has already loaded the client
+        from openai import (APIConnectionError, APIStatusError, APITimeoutError,
+                            RateLimitError)
+
+        if isinstance(error, RateLimitError):
+            self.stats.rate_limited += 1
+            get_metrics().increment("llm_rate_limited_total")
+            # Multiplicative decrease
+            self.concurrency = max(1.0, self.concurrency / 2)
+            retry_after = self._retry_after(error)
+            if retry_after:
+                self._pause(retry_after)
+            return retry_after or 0.0
+        if isinstance(error, (APIConnectionError, APITimeoutError)):
+            return 0.0
+        if isinstance(error, APIStatusError) and error.status_code >= 500:
+            return self._retry_after(error) or 0.0
+        return None
+
+    @staticmethod
+    def _retry_after(error: "APIStatusError") -> Optional[float]:
+        headers = error.response.headers if error.response is not None else {}
+        for name in ("retry-after-ms", "retry-after"):
+            value = headers.get(name)
+            if value is None:
+                continue
+            try:
+                seconds = float(value)
+            except ValueError:
+                continue
+            return seconds / 1000 if name == "retry-after-ms" else seconds
+        return None
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, at least as long as the server asked."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return max(retry_after or 0.0, random.uniform(0, ceiling))
+
+    def _report_load(self) -> None:
+        metrics = get_metrics()
+        metrics.set_gauge("llm_in_flight", self._in_flight)
+        metrics.set_gauge("llm_concurrency_limit", int(self.concurrency))
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        """Return how long to wait before a request may be sent."""
+        while self._request_times and self._request_times[0] <= now - WINDOW:
+            self._request_times.popleft()
+        while self._token_window and self._token_window[0][0] <= now - WINDOW:
+            self._window_tokens -= self._token_window.popleft()[1]
+
+        wait = self._paused_until - now
+        if (self.requests_per_minute
+                and len(self._request_times) >= self.requests_per_minute):
+            index = len(self._request_times) - self.requests_per_minute
+            wait = max(wait, self._request_times[index] + WINDOW - now)
+        if (self.tokens_per_minute and self._token_window
+                and self._window_tokens + tokens > self.tokens_per_minute):
+            # Wait until enough of the window has expired
+            excess = self._window_tokens + tokens - self.tokens_per_minute
+            for sent_at, sent_tokens in self._token_window:
+                excess -= sent_tokens
+                if excess <= 0:
+                    wait = max(wait, sent_at + WINDOW - now)
+                    break
+        return wait
+
+    async def _acquire(self, tokens: int) -> None:
+        async with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(now, tokens)
+                if wait <= 0 and self._in_flight < int(self.concurrency):
+                    break
+                try:
+                    await asyncio.wait_for(self._condition.wait(),
+                                           wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            self._in_flight += 1
+            self._report_load()
+            self._request_times.append(now)
+            self._token_window.append((now, tokens))
+            self._window_tokens += tokens
+
+    async def _release(self) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._report_load()
+            self._condition.notify_all()
@@ -3,33 +3,167 @@ Utility functions to interact with Reddit, including initialization,
 subreddit search, and post search.
 """
 
-import asyncpraw
+import asyncio
+import json
+import re
+import time
 import webbrowser
-from typing import List, NamedTuple
-from oauth_server import get_auth_code_from_server
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from metrics import get_metrics
+from post_store import get_post_body_store
 import os
 
+if TYPE_CHECKING:
+    import asyncpraw
+    from post_index import PostIndex
+
 class RedditPost(NamedTuple):
     id: str
     title: str
-    selftext: str
+    # The body text, or None for a slim post whose body is in the post body store
+    body: Optional[str]
     url: str
     num_comments: int
     created_utc: float
 
-async def get_reddit_instance() -> asyncpraw.Reddit:
+class SearchFilter(NamedTuple):
+    """Predicates applied while iterating search results."""
+    max_age_seconds: float
+    max_comments: int
+
+class HighWaterMark(NamedTuple):
+    """The newest post seen by a search, for incremental runs."""
+    created_utc: float
+    fullname: str
+
+@dataclass
+class SearchStats:
+    """Counts of posts fetched from Reddit and kept by the search filter."""
+    fetched: int = 0
+    kept: int = 0
+    discarded: int = 0
+    # Keyword listings stopped early because results left the time window
+    stopped_early: int = 0
+    # Posts served from the local post index without a network call
+    from_index: int = 0
+
+    def __str__(self) -> str:
+        return (f"fetched {self.fetched}, kept {self.kept}, discarded"
+                f" {self.discarded}, stopped early on {self.stopped_early}"
+                f" keywords, {self.from_index} from the post index")
+
+# Reddit's search time windows, from narrowest to widest
+TIME_FILTERS = [
+    ("hour", 60 * 60),
+    ("day", 24 * 60 * 60),
+    ("week", 7 * 24 * 60 * 60),
+    ("month", 31 * 24 * 60 * 60),
+    ("year", 366 * 24 * 60 * 60),
+]
+
+def get_time_filter(max_age_seconds: float) -> str:
+    """
+    Return the narrowest Reddit search time window covering the given age.
+
+    :param max_age_seconds: Maximum age of the posts, in seconds.
+    :return: One of Reddit's `time_filter` values.
+    """
+    for time_filter, seconds in TIME_FILTERS:
+        if max_age_seconds <= seconds:
+            return time_filter
+    return "all"
+
+DEFAULT_TOKEN_PATH = ".reddit_token.json"
+
+def _get_token_path() -> str:
+    return os.getenv("REDDIT_TOKEN_PATH") or DEFAULT_TOKEN_PATH
+
+def load_refresh_token() -> Optional[str]:
+    """
+    Load the Reddit refresh token from REDDIT_REFRESH_TOKEN or the token file.
+
+    :return: The refresh token, or None if there is none.
+    """
+    token = os.getenv("REDDIT_REFRESH_TOKEN")
+    if token:
+        return token
+    try:
+        with open(_get_token_path(), "r", encoding="utf-8") as file:
+            return json.load(file).get("refresh_token") or None
+    except (OSError, ValueError):
+        return None
+
+def save_refresh_token(refresh_token: str) -> None:
+    """
+    Save the Reddit refresh token to the token file, readable only by the
+    current user.
+
+    :param refresh_token: The refresh token.
+    """
+    token_path = _get_token_path()
+    file_descriptor = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+        json.dump({"refresh_token": refresh_token, "saved_at": time.time()}, file)
+
+def delete_refresh_token() -> None:
+    """Delete the saved Reddit refresh token, if any."""
+    try:
+        os.remove(_get_token_path())
+    except FileNotFoundError:
+        pass
+
+def _endpoint_overrides() -> Dict[str, str]:
+    """Reddit endpoints from REDDIT_URL and REDDIT_OAUTH_URL, e.g. a local fake."""
+    overrides = {}
+    if os.getenv("REDDIT_URL"):
+        overrides["reddit_url"] = os.environ["REDDIT_URL"]
+    if os.getenv("REDDIT_OAUTH_URL"):
+        overrides["oauth_url"] = os.environ["REDDIT_OAUTH_URL"]
+    return overrides
+
+async def get_reddit_instance(read_only: bool = False,
+                              reauthorize: bool = False) -> "asyncpraw.Reddit":
     """
     Load Reddit API credentials from environment variables and initialize
     Reddit instance.
 
+    A saved refresh token is reused, so the browser authorization only runs
+    the first time (or when `reauthorize` is set). The token is checked
+    first, and a revoked one is discarded and authorized again. In read-only
+    mode the
+    instance uses application-only auth, which is enough for searching and
+    needs neither a browser nor a redirect URI.
+
+    :param read_only: Whether to use application-only auth.
+    :param reauthorize: Whether to discard the saved refresh token and
+        authorize again in the browser.
     :return: Initialized Reddit instance.
-    :raises RuntimeError: If any required environment variables are missing.
+    :raises RuntimeError: If any required environment variables are missing,
+        or REDDIT_REFRESH_TOKEN was revoked.
     """
+    # Imported on first use, so cached runs do not load the network stack
+    import asyncpraw
+
     client_id = os.getenv("REDDIT_CLIENT_ID") or ""
     client_secret = os.getenv("REDDIT_CLIENT_SECRET") or ""
     user_agent = os.getenv("REDDIT_USER_AGENT") or ""
     redirect_uri = os.getenv("REDDIT_REDIRECT_URI") or ""
 
+    if read_only:
+        if not all([client_id, client_secret, user_agent]):
+            raise RuntimeError(
+                "Error: Missing one or more environment variables"
+                " (REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET, REDDIT_USER_AGENT)."
+            )
+        reddit = asyncpraw.Reddit(client_id=client_id,
+                                  client_secret=client_secret,
+                                  user_agent=user_agent,
+                                  **_endpoint_overrides())
+        reddit.read_only = True
+        return reddit
+
     if not all([client_id, client_secret, user_agent, redirect_uri]):
         raise RuntimeError(
             "Error: Missing one or more environment variables"
@@ -37,10 +171,106 @@ async def get_reddit_instance() -> asyncpraw.Reddit:
             " REDDIT_REDIRECT_URI)."
         )
 
-    return await _init_reddit(client_id, client_secret, user_agent, redirect_uri)
+    if reauthorize:
+        delete_refresh_token()
+
+    refresh_token = load_refresh_token()
+    if refresh_token:
+        reddit = asyncpraw.Reddit(client_id=client_id,
+                                  client_secret=client_secret,
+                                  user_agent=user_agent,
+                                  redirect_uri=redirect_uri,
+                                  refresh_token=refresh_token,
+                                  **_endpoint_overrides())
+        if await _is_authorized(reddit):
+            return reddit
+        await reddit.close()
+        if os.getenv("REDDIT_REFRESH_TOKEN"):
+            raise RuntimeError(
+                "Error: REDDIT_REFRESH_TOKEN was revoked or has expired."
+                " Update it, or unset it and run with --reauthorize."
+            )
+        print("🔑 The saved Reddit refresh token was revoked, authorizing again...")
+        delete_refresh_token()
+
+    reddit = await _init_reddit(client_id, client_secret, user_agent, redirect_uri)
+    if reddit.config.refresh_token:
+        save_refresh_token(reddit.config.refresh_token)
+    return reddit
+
+async def _is_authorized(reddit: "asyncpraw.Reddit") -> bool:
+    """
+    Check that Reddit still accepts the refresh token of an instance, with
+    one cheap request.
+
+    :param reddit: Reddit instance using a refresh token.
+    :return: False if the token was revoked, True otherwise. Other errors,
+        e.g. when offline, are left for the searches to report.
+    """
+    from asyncprawcore.exceptions import (AsyncPrawcoreException, OAuthException,
+                                          ResponseException)
+
+    try:
+        await reddit.user.me()
+    except OAuthException:
+        return False
+    except ResponseException as e:
+        # Reddit answers a revoked refresh token with invalid_grant
+        return e.response.status not in (400, 401)
+    except AsyncPrawcoreException:
+        pass
+    return True
+
+class RedditInitError(RuntimeError):
+    """Reddit could not be initialized, e.g. the user did not authorize the app."""
+
+class RedditSession:
+    """
+    Reddit instance created on first use, so a run served from the cache
+    never authorizes or loads Async PRAW.
+    """
+
+    def __init__(self, read_only: bool = False, reauthorize: bool = False):
+        """
+        :param read_only: Whether to use application-only auth.
+        :param reauthorize: Whether to discard the saved refresh token and
+            authorize again in the browser.
+        """
+        self.read_only = read_only
+        self.reauthorize = reauthorize
+        self._reddit: Optional["asyncpraw.Reddit"] = None
+        self._error: Optional[RedditInitError] = None
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> "asyncpraw.Reddit":
+        """
+        Return the Reddit instance, initializing it on the first call.
+
+        :return: Initialized Reddit instance.
+        :raises RedditInitError: If the initialization failed. It is not tried
+            again, so the user is not asked to authorize more than once.
+        """
+        async with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._reddit is None:
+                try:
+                    self._reddit = await get_reddit_instance(self.read_only,
+                                                             self.reauthorize)
+                except RuntimeError as e:
+                    self._error = RedditInitError(str(e))
+                    raise self._error from e
+                print("🚀 Reddit initialized successfully.")
+            return self._reddit
+
+    async def close(self) -> None:
+        """Close the Reddit instance, if it was created."""
+        if self._reddit is not None:
+            await self._reddit.close()
+            self._reddit = None
 
 async def _init_reddit(client_id: str, client_secret: str, user_agent: str,
-                      redirect_uri: str) -> asyncpraw.Reddit:
+                      redirect_uri: str) -> "asyncpraw.Reddit":
     """
     Initialize and return an Async PRAW instance using OAuth2.
 
@@ -51,12 +281,16 @@ async def _init_reddit(client_id: str, client_secret: str, user_agent: str,
     :return: Initialized Async PRAW instance.
     :raises: RuntimeError if there is an error during authentication.
     """
+    import asyncpraw
+    from oauth_server import get_auth_code_from_server
+
     print("Initializing Reddit with the following parameters:")
 
     reddit = asyncpraw.Reddit(client_id=client_id,
                               client_secret=client_secret,
                               user_agent=user_agent,
-                              redirect_uri=redirect_uri)
+                              redirect_uri=redirect_uri,
+                              **_endpoint_overrides())
 
     # Obtain the URL for user authentication
     auth_url = reddit.auth.url(["*"], "secrethorseshoe", "permanent")
@@ -80,26 +314,450 @@ async def _init_reddit(client_id: str, client_secret: str, user_agent: str,
 
     return reddit
 
-async def search_posts(reddit: asyncpraw.Reddit, keywords: List[str], limit_per_keyword: int = 10
+# Shared between videos in batch mode so a keyword is only fetched once.
+# The results and new high-water mark of each search, see `_search_keyword`.
+KeywordCache = Dict[str, "asyncio.Future[Tuple[List[RedditPost], Optional[HighWaterMark]]]"]
+
+DEFAULT_SEARCH_CONCURRENCY = 5
+DEFAULT_SEARCH_TIMEOUT = 120  # in seconds
+# Number of results Reddit returns per listing request
+REDDIT_PAGE_SIZE = 100
+# Subreddits combined into a single "sub1+sub2+..." search
+SUBREDDITS_PER_QUERY = 10
+
+_SUBREDDIT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_]{2,21}$")
+
+def normalize_subreddit_names(names: List[str]) -> List[str]:
+    """
+    Clean up subreddit names, e.g. "r/Python " to "Python", dropping
+    duplicates and names Reddit would reject.
+
+    :param names: The subreddit names.
+    :return: The valid, unique names, in their original order.
+    """
+    normalized: Dict[str, str] = {}
+    for name in names:
+        name = name.strip().removeprefix("/").removeprefix("r/")
+        if _SUBREDDIT_NAME_PATTERN.match(name):
+            normalized.setdefault(name.lower(), name)
+    return list(normalized.values())
+
+async def discover_subreddits(reddit: "asyncpraw.Reddit", keywords: List[str],
+                              limit_per_keyword: int = 5,
+                              max_concurrency: int = DEFAULT_SEARCH_CONCURRENCY
+) -> List[str]:
+    """
+    Find candidate subreddits whose name or description matches the keywords.
+
+    :param reddit: Initialized Async PRAW instance.
+    :param keywords: List of keywords to search for.
+    :param limit_per_keyword: Maximum number of subreddits per keyword.
+    :param max_concurrency: Maximum number of keywords searched at once.
+    :return: The unique subreddit names, in order of discovery.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def search(keyword: str) -> List[str]:
+        async with semaphore:
+            try:
+                return [subreddit.display_name async for subreddit
+                        in reddit.subreddits.search(keyword, limit=limit_per_keyword)]
+            except Exception as e:
+                print(f"Error searching subreddits for '{keyword}': {e}")
+                return []
+
+    results = await asyncio.gather(*[search(keyword) for keyword in dict.fromkeys(keywords)])
+    return normalize_subreddit_names([name for names in results for name in names])
+
+class _SearchClock:
+    """
+    Measures the time spent searching: it only runs while at least one
+    search is working, not while they all wait for the consumer to take
+    their posts, e.g. slow LLM stages in streaming mode.
+    """
+
+    def __init__(self, timeout: Optional[float]):
+        self.timeout = timeout
+        self._active = 0
+        self._elapsed = 0.0
+        self._started = 0.0
+
+    def _now(self) -> float:
+        if self._active:
+            return self._elapsed + time.monotonic() - self._started
+        return self._elapsed
+
+    def remaining(self) -> Optional[float]:
+        """The search time left, or None without a timeout."""
+        if self.timeout is None:
+            return None
+        return self.timeout - self._now()
+
+    def start(self) -> None:
+        if not self._active:
+            self._started = time.monotonic()
+        self._active += 1
+
+    def stop(self) -> None:
+        self._active -= 1
+        if not self._active:
+            self._elapsed += time.monotonic() - self._started
+
+    @contextmanager
+    def running(self) -> Iterator[None]:
+        self.start()
+        try:
+            yield
+        finally:
+            self.stop()
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        self.stop()
+        try:
+            yield
+        finally:
+            self.start()
+
+async def search_posts(reddit: "asyncpraw.Reddit", keywords: List[str], limit_per_keyword: int = 10,
+                       keyword_cache: Optional[KeywordCache] = None,
+                       max_concurrency: int = DEFAULT_SEARCH_CONCURRENCY,
+                       timeout: Optional[float] = DEFAULT_SEARCH_TIMEOUT,
+                       search_filter: Optional[SearchFilter] = None,
+                       stats: Optional[SearchStats] = None,
+                       subreddits: Optional[List[str]] = None,
+                       post_index: Optional["PostIndex"] = None,
+                       high_water_marks: Optional[Dict[str, HighWaterMark]] = None
 ) -> List[RedditPost]:
     """
     Search Reddit for posts matching the given keywords.
 
+    Keywords are searched concurrently and the results are deduplicated by
+    post ID as they arrive. If the search takes longer than `timeout`, the
+    remaining keywords are cancelled and the posts found so far are returned.
+    Time the searches spend waiting for a slow consumer of `iter_posts` does
+    not count.
+
     :param reddit: Initialized Async PRAW instance.
     :param keywords: List of keywords to search for.
-    :param limit: Maximum number of posts to return.
-    :return: List of RedditPost named tuples containing matching Reddit submissions.
-    """
-    posts = []
-    for keyword in keywords:
-        subreddit = await reddit.subreddit("all")
-        async for submission in subreddit.search(keyword, limit=limit_per_keyword):
-            posts.append(RedditPost(
-                id=submission.id,
-                title=submission.title,
-                selftext=submission.selftext,
-                url=submission.url,
-                num_comments=submission.num_comments,
-                created_utc=submission.created_utc
-            ))
-    return posts
+    :param limit_per_keyword: Maximum number of posts to return per keyword.
+    :param keyword_cache: Optional cache shared between searches, so
+        keywords already fetched (or being fetched) by another video are
+        reused instead of hitting the API again.
+    :param max_concurrency: Maximum number of keywords searched at once.
+    :param timeout: Maximum total search time in seconds, or None to wait
+        for every keyword.
+    :param search_filter: Optional predicates sent to Reddit as a time window
+        and applied while iterating, sorting by newest so each keyword's
+        listing stops as soon as results fall outside the window.
+    :param stats: Optional counters updated with fetched and kept posts.
+    :param subreddits: Optional subreddits to search instead of r/all. They
+        are combined into multi-subreddit queries of SUBREDDITS_PER_QUERY,
+        each searched separately for every keyword.
+    :param post_index: Optional index answering searches whose results are
+        still fresh without a network call, and recording new results.
+    :param high_water_marks: Optional newest post seen by each search in a
+        previous run, updated in place. If given, searches with a mark are
+        sorted by newest and return every post newer than their mark, even
+        past `limit_per_keyword`, and the index is not used to answer them.
+    :return: List of unique RedditPost named tuples, in arrival order.
+    :raises Exception: The first search error, if every search failed.
+    """
+    return [post async for post in iter_posts(
+        reddit, keywords, limit_per_keyword, keyword_cache=keyword_cache,
+        max_concurrency=max_concurrency, timeout=timeout,
+        search_filter=search_filter, stats=stats, subreddits=subreddits,
+        post_index=post_index, high_water_marks=high_water_marks)]
+
+async def iter_posts(reddit: "asyncpraw.Reddit", keywords: List[str], limit_per_keyword: int = 10,
+                     keyword_cache: Optional[KeywordCache] = None,
+                     max_concurrency: int = DEFAULT_SEARCH_CONCURRENCY,
+                     timeout: Optional[float] = DEFAULT_SEARCH_TIMEOUT,
+                     queue_size: int = 100,
+                     search_filter: Optional[SearchFilter] = None,
+                     stats: Optional[SearchStats] = None,
+                     subreddits: Optional[List[str]] = None,
+                     post_index: Optional["PostIndex"] = None,
+                     high_water_marks: Optional[Dict[str, HighWaterMark]] = None
+) -> AsyncIterator[RedditPost]:
+    """
+    Search Reddit for the given keywords and yield each unique post as soon
+    as it is received. See `search_posts` for the parameters.
+
+    :param queue_size: Maximum number of posts buffered ahead of the consumer.
+    :return: Async iterator of unique RedditPost named tuples.
+    :raises Exception: The first search error, if every search failed.
+    """
+    unique_keywords = list(dict.fromkeys(keywords))
+    if not unique_keywords:
+        return
+
+    subreddit_names = ["all"]
+    if subreddits:
+        names = normalize_subreddit_names(subreddits)
+        subreddit_names = ["+".join(names[start:start + SUBREDDITS_PER_QUERY])
+                           for start in range(0, len(names), SUBREDDITS_PER_QUERY)]
+    searches = [(keyword, subreddit_name) for keyword in unique_keywords
+                for subreddit_name in subreddit_names]
+
+    queue: asyncio.Queue[Optional[RedditPost]] = asyncio.Queue(maxsize=queue_size)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    clock = _SearchClock(timeout)
+
+    async def put(post: RedditPost) -> None:
+        with clock.paused():
+            await queue.put(post)
+
+    async def search(keyword: str, subreddit_name: str) -> None:
+        async with semaphore:
+            with clock.running():
+                await run_search(keyword, subreddit_name)
+
+    async def run_search(keyword: str, subreddit_name: str) -> None:
+        query = (f"{subreddit_name.lower()}:{keyword.strip().lower()}:"
+                 f"{limit_per_keyword}:{search_filter}")
+        incremental = high_water_marks is not None
+        if post_index is not None and not incremental:
+            indexed = await asyncio.to_thread(post_index.get_fresh_query, query)
+            if indexed is not None:
+                if stats is not None:
+                    stats.from_index += len(indexed)
+                # Slim posts, whose bodies are already in the body store
+                for post in indexed:
+                    await put(post)
+                return
+
+        subreddit = await reddit.subreddit(subreddit_name)
+        posts = []
+        if keyword_cache is None:
+            async for post in _iter_keyword(subreddit, keyword, limit_per_keyword,
+                                            search_filter, stats,
+                                            high_water_marks, query):
+                posts.append(post)
+                await put(post)
+        else:
+            cache_key = query
+            if incremental:
+                cache_key += f":since={high_water_marks.get(query)}"
+            future = keyword_cache.get(cache_key)
+            if future is None:
+                future = asyncio.ensure_future(
+                    _search_keyword(subreddit, keyword, limit_per_keyword,
+                                    search_filter, stats,
+                                    high_water_marks, query))
+                keyword_cache[cache_key] = future
+            try:
+                # Shielded so a timeout here does not cancel another video's search
+                posts, mark = await asyncio.shield(future)
+            except Exception:
+                # Let the next video retry instead of reusing the failure
+                if keyword_cache.get(cache_key) is future:
+                    keyword_cache.pop(cache_key, None)
+                raise
+            if incremental and mark is not None:
+                # Every video sharing the search advances its own mark
+                high_water_marks[query] = mark
+            for post in posts:
+                await put(post)
+
+        if post_index is not None and incremental:
+            # Only the new posts were fetched, so keep the query's results
+            await asyncio.to_thread(post_index.put_posts, posts)
+        elif post_index is not None:
+            await asyncio.to_thread(post_index.put_query, query, posts)
+
+    tasks = [asyncio.create_task(search(keyword, subreddit_name))
+             for keyword, subreddit_name in searches]
+
+    async def wait_for_searches() -> None:
+        try:
+            pending = set(tasks)
+            while pending:
+                remaining = clock.remaining()
+                if remaining is not None and remaining <= 0:
+                    break
+                # Search time is left if the clock was paused meanwhile
+                _, pending = await asyncio.wait(pending, timeout=remaining)
+            done = set(tasks) - pending
+
+            if pending:
+                print(f"⏱️ Search timed out after {timeout}s, skipping"
+                      f" {len(pending)} of {len(tasks)} searches.")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+            errors = []
+            for (keyword, subreddit_name), task in zip(searches, tasks):
+                if task in done and task.exception() is not None:
+                    print(f"Error searching r/{subreddit_name} for '{keyword}':"
+                          f" {task.exception()}")
+                    errors.append(task.exception())
+            if errors and len(errors) == len(tasks):
+                raise errors[0]
+        finally:
+            await queue.put(None)
+
+    waiter = asyncio.create_task(wait_for_searches())
+    metrics = get_metrics()
+    seen = set()
+    try:
+        while True:
+            post = await queue.get()
+            metrics.set_gauge("queue_depth", queue.qsize(), queue="search")
+            if post is None:
+                break
+            if post.id in seen:
+                continue
+            seen.add(post.id)
+            yield post
+        await waiter
+    finally:
+        # The consumer may stop early, so do not leave searches behind
+        for task in tasks:
+            task.cancel()
+        waiter.cancel()
+
+async def _timed_listing(listing) -> AsyncIterator:
+    """
+    Yield the submissions of a listing, recording the time spent waiting for
+    each page of results.
+
+    :param listing: An Async PRAW listing generator.
+    :return: Async iterator of its submissions.
+    """
+    metrics = get_metrics()
+    iterator = listing.__aiter__()
+    waited = 0.0
+    count = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                submission = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                waited += time.perf_counter() - start
+            count += 1
+            metrics.increment("reddit_posts_fetched_total")
+            if count % REDDIT_PAGE_SIZE == 0:
+                metrics.observe("reddit_page_seconds", waited)
+                waited = 0.0
+            yield submission
+    finally:
+        # The last, partial page, also when the caller stops early
+        if count % REDDIT_PAGE_SIZE or not count:
+            metrics.observe("reddit_page_seconds", waited)
+
+async def _search_keyword(subreddit, keyword: str, limit: int,
+                          search_filter: Optional[SearchFilter] = None,
+                          stats: Optional[SearchStats] = None,
+                          high_water_marks: Optional[Dict[str, HighWaterMark]] = None,
+                          query: str = ""
+) -> Tuple[List[RedditPost], Optional[HighWaterMark]]:
+    """
+    Search a subreddit for a single keyword. See `_iter_keyword` for the
+    parameters. `high_water_marks` is not updated, so that the search can be
+    shared by callers with marks of their own.
+
+    :return: List of matching RedditPost named tuples, and the query's new
+        high-water mark, if marks are given and it has one.
+    """
+    marks = None
+    if high_water_marks is not None:
+        marks = {query: high_water_marks[query]} if query in high_water_marks else {}
+    posts = [post async for post in _iter_keyword(subreddit, keyword, limit,
+                                                  search_filter, stats, marks, query)]
+    return posts, marks.get(query) if marks is not None else None
+
+async def _iter_keyword(subreddit, keyword: str, limit: int,
+                        search_filter: Optional[SearchFilter] = None,
+                        stats: Optional[SearchStats] = None,
+                        high_water_marks: Optional[Dict[str, HighWaterMark]] = None,
+                        query: str = ""
+) -> AsyncIterator[RedditPost]:
+    """
+    Yield the posts matching a single keyword as each one is received.
+
+    :param subreddit: The Async PRAW subreddit to search.
+    :param keyword: The keyword to search for.
+    :param limit: Maximum number of posts to fetch, except after a
+        high-water mark, when every newer post is fetched.
+    :param search_filter: Optional predicates applied while iterating.
+    :param stats: Optional counters updated with fetched and kept posts.
+    :param high_water_marks: Optional newest post seen by each query. A
+        query without a mark is searched as usual and gets the newest post
+        it returned as its mark. A query with a mark is sorted by newest and
+        read until the mark, past `limit`, so no post is skipped. The mark
+        is only advanced once the listing has been read to its end.
+    :param query: The key of this search in `high_water_marks`.
+    :return: Async iterator of RedditPost named tuples.
+    """
+    now = time.time()
+    since = high_water_marks.get(query) if high_water_marks is not None else None
+    body_store = get_post_body_store()
+
+    if search_filter is None and since is None:
+        listing = subreddit.search(keyword, limit=limit)
+    else:
+        max_age = search_filter.max_age_seconds if search_filter is not None else None
+        if since is not None:
+            since_age = now - since.created_utc
+            max_age = min(max_age, since_age) if max_age is not None else since_age
+        listing = subreddit.search(
+            keyword, sort="new",
+            time_filter=get_time_filter(max_age) if max_age is not None else "all",
+            # As many pages as Reddit serves, the mark ends the listing
+            limit=None if since is not None else limit)
+    min_created_utc = (now - search_filter.max_age_seconds
+                       if search_filter is not None else None)
+
+    newest = None
+    async for submission in _timed_listing(listing):
+        if stats is not None:
+            stats.fetched += 1
+        if high_water_marks is not None and (newest is None
+                                             or submission.created_utc > newest.created_utc):
+            # Not always the first result, the first search is sorted by relevance
+            newest = HighWaterMark(submission.created_utc, submission.fullname)
+
+        if since is not None and (submission.fullname == since.fullname
+                                  or submission.created_utc < since.created_utc):
+            # Sorted by newest, so the rest was seen by a previous run
+            if stats is not None:
+                stats.discarded += 1
+                stats.stopped_early += 1
+            break
+
+        if search_filter is not None and min_created_utc is not None:
+            if submission.created_utc <= min_created_utc:
+                # Sorted by newest, so every later result is older still
+                if stats is not None:
+                    stats.discarded += 1
+                    stats.stopped_early += 1
+                break
+            if submission.num_comments > search_filter.max_comments:
+                if stats is not None:
+                    stats.discarded += 1
+                continue
+
+        if stats is not None:
+            stats.kept += 1
+        # Only the stages that read the body load it back from the store
+        if body_store.put(submission.id, submission.selftext):
+            await asyncio.to_thread(body_store.flush)
+        yield RedditPost(
+            id=submission.id,
+            title=submission.title,
+            body=None,
+            url=submission.url,
+            num_comments=submission.num_comments,
+            created_utc=submission.created_utc
+        )
+
+    await asyncio.to_thread(body_store.flush)
+
+    if (high_water_marks is not None and newest is not None
+            and (since is None or newest.created_utc >= since.created_utc)):
+        high_water_marks[query] = newest
@@ -0,0 +1,29 @@
+"""The modules live at the top level of the repository."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture
+def openai_server(monkeypatch, request):
+    """
+    Point the LLM helpers at a mock OpenAI server, with fresh process-wide
+    client, scheduler and metrics, and the response cache disabled. Tests
+    can pass `MockSettings` with `@pytest.mark.parametrize(..., indirect=True)`.
+    """
+    import llm_utils
+    import metrics
+    from benchmarks.mock_openai import MockOpenAIServer, MockSettings
+
+    settings = getattr(request, "param", None) or MockSettings(latency=0.01)
+    with MockOpenAIServer(settings) as server:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setenv("LLM_CACHE", "0")
+        monkeypatch.setattr(llm_utils, "_client", None)
+        monkeypatch.setattr(llm_utils, "_scheduler", None)
+        monkeypatch.setattr(metrics, "_metrics", None)
+        yield server
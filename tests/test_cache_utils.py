@@ -0,0 +1,79 @@
+import asyncio
+import os
+import pickle
+import pytest
+import cache_utils
+import metrics
+from cache_utils import CacheStore, cache_result
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("cache_utils.time.time", lambda: now[0])
+    return now
+
+def write_pickle(directory, video_hash, step, value):
+    os.makedirs(directory / video_hash, exist_ok=True)
+    with open(directory / video_hash / f"{step}.pkl", "wb") as file:
+        pickle.dump(value, file)
+
+def test_least_recently_used_entries_are_evicted_over_the_size_limit(tmp_path, clock):
+    entry_size = len(pickle.dumps("x" * 100))
+    store = CacheStore(str(tmp_path / "cache.sqlite3"), max_size=2 * entry_size,
+                       legacy_dir=None)
+    store.set_sync("video", "a", "x" * 100)
+    clock[0] = 1.0
+    store.set_sync("video", "b", "x" * 100)
+    clock[0] = 2.0
+    assert store.get_sync("video", "a")[0]
+    clock[0] = 3.0
+    store.set_sync("video", "c", "x" * 100)
+    assert [store.get_sync("video", step)[0] for step in "abc"] == [True, False, True]
+
+def test_expired_entries_are_misses_and_pruned(tmp_path, clock):
+    store = CacheStore(str(tmp_path / "cache.sqlite3"), max_age=10, legacy_dir=None)
+    store.set_sync("video", "old", 1)
+    clock[0] = 5.0
+    store.set_sync("video", "new", 2)
+    clock[0] = 12.0
+    assert store.get_sync("video", "old") == (False, None)
+    assert store.get_sync("video", "new") == (True, 2)
+    clock[0] = 20.0
+    assert store.prune_sync(max_age=10) == 1
+    assert store.list_sync() == []
+
+def test_old_pickle_files_are_imported_on_a_miss(tmp_path):
+    legacy_dir = tmp_path / "cache"
+    write_pickle(legacy_dir, "video", "keywords", ["python"])
+    store = CacheStore(str(tmp_path / "cache.sqlite3"), legacy_dir=str(legacy_dir))
+    assert store.get_sync("video", "keywords") == (True, ["python"])
+    assert store.get_sync("video", "comments") == (False, None)
+    # The entry now lives in the database
+    os.remove(legacy_dir / "video" / "keywords.pkl")
+    assert store.get_sync("video", "keywords") == (True, ["python"])
+
+def test_migrate_imports_and_deletes_pickle_files(tmp_path):
+    legacy_dir = tmp_path / "cache"
+    write_pickle(legacy_dir, "first", "keywords", ["python"])
+    write_pickle(legacy_dir, "second", "comments", {"abc": "A comment"})
+    store = CacheStore(str(tmp_path / "cache.sqlite3"), legacy_dir=None)
+    assert store.migrate_sync(str(legacy_dir), delete=True) == 2
+    assert store.get_sync("second", "comments") == (True, {"abc": "A comment"})
+    assert os.listdir(legacy_dir) == []
+
+def test_cached_steps_run_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_utils, "_cache_store",
+                        CacheStore(str(tmp_path / "cache.sqlite3"), legacy_dir=None))
+    monkeypatch.setattr(metrics, "_metrics", None)
+    calls = []
+
+    @cache_result("keywords")
+    async def extract(video_hash):
+        calls.append(video_hash)
+        return ["python"]
+
+    assert asyncio.run(extract(video_hash="video")) == ["python"]
+    assert asyncio.run(extract(video_hash="video")) == ["python"]
+    assert calls == ["video"]
+    with pytest.raises(ValueError):
+        asyncio.run(extract(video_hash=None))
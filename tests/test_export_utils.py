@@ -0,0 +1,55 @@
+import csv
+import pytest
+from export_utils import ExportRow, open_exporter
+
+def row(post_id, cluster_id=None):
+    return ExportRow(video_url="https://youtube.com/watch?v=1", post_id=post_id,
+                     cluster_id=cluster_id, title="Title", url="https://reddit.com",
+                     comment="Nice", relevant=True, num_comments=1, created_utc=0.0,
+                     exported_at=0.0, elapsed_seconds=1.0)
+
+def test_csv_append_skips_known_posts(tmp_path):
+    path = str(tmp_path / "posts.csv")
+    with open_exporter(path) as exporter:
+        exporter.write(row("a"))
+    with open_exporter(path, append=True) as exporter:
+        assert not exporter.write(row("a"))
+        assert exporter.write(row("b", cluster_id="a"))
+
+    with open(path, newline="", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    assert [(row["Post ID"], row["Cluster ID"]) for row in rows] == [("a", ""), ("b", "a")]
+
+def test_csv_append_rejects_other_columns(tmp_path):
+    path = tmp_path / "posts.csv"
+    path.write_text("Post Title,Post URL\nTitle,https://reddit.com\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="different columns"):
+        with open_exporter(str(path), append=True):
+            pass
+
+def test_parquet_append_skips_known_posts(tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "posts.parquet")
+    with open_exporter(path) as exporter:
+        exporter.write(row("a"))
+    with open_exporter(path, append=True) as exporter:
+        assert not exporter.write(row("a"))
+        assert exporter.write(row("b", cluster_id="a"))
+
+    table = parquet.read_table(path)
+    assert table.column("post_id").to_pylist() == ["a", "b"]
+    assert table.column("cluster_id").to_pylist() == [None, "a"]
+
+def test_parquet_writes_a_row_group_per_flush(tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    from export_utils import ParquetExporter
+
+    path = str(tmp_path / "posts.parquet")
+    with ParquetExporter(path, row_group_size=2) as exporter:
+        for post_id in "abcde":
+            exporter.write(row(post_id))
+    assert parquet.ParquetFile(path).num_row_groups == 3
+
+    with ParquetExporter(path, append=True, row_group_size=2) as exporter:
+        assert exporter.write(row("f"))
+    assert parquet.read_table(path).column("post_id").to_pylist() == list("abcdef")
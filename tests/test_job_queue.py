@@ -0,0 +1,39 @@
+from job_queue import FAILED, PENDING, JobQueue
+
+def make_queue(tmp_path, **kwargs):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), **kwargs)
+
+def test_failed_job_is_retried_up_to_max_attempts(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.enqueue(["https://youtube.com/watch?v=1"], {})
+
+    job = queue.lease("w1")
+    assert job.attempts == 1
+    assert queue.fail(job.id, "w1", "boom")
+    job = queue.lease("w1")
+    assert job.attempts == 2
+    assert not queue.fail(job.id, "w1", "boom")
+    assert queue.lease("w1") is None
+    assert queue.counts() == {FAILED: 1}
+
+def test_expired_lease_counts_as_an_attempt(tmp_path):
+    # Every lease expires at once, as if the job killed its worker each time
+    queue = make_queue(tmp_path, lease_seconds=-1, max_attempts=2)
+    queue.enqueue(["https://youtube.com/watch?v=1"], {})
+
+    assert queue.lease("w1").attempts == 1
+    assert queue.lease("w2").attempts == 2
+    assert queue.lease("w3") is None
+    assert not queue.has_unfinished()
+    [status] = queue.list()
+    assert status.status == FAILED
+    assert "Lease expired 2 times" in status.error
+
+def test_resume_resets_attempts(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=-1, max_attempts=1)
+    queue.enqueue(["https://youtube.com/watch?v=1"], {})
+    queue.lease("w1")
+
+    assert queue.resume() == 1
+    assert queue.counts() == {PENDING: 1}
+    assert queue.lease("w1").attempts == 1
@@ -0,0 +1,53 @@
+import time
+import pytest
+from llm_utils import JSONStreamParser, extract_json_from_string
+
+@pytest.mark.parametrize("text, expected", [
+    ('Here: {"keywords": ["a", "b"], "n": {"x": [1, {"y": 2}]}} done',
+     {"keywords": ["a", "b"], "n": {"x": [1, {"y": 2}]}}),
+    ('see [below] then {"a": "}{["}', {"a": "}{["}),
+    ('```json\n{"relevant_ids": ["x1"], "not_relevant_ids": []}\n```',
+     {"relevant_ids": ["x1"], "not_relevant_ids": []}),
+    ('prefix {"a": "esc \\" }"} z', {"a": 'esc " }'}),
+    ('{ ] {"ok": true}', {"ok": True}),
+    ('[see {"a": 1} below]', {"a": 1}),
+    ('[ {a ] {"b": 2}', {"b": 2}),
+])
+def test_extracts_first_value(text, expected):
+    assert extract_json_from_string(text) == expected
+
+def test_unclosed_bracket_before_json():
+    assert extract_json_from_string('Use {curly braces like {"a":1}') == {"a": 1}
+    assert extract_json_from_string('{x {y {"deep": [1, {"k": []}]} z') == {"deep": [1, {"k": []}]}
+
+def test_no_json():
+    with pytest.raises(ValueError):
+        extract_json_from_string("nothing here")
+    with pytest.raises(ValueError):
+        extract_json_from_string('{"a": [1, }')
+
+def test_feed_in_pieces():
+    parser = JSONStreamParser()
+    text = 'Sure! {"keywords": ["rust", "async"]} and [1]'
+    values = []
+    for start in range(0, len(text), 3):
+        values += parser.feed(text[start:start + 3])
+    assert values == [{"keywords": ["rust", "async"]}, [1]]
+
+def _seconds(text: str) -> float:
+    start = time.perf_counter()
+    try:
+        extract_json_from_string(text)
+    except ValueError:
+        pass
+    return time.perf_counter() - start
+
+@pytest.mark.parametrize("make_text", [
+    lambda n: "{" * n + "]",
+    lambda n: "[x " * n + '{"a": 1}',
+    lambda n: "[x] " * n + '{"a": 1}',
+])
+def test_linear_time(make_text):
+    # Rescanning after each invalid candidate took ~1.5s at n=4000 and grew
+    # quadratically, i.e. ~40s here
+    assert _seconds(make_text(20000)) < 2
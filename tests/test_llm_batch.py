@@ -0,0 +1,77 @@
+import asyncio
+import os
+import pytest
+import llm_batch
+from llm_batch import BatchJobError, DeferredBatcher, LocalBatchBackend
+
+async def echo(body):
+    return {"choices": [{"message": {"content": body["messages"][-1]["content"].upper()}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1}}
+
+def body(prompt):
+    return {"model": "test", "messages": [{"role": "user", "content": prompt}]}
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setattr(llm_batch, "get_llm_cache", lambda: None)
+
+def make_batcher(tmp_path, backend):
+    return DeferredBatcher(backend, directory=str(tmp_path / "batches"),
+                           idle_seconds=0.01, poll_seconds=0.01)
+
+def test_requests_are_answered_by_one_job(tmp_path):
+    backend = LocalBatchBackend(str(tmp_path / "local"), respond=echo)
+    batcher = make_batcher(tmp_path, backend)
+
+    async def run():
+        return await asyncio.gather(batcher.request("a", body("one")),
+                                    batcher.request("b", body("two")))
+
+    assert asyncio.run(run()) == ["ONE", "TWO"]
+    # The job's record, request file and local files are deleted
+    assert os.listdir(tmp_path / "batches") == []
+    assert os.listdir(tmp_path / "local") == []
+
+class FlakyBackend(LocalBatchBackend):
+    def __init__(self, directory, failures, error=ConnectionError):
+        super().__init__(directory, respond=echo)
+        self.failures = failures
+        self.error = error
+        self.checks = 0
+
+    async def fetch_results(self, job_id):
+        self.checks += 1
+        if self.checks <= self.failures:
+            raise self.error("connection reset")
+        return await super().fetch_results(job_id)
+
+def test_transient_poll_errors_are_retried(tmp_path):
+    backend = FlakyBackend(str(tmp_path / "local"), failures=2)
+    batcher = make_batcher(tmp_path, backend)
+
+    assert asyncio.run(batcher.request("a", body("one"))) == "ONE"
+    assert backend.checks == 3
+
+def test_terminal_job_error_fails_requests_and_forgets_the_job(tmp_path):
+    backend = FlakyBackend(str(tmp_path / "local"), failures=1, error=BatchJobError)
+    batcher = make_batcher(tmp_path, backend)
+
+    with pytest.raises(RuntimeError, match="connection reset"):
+        asyncio.run(batcher.request("a", body("one")))
+    assert os.listdir(tmp_path / "batches") == []
+    assert os.listdir(tmp_path / "local") == []
+
+def test_job_is_kept_when_polling_keeps_failing(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_batch, "MAX_POLL_ERRORS", 2)
+    backend = FlakyBackend(str(tmp_path / "local"), failures=2)
+    batcher = make_batcher(tmp_path, backend)
+
+    with pytest.raises(RuntimeError, match="Gave up"):
+        asyncio.run(batcher.request("a", body("one")))
+    records = [name for name in os.listdir(tmp_path / "batches") if name.endswith(".json")]
+    assert len(records) == 1
+
+    # The next run resumes the job and gets its answer
+    resumed = make_batcher(tmp_path, backend)
+    assert asyncio.run(resumed.request("a", body("one"))) == "ONE"
+    assert os.listdir(tmp_path / "batches") == []
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+import metrics
+from llm_cache import LLMCache, get_cache_key
+from metrics import get_metrics
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "_metrics", None)
+    return LLMCache(str(tmp_path / "llm.sqlite3"))
+
+def counting(response, calls, delay=0.01):
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return response
+    return compute
+
+def requests(result):
+    return get_metrics().counter_total("cache_requests_total", cache="llm", result=result)
+
+def test_concurrent_misses_share_one_computation(cache):
+    calls = []
+    key = get_cache_key("model", None, "prompt")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute(key, counting("answer", calls))
+                                      for _ in range(5)))
+
+    assert asyncio.run(run()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert (requests("miss"), requests("shared")) == (1, 4)
+
+    # Later requests are hits, also from another cache on the same file
+    other = LLMCache(cache.path)
+    assert asyncio.run(other.get_or_compute(key, counting("other", calls))) == "answer"
+    assert len(calls) == 1
+    assert requests("hit") == 1
+
+def test_cancelled_caller_does_not_cancel_the_others(cache):
+    calls = []
+
+    async def run():
+        first = asyncio.ensure_future(cache.get_or_compute("key", counting("answer", calls, 0.05)))
+        second = asyncio.ensure_future(cache.get_or_compute("key", counting("answer", calls)))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "answer"
+    assert cache.get_sync("key") == "answer"
+
+def test_empty_responses_are_not_cached(cache):
+    assert asyncio.run(cache.get_or_compute("key", counting("", []))) == ""
+    assert cache.get_sync("key") is None
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    cache = LLMCache(str(tmp_path / "llm.sqlite3"), max_entries=2)
+    clock = iter(range(100))
+    monkeypatch.setattr("llm_cache.time.time", lambda: float(next(clock)))
+    cache.set_sync("a", "1")
+    cache.set_sync("b", "2")
+    assert cache.get_sync("a") == "1"
+    cache.set_sync("c", "3")
+    assert [cache.get_sync(key) for key in "abc"] == ["1", None, "3"]
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    cache = LLMCache(str(tmp_path / "llm.sqlite3"), ttl=10)
+    now = [0.0]
+    monkeypatch.setattr("llm_cache.time.time", lambda: now[0])
+    cache.set_sync("key", "answer")
+    now[0] = 5.0
+    assert cache.get_sync("key") == "answer"
+    now[0] = 11.0
+    assert cache.get_sync("key") is None
+
+def test_keys_depend_on_every_part_of_the_request():
+    keys = {get_cache_key("model", None, "prompt"),
+            get_cache_key("other", None, "prompt"),
+            get_cache_key("model", "system", "prompt"),
+            get_cache_key("model", None, "other"),
+            get_cache_key("model", None, "prompt", {"type": "json_object"})}
+    assert len(keys) == 5
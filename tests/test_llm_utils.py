@@ -0,0 +1,18 @@
+import asyncio
+from llm_utils import request_completion, request_json
+from metrics import get_metrics
+
+RELEVANCE_PROMPT = 'Post Title: Learning Python\nAnswer with {"relevant": true or false}.'
+SCHEMA = {"type": "object", "properties": {"relevant": {"type": "boolean"}},
+          "required": ["relevant"], "additionalProperties": False}
+
+def test_streamed_json_requests_record_their_usage(openai_server):
+    result = asyncio.run(request_json(RELEVANCE_PROMPT, schema=SCHEMA, schema_name="relevance"))
+    assert set(result) == {"relevant"}
+    metrics = get_metrics()
+    assert metrics.counter_total("llm_tokens_total", kind="prompt") > 0
+    assert metrics.counter_total("llm_tokens_total", kind="completion") > 0
+
+def test_plain_requests_record_their_usage(openai_server):
+    assert "video" in asyncio.run(request_completion("Write a comment"))
+    assert get_metrics().counter_total("llm_tokens_total", kind="prompt") > 0
@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+import outreach
+from reddit_search import RedditPost
+
+class MemoryStore:
+    def __init__(self):
+        self.steps = {}
+
+    async def get(self, video_hash, step):
+        return step in self.steps, self.steps.get(step)
+
+    async def set(self, video_hash, step, value):
+        self.steps[step] = value
+
+def post(post_id):
+    return RedditPost(id=post_id, title=f"Title {post_id}", body="body",
+                      url=f"https://reddit.com/{post_id}", num_comments=0, created_utc=0.0)
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryStore()
+    monkeypatch.setattr(outreach, "get_cache_store", lambda: store)
+    return store
+
+def test_new_near_duplicates_reuse_their_cluster_verdict_and_comment(store, monkeypatch):
+    judged, commented = [], []
+
+    async def analyze_posts(posts, *args, **kwargs):
+        judged.extend(post.id for post in posts)
+        return [post for post in posts if post.id == "fresh"]
+
+    async def iter_engagement_content(video_url, video_title, posts, **kwargs):
+        for post in posts:
+            commented.append(post.id)
+            yield post.id, f"comment for {post.id}"
+
+    monkeypatch.setattr(outreach, "analyze_posts", analyze_posts)
+    monkeypatch.setattr(outreach, "iter_engagement_content", iter_engagement_content)
+    store.steps["relevant_posts"] = [post("a")]
+    store.steps["comments"] = {"a": "comment for a"}
+
+    # "a2" and "b2" are new near-duplicates of "a" (relevant) and "b" (not relevant)
+    posts = [post("a"), post("b"), post("a2"), post("b2"), post("fresh")]
+    clusters = {"a": "a", "a2": "a", "b": "b", "b2": "b", "fresh": "fresh"}
+    new_posts = posts[2:]
+
+    async def run():
+        relevant = await outreach.update_relevant_posts(posts, new_posts, "Video", "Summary",
+                                                        "hash", clusters=clusters)
+        comments = await outreach.generate_comments("https://youtu.be/1", "Video", relevant,
+                                                    "hash", clusters=clusters)
+        return relevant, comments
+
+    relevant, comments = asyncio.run(run())
+    assert judged == ["fresh"]
+    assert [p.id for p in relevant] == ["a", "a2", "fresh"]
+    assert commented == ["fresh"]
+    assert comments["a2"] == "comment for a"
+    assert store.steps["comments"] == comments
@@ -0,0 +1,71 @@
+import asyncio
+import re
+import post_analysis
+from post_analysis import RelevanceStats, analyze_posts, split_into_batches
+from reddit_search import RedditPost
+
+def make_post(post_id, body="Some text"):
+    return RedditPost(id=post_id, title=f"Post {post_id}", body=body,
+                      url=f"https://www.reddit.com/comments/{post_id}/",
+                      num_comments=0, created_utc=1.0)
+
+class FakeModel:
+    """Judges posts with an even ID relevant, failing batches over `max_batch` posts."""
+
+    def __init__(self, max_batch):
+        self.max_batch = max_batch
+        self.batch_sizes = []
+
+    async def request_json(self, prompt, system_prompt, schema, schema_name):
+        if schema_name == "relevance":
+            self.batch_sizes.append(1)
+            post_id = re.search(r"Post Title: Post (\d+)", prompt).group(1)
+            return {"relevant": int(post_id) % 2 == 0}
+        post_ids = re.findall(r'<post id="(\d+)">', prompt)
+        self.batch_sizes.append(len(post_ids))
+        if len(post_ids) > self.max_batch:
+            raise ValueError("Truncated output")
+        # Drops the last post of batches of three
+        answered = post_ids[:2] if len(post_ids) == 3 else post_ids
+        return {"relevant_ids": [post_id for post_id in answered if int(post_id) % 2 == 0],
+                "not_relevant_ids": [post_id for post_id in answered if int(post_id) % 2]}
+
+def classify(posts, model, monkeypatch):
+    monkeypatch.setattr(post_analysis, "request_json", model.request_json)
+    stats = RelevanceStats()
+    relevant = asyncio.run(analyze_posts(posts, "A video", "Its description",
+                                         batched=True, stats=stats))
+    return [post.id for post in relevant], stats
+
+def test_batches_answer_every_post_in_one_request(monkeypatch):
+    model = FakeModel(max_batch=25)
+    relevant, stats = classify([make_post(str(index)) for index in range(8)], model,
+                               monkeypatch)
+    assert relevant == ["0", "2", "4", "6"]
+    assert model.batch_sizes == [8]
+    assert stats.requests == 1
+    assert stats.saved_tokens > 0
+
+def test_failing_batches_are_split_until_answered(monkeypatch):
+    model = FakeModel(max_batch=3)
+    relevant, stats = classify([make_post(str(index)) for index in range(8)], model,
+                               monkeypatch)
+    assert relevant == ["0", "2", "4", "6"]
+    # 8 fails, both halves of 4 fail, each batch of 2 is answered
+    assert model.batch_sizes == [8, 4, 2, 2, 4, 2, 2]
+    assert stats.requests == 7
+
+def test_missing_posts_are_retried_on_their_own(monkeypatch):
+    model = FakeModel(max_batch=25)
+    relevant, _ = classify([make_post(str(index)) for index in range(3)], model, monkeypatch)
+    assert relevant == ["0", "2"]
+    # The post left out of the answer is asked about alone
+    assert model.batch_sizes == [3, 1]
+
+def test_batches_fit_the_token_budget():
+    posts = [make_post(str(index), body="word " * 200) for index in range(10)]
+    batches = split_into_batches(posts, header_tokens=100, max_batch_tokens=1000)
+    assert [post for batch in batches for post in batch] == posts
+    assert all(len(batch) == 3 for batch in batches[:-1])
+    assert split_into_batches(posts, header_tokens=100, max_batch_tokens=10**6,
+                              max_batch_posts=4)[0] == posts[:4]
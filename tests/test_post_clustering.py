@@ -0,0 +1,26 @@
+from post_clustering import cluster_posts_sync
+from reddit_search import RedditPost
+
+def post(post_id, title, body=""):
+    return RedditPost(id=post_id, title=title, body=body, url=f"https://reddit.com/{post_id}",
+                      num_comments=0, created_utc=0.0)
+
+QUESTION = ("I have been learning Python for three months and can write small scripts,"
+            " but every time I try a real project with a database and a web framework"
+            " I get lost. How did you make the jump from tutorials to building things?")
+
+def test_cross_posts_are_clustered():
+    posts = [post("a", "How to go from Python tutorials to real projects?", QUESTION),
+             post("b", "Python: from tutorials to real projects", QUESTION + " Thanks!"),
+             post("c", "Which mechanical keyboard switches are quietest?",
+                  "My roommate complains about my blue switches, looking for something"
+                  " quiet for typing at night without losing the tactile feel.")]
+    clusters = cluster_posts_sync(posts)
+    assert clusters == {"a": "a", "b": "a", "c": "c"}
+
+def test_short_posts_are_not_clustered():
+    posts = [post("a", "Help please"), post("b", "Help please!"),
+             post("c", "Question"), post("d", "question"),
+             post("e", "Need advice", "Any ideas?"), post("f", "Need advice", "Any ideas??")]
+    clusters = cluster_posts_sync(posts)
+    assert clusters == {post.id: post.id for post in posts}
@@ -0,0 +1,34 @@
+import time
+from post_index import PostIndex
+from post_store import PostBodyStore, with_bodies
+import post_store
+from reddit_search import RedditPost
+
+def post(post_id, body="body"):
+    return RedditPost(id=post_id, title=f"Title {post_id}", body=body,
+                      url=f"https://reddit.com/{post_id}", num_comments=1,
+                      created_utc=time.time())
+
+def make_index(tmp_path, monkeypatch):
+    store = PostBodyStore(str(tmp_path / "bodies.sqlite3"))
+    monkeypatch.setattr(post_store, "_post_body_store", store)
+    return PostIndex(str(tmp_path / "index.sqlite3"), body_store=store), store
+
+def test_bodies_are_kept_in_the_body_store(tmp_path, monkeypatch):
+    index, store = make_index(tmp_path, monkeypatch)
+    index.put_query("all:python:10:None", [post("a", "first body"), post("b", "second body")])
+
+    posts = index.get_fresh_query("all:python:10:None")
+    assert [p.body for p in posts] == [None, None]
+    assert [p.body for p in with_bodies(posts)] == ["first body", "second body"]
+    assert store.get("a") == "first body"
+
+def test_prune_deletes_old_posts_and_their_verdicts(tmp_path, monkeypatch):
+    index, _ = make_index(tmp_path, monkeypatch)
+    index.put_posts([post("old")], fetched_at=time.time() - 100)
+    index.put_posts([post("new")])
+    index.put_verdicts("video", {"old": True, "new": False})
+
+    assert index.prune(50) == 1
+    assert list(index.get_posts(["old", "new"])) == ["new"]
+    assert index.get_verdicts("video", ["old", "new"]) == {"new": False}
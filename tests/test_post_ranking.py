@@ -0,0 +1,64 @@
+import asyncio
+from collections import Counter
+import pytest
+from post_ranking import PostVectorCache, bm25_scores, prefilter_posts, rank_posts_sync, tokenize
+from reddit_search import RedditPost
+
+VIDEO_TITLE = "Python asyncio tutorial"
+VIDEO_DESCRIPTION = "Learn async await, event loops and tasks in Python."
+
+def make_post(post_id, title, body):
+    return RedditPost(id=post_id, title=title, body=body,
+                      url=f"https://www.reddit.com/comments/{post_id}/",
+                      num_comments=0, created_utc=1.0)
+
+POSTS = [
+    make_post("garden", "Tomatoes in my garden", "When should I water them?"),
+    make_post("asyncio", "Confused by asyncio in Python",
+              "How do tasks and the event loop fit together with async await?"),
+    make_post("python", "Python list question", "How do I sort a list in Python?"),
+    make_post("cooking", "Best pasta recipe", "Looking for something quick."),
+]
+
+@pytest.fixture(autouse=True)
+def working_directory(tmp_path, monkeypatch):
+    # The vector cache lives under the relative cache directory
+    monkeypatch.chdir(tmp_path)
+
+def test_tokenize_drops_links_and_stopwords():
+    assert tokenize("The C++ and C# guide: https://example.com/x is here") == \
+        ["c++", "c#", "guide"]
+
+def test_bm25_prefers_rarer_and_more_frequent_terms():
+    documents = [Counter(["python"]), Counter(["python", "asyncio", "asyncio"]),
+                 Counter(["cooking"])]
+    scores = bm25_scores(Counter(["python", "asyncio"]), documents)
+    assert scores[1] > scores[0] > scores[2] == 0
+
+def test_posts_are_ranked_best_first_with_normalized_scores():
+    ranked = rank_posts_sync(POSTS, VIDEO_TITLE, VIDEO_DESCRIPTION)
+    assert [post.id for post, _ in ranked[:2]] == ["asyncio", "python"]
+    assert ranked[0][1] == 1.0
+    assert {post.id for post, score in ranked if score == 0} == {"garden", "cooking"}
+
+def test_prefilter_keeps_the_top_k_above_the_threshold():
+    def prefilter(**kwargs):
+        posts = asyncio.run(prefilter_posts(POSTS, VIDEO_TITLE, VIDEO_DESCRIPTION, **kwargs))
+        return [post.id for post in posts]
+
+    assert prefilter(top_k=1) == ["asyncio"]
+    assert prefilter(threshold=0.01) == ["asyncio", "python"]
+    assert prefilter(top_k=3, threshold=0.01) == ["asyncio", "python"]
+
+def test_cached_vectors_skip_the_post_bodies():
+    cache = PostVectorCache()
+    expected = rank_posts_sync(POSTS, VIDEO_TITLE, VIDEO_DESCRIPTION, cache=cache)
+    # Slim posts whose body is not in the post body store
+    slim = [post._replace(body=None) for post in POSTS]
+    ranked = rank_posts_sync(slim, VIDEO_TITLE, VIDEO_DESCRIPTION, cache=cache)
+    assert [(post.id, score) for post, score in ranked] == \
+        [(post.id, score) for post, score in expected]
+
+def test_unknown_methods_are_rejected():
+    with pytest.raises(ValueError):
+        rank_posts_sync(POSTS, VIDEO_TITLE, VIDEO_DESCRIPTION, method="magic")
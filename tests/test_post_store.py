@@ -0,0 +1,33 @@
+import pytest
+import post_store
+from post_store import PostBodyStore, with_bodies
+from reddit_search import RedditPost
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = PostBodyStore(str(tmp_path / "bodies.sqlite3"))
+    monkeypatch.setattr(post_store, "_post_body_store", store)
+    return store
+
+def slim(post_id):
+    return RedditPost(id=post_id, title="Title", body=None, url="https://reddit.com",
+                      num_comments=0, created_utc=0.0)
+
+def test_touched_bodies_survive_pruning(store, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("post_store.time.time", lambda: now[0])
+    store.put("old", "old body")
+    store.put("used", "used body")
+    store.flush()
+    now[0] = 50.0
+    store.touch(["used"])
+
+    now[0] = 60.0
+    assert store.prune(20) == 1
+    assert store.get_many(["old", "used"]) == {"used": "used body"}
+
+def test_with_bodies_raises_for_a_missing_body(store):
+    store.put("a", "")
+    assert [post.body for post in with_bodies([slim("a")])] == [""]
+    with pytest.raises(RuntimeError, match="missing"):
+        with_bodies([slim("a"), slim("pruned")])
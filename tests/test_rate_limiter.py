@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+import llm_utils
+from benchmarks.mock_openai import MockSettings
+from llm_utils import get_scheduler, request_completion
+from metrics import get_metrics
+from rate_limiter import RateScheduler, parse_duration
+
+@pytest.mark.parametrize("openai_server", [MockSettings(latency=0.05, jitter=0, max_concurrency=2)],
+                         indirect=True)
+def test_rate_limited_requests_back_off_and_succeed(openai_server, monkeypatch):
+    monkeypatch.setenv("OPENAI_MAX_CONCURRENCY", "8")
+
+    async def run():
+        return await asyncio.gather(*(request_completion(f"Write comment {index}")
+                                      for index in range(8)))
+
+    assert len(asyncio.run(run())) == 8
+    scheduler = get_scheduler()
+    assert scheduler.stats.requests == 8
+    assert scheduler.stats.rate_limited > 0
+    assert scheduler.stats.failures == 0
+    # Each 429 halved the concurrency limit
+    assert scheduler.concurrency < 8
+    assert scheduler.stats.retries > 0
+    assert get_metrics().counter_total("llm_retries_total") == scheduler.stats.retries
+
+@pytest.mark.parametrize("openai_server", [MockSettings(latency=0.0, error_rate=1.0)],
+                         indirect=True)
+def test_server_errors_are_retried_until_the_limit(openai_server, monkeypatch):
+    from openai import InternalServerError
+
+    scheduler = RateScheduler(max_retries=2, base_delay=0.01)
+    monkeypatch.setattr(llm_utils, "_scheduler", scheduler)
+    with pytest.raises(InternalServerError):
+        asyncio.run(request_completion("Write a comment"))
+    assert scheduler.stats.retries == 2
+    assert scheduler.stats.failures == 1
+    assert get_metrics().counter_total("llm_failures_total") == 1
+
+def test_requests_over_the_rate_wait_for_the_window():
+    scheduler = RateScheduler(requests_per_minute=2)
+    now = 1000.0
+    assert scheduler._wait_time(now, 0) <= 0
+    scheduler._request_times.extend([now - 50, now - 10])
+    # The oldest request leaves the window in 10 seconds
+    assert scheduler._wait_time(now, 0) == pytest.approx(10)
+
+def test_backoff_waits_at_least_the_retry_after_delay():
+    scheduler = RateScheduler(base_delay=0.01)
+    assert all(scheduler._backoff(attempt, 2.0) >= 2.0 for attempt in range(1, 6))
+
+@pytest.mark.parametrize("value, seconds", [("250ms", 0.25), ("6m0s", 360), ("1.5", 1.5),
+                                            ("soon", None)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
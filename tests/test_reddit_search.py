@@ -0,0 +1,212 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import post_store
+from post_store import PostBodyStore
+import reddit_search
+from reddit_search import iter_posts
+
+class FakeSubreddit:
+    def __init__(self, count, delay):
+        self.count = count
+        self.delay = delay
+
+    async def search(self, keyword, **kwargs):
+        for index in range(self.count):
+            await asyncio.sleep(self.delay)
+            yield SimpleNamespace(id=f"{keyword}{index}", title=keyword, selftext="body",
+                                  url="https://reddit.com", num_comments=0,
+                                  created_utc=1.0, fullname=f"t3_{keyword}{index}")
+
+class FakeReddit:
+    def __init__(self, count, delay):
+        self.count = count
+        self.delay = delay
+
+    async def subreddit(self, name):
+        return FakeSubreddit(self.count, self.delay)
+
+@pytest.fixture(autouse=True)
+def body_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(post_store, "_post_body_store",
+                        PostBodyStore(str(tmp_path / "bodies.sqlite3")))
+
+async def consume(reddit, keywords, timeout, consumer_delay=0.0):
+    posts = []
+    async for post in iter_posts(reddit, keywords, limit_per_keyword=10,
+                                 timeout=timeout, queue_size=1):
+        posts.append(post)
+        await asyncio.sleep(consumer_delay)
+    return posts
+
+def test_slow_consumer_does_not_count_against_the_timeout():
+    # The consumer takes 0.8s in total, far over the timeout, while
+    # Reddit answers within it
+    posts = asyncio.run(consume(FakeReddit(4, 0.001), ["a", "b"], timeout=0.3,
+                                consumer_delay=0.1))
+    assert len(posts) == 8
+
+def test_slow_search_times_out():
+    posts = asyncio.run(consume(FakeReddit(10, 0.05), ["a"], timeout=0.12))
+    assert 0 < len(posts) < 10
+
+def test_shared_search_updates_every_callers_marks():
+    reddit = FakeReddit(3, 0.01)
+    keyword_cache = {}
+    first_marks, second_marks = {}, {}
+
+    async def run():
+        async def search(marks):
+            return [post async for post in iter_posts(reddit, ["a"], keyword_cache=keyword_cache,
+                                                      high_water_marks=marks)]
+        return await asyncio.gather(search(first_marks), search(second_marks))
+
+    first, second = asyncio.run(run())
+    assert len(keyword_cache) == 1
+    assert len(first) == len(second) == 3
+    assert first_marks == second_marks
+    [mark] = first_marks.values()
+    assert mark.fullname == "t3_a0"
+
+class ListingSubreddit:
+    """Serves posts by relevance (oldest first here) or newest, honoring the limit."""
+
+    def __init__(self):
+        self.posts = []
+        self.calls = []
+
+    def publish(self, count):
+        start = len(self.posts)
+        self.posts += [SimpleNamespace(id=f"p{index}", title="t", selftext="body",
+                                       url="https://reddit.com", num_comments=0,
+                                       created_utc=float(index), fullname=f"t3_p{index}")
+                       for index in range(start, start + count)]
+
+    async def search(self, keyword, sort="relevance", limit=None, **kwargs):
+        self.calls.append((sort, limit))
+        posts = self.posts if sort == "relevance" else self.posts[::-1]
+        for post in posts[:limit]:
+            yield post
+
+class ListingReddit:
+    def __init__(self, subreddit):
+        self._subreddit = subreddit
+
+    async def subreddit(self, name):
+        return self._subreddit
+
+def test_incremental_runs_fetch_every_post_since_the_mark():
+    subreddit = ListingSubreddit()
+    reddit = ListingReddit(subreddit)
+    marks = {}
+
+    async def run():
+        return [post.id async for post in iter_posts(reddit, ["a"], limit_per_keyword=10,
+                                                     high_water_marks=marks)]
+
+    subreddit.publish(30)
+    assert len(asyncio.run(run())) == 10
+    # The first run keeps relevance sort, and marks the newest post it saw
+    assert subreddit.calls == [("relevance", 10)]
+    [mark] = marks.values()
+    assert mark.fullname == "t3_p9"
+
+    subreddit.publish(25)
+    new_ids = asyncio.run(run())
+    # Every post newer than the mark, past the limit of 10
+    assert sorted(new_ids) == sorted(f"p{index}" for index in range(10, 55))
+    [mark] = marks.values()
+    assert mark.fullname == "t3_p54"
+
+@pytest.fixture
+def reddit_env(tmp_path, monkeypatch):
+    for name, value in [("REDDIT_CLIENT_ID", "id"), ("REDDIT_CLIENT_SECRET", "secret"),
+                        ("REDDIT_USER_AGENT", "tests"),
+                        ("REDDIT_REDIRECT_URI", "http://localhost:8080")]:
+        monkeypatch.setenv(name, value)
+    monkeypatch.setenv("REDDIT_TOKEN_PATH", str(tmp_path / "token.json"))
+    monkeypatch.delenv("REDDIT_REFRESH_TOKEN", raising=False)
+
+async def fake_oauth_server(valid_token):
+    """Token and identity endpoints of Reddit, accepting one refresh token."""
+    from aiohttp import web
+
+    async def access_token(request):
+        data = await request.post()
+        if data.get("refresh_token") != valid_token:
+            return web.json_response({"error": "invalid_grant"}, status=400)
+        return web.json_response({"access_token": "access", "token_type": "bearer",
+                                  "expires_in": 3600, "scope": "*"})
+
+    async def me(request):
+        return web.json_response({"name": "tester", "id": "1"})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/access_token", access_token)
+    app.router.add_get("/api/v1/me", me)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+def authorize_with(token, calls):
+    async def init_reddit(*args):
+        import asyncpraw
+        calls.append(args)
+        return asyncpraw.Reddit(client_id="id", client_secret="secret", user_agent="tests",
+                                refresh_token=token)
+    return init_reddit
+
+@pytest.mark.parametrize("saved, authorized", [("good", 0), ("revoked", 1)])
+def test_saved_refresh_token_is_reused_unless_revoked(reddit_env, monkeypatch, saved, authorized):
+    calls = []
+    monkeypatch.setattr(reddit_search, "_init_reddit", authorize_with("fresh", calls))
+    reddit_search.save_refresh_token(saved)
+
+    async def run():
+        runner, url = await fake_oauth_server(valid_token="good")
+        monkeypatch.setenv("REDDIT_URL", url)
+        monkeypatch.setenv("REDDIT_OAUTH_URL", url)
+        try:
+            reddit = await reddit_search.get_reddit_instance()
+            await reddit.close()
+        finally:
+            await runner.cleanup()
+        return reddit
+
+    reddit = asyncio.run(run())
+    assert len(calls) == authorized
+    expected = "good" if saved == "good" else "fresh"
+    assert reddit.config.refresh_token == expected
+    assert reddit_search.load_refresh_token() == expected
+
+def test_revoked_environment_token_asks_for_a_new_one(reddit_env, monkeypatch):
+    monkeypatch.setenv("REDDIT_REFRESH_TOKEN", "revoked")
+    monkeypatch.setattr(reddit_search, "_init_reddit", authorize_with("fresh", []))
+
+    async def run():
+        runner, url = await fake_oauth_server(valid_token="good")
+        monkeypatch.setenv("REDDIT_URL", url)
+        monkeypatch.setenv("REDDIT_OAUTH_URL", url)
+        try:
+            await reddit_search.get_reddit_instance()
+        finally:
+            await runner.cleanup()
+
+    with pytest.raises(RuntimeError, match="REDDIT_REFRESH_TOKEN"):
+        asyncio.run(run())
+
+def test_read_only_uses_application_auth_without_a_token(reddit_env, monkeypatch):
+    monkeypatch.delenv("REDDIT_REDIRECT_URI")
+    monkeypatch.setattr(reddit_search, "_init_reddit", authorize_with("fresh", []))
+
+    async def run():
+        reddit = await reddit_search.get_reddit_instance(read_only=True)
+        await reddit.close()
+        return reddit
+
+    reddit = asyncio.run(run())
+    assert reddit.read_only
+    assert reddit_search.load_refresh_token() is None
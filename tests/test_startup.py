@@ -0,0 +1,65 @@
+"""
+Startup budget: importing `outreach` (all `outreach.py --help` needs) stays
+fast and loads no heavy module, and a run fully served from the step cache
+loads no network library. Each check runs in a fresh interpreter.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET = 0.3  # in seconds
+NETWORK_MODULES = {"asyncpraw", "asyncprawcore", "aiohttp", "openai", "httpx", "yt_dlp"}
+HEAVY_MODULES = NETWORK_MODULES | {"numpy", "sentence_transformers", "pyarrow"}
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import outreach
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "modules": sorted(name for name in sys.modules if "." not in name)}))
+"""
+
+# Fills the step cache of a video, then runs the pipeline on it
+CACHED_RUN_SCRIPT = """
+import asyncio, contextlib, io, json, sys
+from cache_utils import CacheStore, get_video_hash
+from reddit_search import RedditPost
+
+video_url = "https://www.youtube.com/watch?v=cachedrun00"
+video_hash = get_video_hash(video_url)
+post = RedditPost(id="abc", title="A post", body="Some text",
+                  url="https://www.reddit.com/comments/abc/", num_comments=1,
+                  created_utc=1.0)
+store = CacheStore(legacy_dir=None)
+store.set_sync(video_hash, "video_details", ("A video", "Its description"))
+store.set_sync(video_hash, "keywords", ["keyword"])
+store.set_sync(video_hash, "filtered_posts", [post])
+store.set_sync(video_hash, "relevant_posts", [post])
+store.set_sync(video_hash, "comments", {"abc": "A comment"})
+
+import outreach
+with contextlib.redirect_stdout(io.StringIO()):
+    asyncio.run(outreach.main_batch([video_url], 1))
+print(json.dumps({"modules": sorted(name for name in sys.modules if "." not in name)}))
+"""
+
+def run_script(script, cwd):
+    environment = {**os.environ, "PYTHONPATH": os.pathsep.join(
+        [REPO_DIR, *filter(None, [os.getenv("PYTHONPATH")])])}
+    result = subprocess.run([sys.executable, "-c", script], cwd=cwd, env=environment,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def test_importing_outreach_is_fast_and_light():
+    # The fastest of a few runs, so a busy machine does not fail the check
+    results = [run_script(IMPORT_SCRIPT, REPO_DIR) for _ in range(3)]
+    assert min(result["seconds"] for result in results) < IMPORT_BUDGET
+    assert not HEAVY_MODULES & set(results[0]["modules"])
+
+def test_cached_run_loads_no_network_library(tmp_path):
+    result = run_script(CACHED_RUN_SCRIPT, str(tmp_path))
+    assert not NETWORK_MODULES & set(result["modules"])
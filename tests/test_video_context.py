@@ -0,0 +1,64 @@
+from video_context import clean_description
+
+TWITTER_CLONE = """In this video we build a Twitter clone with Next.js and Supabase.
+We subscribe to realtime changes so new tweets show up instantly, and add
+likes, follows and a LinkedIn-style profile page.
+
+00:00 Intro
+01:30 Setting up Supabase
+05:10 Subscribing to realtime changes
+12:45 Following other users
+20:00 Deploying to Vercel
+
+Source code: https://github.com/someone/twitter-clone
+Subscribe for more: https://youtube.com/@someone?sub_confirmation=1
+Follow me on Twitter: @someone
+This video is sponsored by Acme Hosting. Use promo code ACME20 for 20% off.
+#nextjs #supabase #webdev
+"""
+
+def test_keeps_content_mentioning_social_networks():
+    cleaned = clean_description(TWITTER_CLONE)
+    assert cleaned.splitlines() == [
+        "In this video we build a Twitter clone with Next.js and Supabase.",
+        "We subscribe to realtime changes so new tweets show up instantly, and add",
+        "likes, follows and a LinkedIn-style profile page.",
+        "Intro",
+        "Setting up Supabase",
+        "Subscribing to realtime changes",
+        "Following other users",
+        "Deploying to Vercel",
+    ]
+
+COOKING = """Learn how to make Neapolitan pizza dough at home, with only four
+ingredients and no special equipment. We also cover how to stretch the dough
+without tearing it and how to bake it in a regular oven.
+
+LINKS
+Recipe: https://example.com/pizza
+My knife: https://amzn.to/abc123
+Get my cookbook here https://example.com/book
+Join our Discord: https://discord.gg/pizza
+
+Support the channel on Patreon: https://patreon.com/chef
+"""
+
+def test_removes_calls_to_action_and_link_labels():
+    cleaned = clean_description(COOKING)
+    assert cleaned.splitlines() == [
+        "Learn how to make Neapolitan pizza dough at home, with only four",
+        "ingredients and no special equipment. We also cover how to stretch the dough",
+        "without tearing it and how to bake it in a regular oven.",
+    ]
+
+def test_keeps_descriptive_lines_with_links():
+    line = "The benchmark compares three runtimes, see the full results at https://example.com/r"
+    assert clean_description(line) == (
+        "The benchmark compares three runtimes, see the full results at")
+
+def test_keeps_email_addresses_and_code_terms():
+    text = "We use code splitting to load the editor lazily.\nContact: team@example.com for questions"
+    assert clean_description(text).splitlines() == [
+        "We use code splitting to load the editor lazily.",
+        "Contact: team@example.com for questions",
+    ]
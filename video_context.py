@@ -0,0 +1,103 @@
+"""
+Compact video context shared by every prompt about a video.
+
+YouTube descriptions are mostly chapter timestamps, links, sponsor blurbs
+and calls to action. They are cleaned up locally, then summarized once per
+video if they are still long, and the result is placed at the start of each
+post-level prompt. The shared part of the prompts is therefore identical
+for every post, so providers can cache it as a prompt prefix.
+"""
+
+import re
+from llm_utils import request_completion, estimate_tokens
+
+# Cleaned descriptions up to this size are used as they are
+SUMMARY_MIN_TOKENS = 150
+SUMMARY_MAX_WORDS = 80
+
+_URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+_HANDLE_PATTERN = re.compile(r"(?<![\w.])@\w{2,}")
+# Chapter time codes, e.g. "00:00", "1:02:03 -"
+_TIMESTAMP_PATTERN = re.compile(r"^\s*\(?\d{1,2}(?::\d{2}){1,2}\)?\s*[-–—:|]?\s*")
+_HASHTAG_LINE_PATTERN = re.compile(r"^\s*(#\w+\s*)+$")
+# Section headings of the parts removed below
+_HEADING_PATTERN = re.compile(
+    r"^\W*(links?|resources|timestamps|chapters|socials?|credits)\W*$", re.IGNORECASE)
+# Labels left once a link is removed, e.g. "Docs:"
+_MAX_LINK_LABEL_WORDS = 3
+# Calls to action, which only advertise when they point at a link or @handle:
+# "Follow me on Twitter: @me", but not "subscribe to realtime changes"
+_CALL_TO_ACTION_PATTERN = re.compile(
+    r"\b(subscribe|follow|join|support|check out|sign up|signup|download|buy|shop"
+    r"|grab|get (my|our|the|your|\d+%)|visit|connect with|find (me|us)|donate"
+    r"|become a (member|patron)|use (my )?(link|code))\b",
+    re.IGNORECASE)
+# Sponsor lines, which advertise even without a link
+_SPONSOR_PATTERN = re.compile(
+    r"\b(sponsored by|(promo|discount|coupon) code)\b",
+    re.IGNORECASE)
+
+def clean_description(description: str) -> str:
+    """
+    Remove the parts of a video description that do not describe the video:
+    links, chapter time codes (the chapter titles are kept), hashtag lines,
+    sponsor lines and calls to action pointing at a link or @handle. Lines
+    that merely mention a social network or a verb like "subscribe" are
+    kept, as they may describe the video.
+
+    :param description: The raw video description.
+    :return: The cleaned description.
+    """
+    lines = []
+    for line in description.splitlines():
+        line = _TIMESTAMP_PATTERN.sub("", line)
+        if (_SPONSOR_PATTERN.search(line) or _HASHTAG_LINE_PATTERN.match(line)
+                or _HEADING_PATTERN.match(line)):
+            continue
+        has_link = bool(_URL_PATTERN.search(line) or _HANDLE_PATTERN.search(line))
+        if has_link and _CALL_TO_ACTION_PATTERN.search(line):
+            continue
+        text = " ".join(_URL_PATTERN.sub(" ", line).split()).strip("-–—:|•* ")
+        if has_link and len(text.split()) <= _MAX_LINK_LABEL_WORDS:
+            continue
+        if text:
+            lines.append(text)
+    return "\n".join(lines)
+
+async def summarize_video(video_title: str, video_description: str) -> str:
+    """
+    Return a compact summary of a video for post-level prompts. Short
+    descriptions are only cleaned up; longer ones are summarized by the LLM.
+
+    :param video_title: Title of the video.
+    :param video_description: Raw description of the video.
+    :return: The summary, possibly empty.
+    """
+    description = clean_description(video_description)
+    if estimate_tokens(description) <= SUMMARY_MIN_TOKENS:
+        return description
+
+    prompt = (f"Summarize what the following YouTube video covers in at most"
+              f" {SUMMARY_MAX_WORDS} words, to decide which online discussions"
+              f" it would help. Keep the topics, tools and intended audience."
+              f" Leave out links, timestamps, sponsors and calls to action.\n\n"
+              f"Title: {video_title}\n"
+              f"<description>\n{description}\n</description>")
+    summary = await request_completion(prompt,
+        ("You are an assistant that writes compact, factual summaries."
+         " Output only the summary."))
+    return summary.strip() or description
+
+def format_video_context(video_title: str, video_summary: str) -> str:
+    """
+    Format the video context placed at the start of post-level prompts. It
+    only depends on the video, so it is the same for every post.
+
+    :param video_title: Title of the video.
+    :param video_summary: The video's summary (see `summarize_video`).
+    :return: The context block.
+    """
+    context = f"<video>\nTitle: {video_title}\n"
+    if video_summary:
+        context += f"Summary: {video_summary}\n"
+    return context + "</video>"
@@ -1,32 +1,230 @@
-import yt_dlp
-from typing import Tuple
+"""
+Utilities to read YouTube video metadata with yt-dlp.
+
+yt-dlp is imported on first use, extraction runs on a small thread pool
+where each thread reuses its own extractor, and the details of every
+resolved video are stored in `cache/videos.sqlite3`, so a known video never
+goes through yt-dlp again.
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from cache_utils import CACHE_DIR, open_database
+
+VIDEO_STORE_PATH = os.path.join(CACHE_DIR, "videos.sqlite3")
+DEFAULT_EXTRACTOR_THREADS = 4
+TITLE_NOT_AVAILABLE = "Title not available"
+DESCRIPTION_NOT_AVAILABLE = "Description not available"
+
+_DETAILS_OPTIONS = {
+    "quiet": True,
+    "no_warnings": True,
+    # Do not download the video
+    "simulate": True,
+    # Skip downloading the video
+    "skip_download": True,
+    # Try to use the generic extractor for speed
+    "force_generic_extractor": True,
+    # Do not extract additional information about formats
+    "extract_flat": True,
+}
+
+_PLAYLIST_OPTIONS = {
+    "quiet": True,
+    "no_warnings": True,
+    "skip_download": True,
+    # Only list the entries, do not resolve each video
+    "extract_flat": "in_playlist",
+}
+
+_VIDEO_ID_PATTERN = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)"
+    r"([A-Za-z0-9_-]{11})")
+
+def get_video_id(video_url: str) -> str:
+    """
+    Return the YouTube ID of a video URL, so the different URL forms of a
+    video share their stored details.
+
+    :param video_url: URL of the YouTube video.
+    :return: The video ID, or the URL itself if it has no recognizable ID.
+    """
+    match = _VIDEO_ID_PATTERN.search(video_url)
+    return match.group(1) if match else video_url
+
+class VideoStore:
+    """SQLite store of video titles and descriptions, keyed on video ID."""
+
+    def __init__(self, path: str = VIDEO_STORE_PATH):
+        """
+        :param path: Path to the SQLite database file.
+        """
+        self.path = path
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with open_database(self.path) as connection:
+            if not self._initialized:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS videos ("
+                    " video_id TEXT PRIMARY KEY,"
+                    " title TEXT NOT NULL,"
+                    " description TEXT NOT NULL,"
+                    " fetched_at REAL NOT NULL)")
+                self._initialized = True
+            yield connection
+
+    def get_many(self, video_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        """
+        Look up stored videos.
+
+        :param video_ids: The video IDs.
+        :return: (title, description) pairs of the stored videos, by video ID.
+        """
+        found = {}
+        with self._connect() as connection:
+            # Stay below SQLite's limit on the number of query parameters
+            for start in range(0, len(video_ids), 500):
+                chunk = video_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    "SELECT video_id, title, description FROM videos"
+                    f" WHERE video_id IN ({placeholders})", chunk)
+                found.update({video_id: (title, description)
+                              for video_id, title, description in rows})
+        return found
+
+    def set(self, video_id: str, title: str, description: str) -> None:
+        """
+        Store the details of a video.
+
+        :param video_id: The video ID.
+        :param title: The video title.
+        :param description: The video description.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO videos (video_id, title, description, fetched_at)"
+                " VALUES (?, ?, ?, ?)", (video_id, title, description, time.time()))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_thread_state = threading.local()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DEFAULT_EXTRACTOR_THREADS,
+                                       thread_name_prefix="yt-dlp")
+    return _executor
+
+def _get_extractor(kind: str, options: dict):
+    """Return this thread's extractor with the given options, creating it once."""
+    extractors = getattr(_thread_state, "extractors", None)
+    if extractors is None:
+        extractors = _thread_state.extractors = {}
+    if kind not in extractors:
+        # Imported on first use, as importing yt-dlp is slow
+        import yt_dlp
+        extractors[kind] = yt_dlp.YoutubeDL(options)
+    return extractors[kind]
 
 def extract_video_details(video_url: str) -> Tuple[str, str]:
     """
-    Extract the title and description of a YouTube video.
+    Extract the title and description of a YouTube video with yt-dlp.
+    Blocking, see `fetch_video_details` for the cached asynchronous version.
 
     :param video_url: URL of the YouTube video.
     :return: A tuple containing the video title and description.
     """
-    ydl_opts = {
-        "quiet": True,
-        "no_warnings": True,
-        # Do not download the video
-        "simulate": True,
-        # Skip downloading the video
-        "skip_download": True,
-        # Try to use the generic extractor for speed
-        "force_generic_extractor": True,
-        # Do not extract additional information about formats
-        "extract_flat": True,
-    }
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(video_url, download=False)
-        title = info.get("title") if info else None
-        description = info.get("description") if info else None
-
-    title = title or "Title not available"
-    description = description or "Description not available"
+    info = _get_extractor("details", _DETAILS_OPTIONS).extract_info(video_url, download=False)
+    title = info.get("title") if info else None
+    description = info.get("description") if info else None
+
+    title = title or TITLE_NOT_AVAILABLE
+    description = description or DESCRIPTION_NOT_AVAILABLE
 
     return title, description
+
+_video_store: Optional[VideoStore] = None
+
+def _get_video_store() -> VideoStore:
+    global _video_store
+    if _video_store is None:
+        _video_store = VideoStore()
+    return _video_store
+
+async def fetch_video_details(video_url: str) -> Tuple[str, str]:
+    """
+    Return the title and description of a YouTube video, from the video
+    store if it was resolved before, otherwise with yt-dlp on the extractor
+    thread pool.
+
+    :param video_url: URL of the YouTube video.
+    :return: A tuple containing the video title and description.
+    """
+    details = await fetch_many_video_details([video_url])
+    return details[video_url]
+
+async def fetch_many_video_details(video_urls: List[str]) -> Dict[str, Tuple[str, str]]:
+    """
+    Resolve the title and description of many videos at once. Stored
+    videos are read in a single query, and the others are extracted
+    concurrently on the extractor thread pool and stored.
+
+    :param video_urls: URLs of the YouTube videos.
+    :return: (title, description) pairs, by video URL.
+    """
+    store = _get_video_store()
+    video_ids = {video_url: get_video_id(video_url) for video_url in video_urls}
+    stored = await asyncio.to_thread(store.get_many, list(set(video_ids.values())))
+
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+
+    async def extract(video_url: str) -> Tuple[str, str]:
+        title, description = await loop.run_in_executor(
+            executor, extract_video_details, video_url)
+        if title != TITLE_NOT_AVAILABLE:
+            # A failed extraction is tried again next time
+            await asyncio.to_thread(store.set, video_ids[video_url], title, description)
+        return title, description
+
+    # One extraction per video, even if it is listed under several URLs
+    pending: Dict[str, asyncio.Future] = {}
+    for video_url, video_id in video_ids.items():
+        if video_id not in stored and video_id not in pending:
+            pending[video_id] = asyncio.ensure_future(extract(video_url))
+    if pending:
+        for video_id, details in zip(pending, await asyncio.gather(*pending.values())):
+            stored[video_id] = details
+
+    return {video_url: stored[video_id] for video_url, video_id in video_ids.items()}
+
+def extract_playlist_urls(playlist_url: str) -> List[str]:
+    """
+    List the video URLs of a YouTube playlist or channel.
+
+    :param playlist_url: URL of the YouTube playlist or channel.
+    :return: A list of video URLs, in playlist order.
+    """
+    info = _get_extractor("playlist", _PLAYLIST_OPTIONS).extract_info(
+        playlist_url, download=False)
+
+    urls = []
+    for entry in (info or {}).get("entries") or []:
+        if not entry:
+            continue
+        url = entry.get("url") or entry.get("webpage_url")
+        if url and url.startswith("http"):
+            urls.append(url)
+        elif entry.get("id"):
+            urls.append(f"https://www.youtube.com/watch?v={entry['id']}")
+    return urls